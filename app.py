@@ -1,23 +1,67 @@
-from flask import Flask, render_template, request, send_file, jsonify, session
+from flask import Flask, Response, redirect, render_template, request, send_file, jsonify, session
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
+import base64
 import os
+import time
 import uuid
 from datetime import datetime
-from templates import VIDEO_TEMPLATES, TEXT_PROMPTS
-from video_generator import generate_video
-from sora_generator import generate_video_with_sora, generate_video_with_image
-from replicate_generator import generate_video_with_replicate
+from templates import TEXT_PROMPTS
+from template_registry import get_template as find_template, all_templates, start_reloader
+import asset_store
+import render_cache
+import metrics
+import retention
+from job_store import get_job
+from batch_render import BatchError, parse_variants, submit_batch, batch_status
+from render_jobs import submit_render, fail_orphaned_renders, RenderQueueFull
+from video_generator import (VIDEO_SIZE, RENDER_PROFILES, DEFAULT_RENDER_PROFILE, OUTPUT_FORMATS,
+                             DEFAULT_OUTPUT_FORMAT, render_keyframes)
+from video_effects import BACKGROUND_STYLES
+from image_ingest import display_image
+from remote_jobs import submit_remote, resume_remote_jobs
+from delivery import send_video
+from upload_stream import StreamingRequest, IMAGE_TYPES, AUDIO_TYPES, upload_kind, spooled_path, store_upload
+from storage import UPLOAD_FOLDER
 import json
 
 app = Flask(__name__)
+# Multipart file parts are streamed to disk as they arrive instead of being buffered
+app.request_class = StreamingRequest
 app.secret_key = os.environ.get("SESSION_SECRET")
-app.config['UPLOAD_FOLDER'] = 'uploads'
+app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024
+app.config['MAX_IMAGE_UPLOAD_SIZE'] = 20 * 1024 * 1024
+app.config['MAX_AUDIO_UPLOAD_SIZE'] = 50 * 1024 * 1024
+app.config['MAX_DATA_UPLOAD_SIZE'] = 5 * 1024 * 1024
 app.config['ALLOWED_IMAGE_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 app.config['ALLOWED_AUDIO_EXTENSIONS'] = {'mp3', 'wav', 'ogg', 'm4a'}
+# Let a front proxy (Apache mod_xsendfile, lighttpd) stream video bodies
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+# Live playback of renders (stream=1). /stream_video holds its worker until the
+# render settles, so only enable this with threaded or async gunicorn workers
+# (e.g. --threads 8 or -k gevent); with sync workers it blocks everyone else.
+app.config['RENDER_STREAMING'] = os.environ.get('RENDER_STREAMING', '').lower() in ('1', 'true', 'yes')
 
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+try:
+    resume_remote_jobs()
+except Exception as e:
+    print(f"Error resuming remote jobs: {str(e)}")
+
+try:
+    fail_orphaned_renders()
+except Exception as e:
+    print(f"Error failing orphaned renders: {str(e)}")
+
+retention.start_collector()
+start_reloader()
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    return jsonify({'error': e.description}), 413
+
 def allowed_file(filename, file_type='image'):
     if '.' not in filename:
         return False
@@ -28,10 +72,58 @@ def allowed_file(filename, file_type='image'):
         return ext in app.config['ALLOWED_AUDIO_EXTENSIONS']
     return False
 
+def image_uploads(template):
+    """The request's usable image uploads, one per template slot at most"""
+    uploads = []
+    for i in range(template.image_slots):
+        file = request.files.get(f'image_{i}')
+        if file and file.filename and allowed_file(file.filename, 'image'):
+            if upload_kind(file) not in IMAGE_TYPES:
+                print(f"Skipping {file.filename}: not a supported image")
+                continue
+            uploads.append(file)
+    return uploads
+
+def store_uploaded_images(template):
+    """
+    Add the request's image uploads to the asset store, one per template slot
+
+    The caller owns a reference on each returned asset; if storing fails
+    part way, the ones already taken are released.
+    """
+    image_assets = []
+    try:
+        for file in image_uploads(template):
+            asset_id = store_upload(file, 'image')
+            if asset_id is None:
+                continue
+            # Decode and downsample once here so renders load a small, upright PNG
+            try:
+                display_image(asset_id, VIDEO_SIZE)
+            except Exception as e:
+                print(f"Error processing image {file.filename}: {e}")
+                asset_store.release(asset_id)
+                continue
+            image_assets.append(asset_id)
+    except Exception:
+        asset_store.release_all(image_assets)
+        raise
+    return image_assets
+
+def store_uploaded_audio():
+    """Add the request's background music to the asset store; returns the asset id or None"""
+    file = request.files.get('background_music')
+    if not (file and file.filename and allowed_file(file.filename, 'audio')):
+        return None
+    if upload_kind(file) not in AUDIO_TYPES:
+        print(f"Skipping {file.filename}: not a supported audio file")
+        return None
+    return store_upload(file, 'audio')
+
 @app.route('/')
 def index():
     return render_template('index.html', 
-                         templates=VIDEO_TEMPLATES, 
+                         templates=all_templates(), 
                          prompts=TEXT_PROMPTS)
 
 @app.route('/settings')
@@ -79,6 +171,11 @@ def get_settings():
         print(f"Error getting settings: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/metrics')
+def metrics_route():
+    """Prometheus scrape endpoint covering every web and render worker process"""
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/static/manifest.json')
 def manifest():
     return send_file('static/manifest.json', mimetype='application/manifest+json')
@@ -89,101 +186,294 @@ def service_worker():
 
 @app.route('/get_template/<int:template_id>')
 def get_template(template_id):
-    template = next((t for t in VIDEO_TEMPLATES if t['id'] == template_id), None)
+    template = find_template(template_id)
     if template:
-        return jsonify(template)
+        return jsonify(template.as_dict())
     return jsonify({'error': 'Template not found'}), 404
 
+def form_flag(name):
+    return request.form.get(name, '').lower() in ('1', 'true', 'on', 'yes')
+
+def is_preview_request():
+    """/generate_video with preview=1, or /preview_video with format=video"""
+    return form_flag('preview') or request.endpoint == 'preview_video_route'
+
+def requested_output_formats():
+    """Formats named by the output_format field(s), comma-separated or repeated, in order"""
+    names = [name.strip() for value in request.form.getlist('output_format') for name in value.split(',')]
+    return list(dict.fromkeys(name for name in names if name)) or [DEFAULT_OUTPUT_FORMAT]
+
 @app.route('/generate_video', methods=['POST'])
 def generate_video_route():
+    # Asset references this request holds until a render job takes them over
+    assets = []
     try:
         template_id_str = request.form.get('template_id')
         if not template_id_str:
             return jsonify({'error': 'Template ID is required'}), 400
 
-        template_id = int(template_id_str)
         selected_prompt = request.form.get('text_prompt', '')
         custom_text = request.form.get('custom_text', '')
         background_color = request.form.get('background_color', '#1e3c72')
+        background_style = request.form.get('background_style') or None
+        if background_style is not None and background_style not in BACKGROUND_STYLES:
+            return jsonify({'error': f'Unknown background style: {background_style}'}), 400
+        render_profile = request.form.get('render_profile', DEFAULT_RENDER_PROFILE)
+        if is_preview_request():
+            render_profile = 'preview'
+        if render_profile not in RENDER_PROFILES:
+            return jsonify({'error': f'Unknown render profile: {render_profile}'}), 400
+        output_formats = requested_output_formats()
+        unknown_formats = [name for name in output_formats if name not in OUTPUT_FORMATS]
+        if unknown_formats:
+            return jsonify({'error': f"Unknown output format: {', '.join(unknown_formats)}"}), 400
 
         # Convert hex color to RGB tuple
         bg_color_hex = background_color.lstrip('#')
         bg_color_rgb = tuple(int(bg_color_hex[i:i+2], 16) for i in (0, 2, 4))
 
-        template = next((t for t in VIDEO_TEMPLATES if t['id'] == template_id), None)
+        template = find_template(template_id_str)
         if not template:
             return jsonify({'error': 'Invalid template selected'}), 400
 
-        uploaded_images = []
-        for i in range(template['image_slots']):
-            file_key = f'image_{i}'
-            if file_key in request.files:
-                file = request.files[file_key]
-                if file and file.filename and allowed_file(file.filename, 'image'):
-                    filename = secure_filename(f"{uuid.uuid4()}_{file.filename}")
-                    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                    file.save(filepath)
-                    uploaded_images.append(filepath)
-
-        audio_file = None
-        if 'background_music' in request.files:
-            file = request.files['background_music']
-            if file and file.filename and allowed_file(file.filename, 'audio'):
-                filename = secure_filename(f"{uuid.uuid4()}_{file.filename}")
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
-                audio_file = filepath
-
-        text_overlays = []
-        for slot in template['text_slots']:
-            text = slot['text']
-            if '[' in text and ']' in text:
-                if custom_text:
-                    placeholder = text[text.find('[')+1:text.find(']')]
-                    text = text.replace(f'[{placeholder}]', custom_text)
-                else:
-                    text = text.replace('[Business Name]', 'Your Business')
-                    text = text.replace('[Product Name]', 'Product')
-                    text = text.replace('[Service Type]', 'Service')
-                    text = text.replace('[Event Name]', 'Event')
-                    text = text.replace('[App Name]', 'App')
-            text_overlays.append({
-                'text': text,
-                'start': slot['start'],
-                'duration': slot['duration']
+        image_assets = store_uploaded_images(template)
+        assets.extend(image_assets)
+
+        audio_asset = store_uploaded_audio()
+        if audio_asset:
+            assets.append(audio_asset)
+
+        text_overlays = template.text_overlays(custom_text)
+
+        # Every format has its own cache entry; the ones not cached or already
+        # rendering elsewhere are rendered together by a single job
+        outputs = {}
+        filenames = {}
+        pending = {}
+        for output_format in output_formats:
+            cache_key = render_cache.render_key(
+                template, text_overlays, image_assets, audio_asset, bg_color_rgb, render_profile,
+                background_style=background_style, output_format=output_format
+            )
+            video_filename = filenames[output_format] = render_cache.cached_filename(cache_key)
+            outputs[output_format] = {'video_url': f'/download_video/{video_filename}', 'job_id': None}
+            if render_cache.lookup(cache_key):
+                continue
+            inflight_job = render_cache.inflight_job(cache_key)
+            if inflight_job:
+                outputs[output_format]['job_id'] = inflight_job['id']
+            else:
+                pending[output_format] = (video_filename, cache_key)
+        primary = outputs[output_formats[0]]
+
+        if not pending and not any(output['job_id'] for output in outputs.values()):
+            session['last_video'] = filenames[output_formats[0]]
+            return jsonify({
+                'success': True,
+                'cached': True,
+                'video_url': primary['video_url'],
+                'outputs': outputs,
+                'message': 'Video generated successfully!'
             })
 
-        video_filename = f"video_{uuid.uuid4()}.mp4"
-        video_path = os.path.join(app.config['UPLOAD_FOLDER'], video_filename)
+        job = None
+        if pending:
+            lead_format = next(iter(pending))
+            lead_filename, lead_key = pending.pop(lead_format)
+            # The job owns the references from here, and releases them itself if it can't be queued
+            render_assets, assets = assets, []
+            try:
+                job = submit_render(
+                    lead_filename,
+                    cache_key=lead_key,
+                    assets=render_assets,
+                    extra_outputs=pending,
+                    template=template,
+                    image_assets=image_assets,
+                    text_overlays=text_overlays,
+                    audio_asset=audio_asset,
+                    output_path=os.path.join(app.config['UPLOAD_FOLDER'], lead_filename),
+                    output_format=lead_format,
+                    background_color=bg_color_rgb,
+                    background_style=background_style,
+                    render_profile=render_profile,
+                    stream=(app.config['RENDER_STREAMING'] and form_flag('stream')
+                            and lead_format == output_formats[0])
+                )
+            except RenderQueueFull as e:
+                return jsonify({'error': str(e)}), 503
+            for output_format in [lead_format, *pending]:
+                outputs[output_format]['job_id'] = job['id']
+        # Report the job producing the first requested format, or, when that
+        # one is cached, a job still rendering another; video_url always
+        # stays the first format's
+        job_id = primary['job_id'] or next(output['job_id'] for output in outputs.values() if output['job_id'])
+        if job is None or job['id'] != job_id:
+            job = get_job(job_id)
+
+        session['last_video'] = filenames[output_formats[0]]
+
+        response = {
+            'success': True,
+            'job_id': job['id'],
+            'status_url': f"/jobs/{job['id']}",
+            'video_url': primary['video_url'],
+            'outputs': outputs,
+            'message': 'Video render queued'
+        }
+        if job.get('stream_path') and job.get('video_filename') == filenames[output_formats[0]]:
+            response['stream_url'] = f"/stream_video/{job['id']}"
+        return jsonify(response), 202
+
+    except RequestEntityTooLarge:
+        raise
+    except Exception as e:
+        print(f"Error generating video: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        # Nothing rendering needs them: identical renders exist or are in
+        # progress, or the request failed before queuing
+        asset_store.release_all(assets)
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({
+        'job_id': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'progress': job['progress'],
+        'error': job['error'],
+        'result': job['result']
+    })
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    job = get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] == 'failed':
+        return jsonify({'error': job['error'] or 'Job failed'}), 500
+    if job['status'] != 'done':
+        return jsonify({'status': job['status'], 'progress': job['progress']}), 409
+    return jsonify({'success': True, **job['result']})
+
+@app.route('/batch_render', methods=['POST'])
+def batch_render_route():
+    """
+    Render one template for many variants sharing the same uploads
+
+    Takes the /generate_video form fields as defaults plus 'variants', a
+    CSV (with header) or JSONL file or text field with one row per video.
+    """
+    image_assets = []
+    audio_asset = None
+    try:
+        template = find_template(request.form.get('template_id'))
+        if not template:
+            return jsonify({'error': 'Invalid template selected'}), 400
 
-        generate_video(
-            template=template,
-            images=uploaded_images,
-            text_overlays=text_overlays,
-            audio_file=audio_file,
-            output_path=video_path,
-            background_color=bg_color_rgb
-        )
+        variants_file = request.files.get('variants')
+        if variants_file and variants_file.filename:
+            variants_text = variants_file.read().decode('utf-8-sig')
+            variants_name = variants_file.filename
+        else:
+            variants_text = request.form.get('variants', '')
+            variants_name = ''
+        variants = parse_variants(variants_text, variants_name)
 
-        session['last_video'] = video_filename
+        defaults = {
+            field: request.form[field]
+            for field in ('custom_text', 'background_color', 'background_style', 'render_profile', 'output_format')
+            if request.form.get(field)
+        }
+
+        image_assets = store_uploaded_images(template)
+        audio_asset = store_uploaded_audio()
 
+        batch = submit_batch(template, variants, image_assets, audio_asset, defaults=defaults)
         return jsonify({
             'success': True,
-            'video_url': f'/download_video/{video_filename}',
-            'message': 'Video generated successfully!'
-        })
-
+            'batch_id': batch['id'],
+            'total': len(batch['variants']),
+            'status_url': f"/batches/{batch['id']}",
+            'message': 'Batch render queued'
+        }), 202
+
+    except BatchError as e:
+        return jsonify({'error': str(e)}), 400
+    except RenderQueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
-        print(f"Error generating video: {str(e)}")
+        print(f"Error queuing batch render: {str(e)}")
         return jsonify({'error': str(e)}), 500
+    finally:
+        # Each queued render task holds its own references
+        asset_store.release_all(image_assets + [audio_asset])
+
+@app.route('/batches/<batch_id>')
+def batch_status_route(batch_id):
+    batch = get_job(batch_id)
+    if not batch or batch['kind'] != 'batch':
+        return jsonify({'error': 'Batch not found'}), 404
+    return jsonify({'batch_id': batch['id'], **batch_status(batch)})
+
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_POLL_INTERVAL = 0.2
+
+@app.route('/stream_video/<job_id>')
+def stream_video(job_id):
+    """
+    Play a render while it is still encoding
+
+    Tails the job's fragmented MP4 as ffmpeg appends fragments, ending once
+    the job settles. Finished renders redirect to the regular, seekable file.
+    Only used when RENDER_STREAMING is on, since the tail holds this worker
+    for the length of the render.
+    """
+    job = get_job(job_id)
+    if not job or job['kind'] != 'render':
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] == 'done':
+        return redirect(f"/preview_video/{job['video_filename']}")
+    if not job.get('stream_path'):
+        return jsonify({'error': 'This render is not being streamed'}), 404
+
+    path = job['stream_path']
+
+    def generate():
+        # Wait for the worker to start encoding
+        while not os.path.exists(path):
+            current = get_job(job_id)
+            if current is None or current['status'] in ('done', 'failed'):
+                return
+            time.sleep(STREAM_POLL_INTERVAL)
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(STREAM_CHUNK_SIZE)
+                if chunk:
+                    yield chunk
+                    continue
+                current = get_job(job_id)
+                if current is None or current['status'] in ('done', 'failed'):
+                    # The encoder has exited; send whatever it wrote last
+                    rest = f.read()
+                    if rest:
+                        yield rest
+                    return
+                time.sleep(STREAM_POLL_INTERVAL)
+
+    return Response(generate(), mimetype='video/mp4', headers={'Cache-Control': 'no-store'})
 
 @app.route('/download_video/<filename>')
 def download_video(filename):
     try:
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(filename))
-        if os.path.exists(filepath):
-            return send_file(filepath, as_attachment=True, download_name=filename)
-        return "Video not found", 404
+        return send_video(filepath, as_attachment=True, download_name=filename)
     except Exception as e:
         return str(e), 500
 
@@ -191,12 +481,71 @@ def download_video(filename):
 def preview_video(filename):
     try:
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(filename))
-        if os.path.exists(filepath):
-            return send_file(filepath, mimetype='video/mp4')
-        return "Video not found", 404
+        return send_video(filepath)
     except Exception as e:
         return str(e), 500
 
+@app.route('/preview_video', methods=['POST'])
+def preview_video_route():
+    """
+    Quick preview of a template render
+
+    By default returns a strip of JPEG keyframes rendered synchronously from
+    the template timeline. With format=video, queues a low resolution,
+    low frame rate render exactly like /generate_video with preview=1.
+    """
+    if request.form.get('format') == 'video':
+        return generate_video_route()
+
+    try:
+        template_id_str = request.form.get('template_id')
+        if not template_id_str:
+            return jsonify({'error': 'Template ID is required'}), 400
+
+        template = find_template(template_id_str)
+        if not template:
+            return jsonify({'error': 'Invalid template selected'}), 400
+
+        custom_text = request.form.get('custom_text', '')
+        background_color = request.form.get('background_color', '#1e3c72')
+        background_style = request.form.get('background_style') or None
+        if background_style is not None and background_style not in BACKGROUND_STYLES:
+            return jsonify({'error': f'Unknown background style: {background_style}'}), 400
+        # Keyframes show the first requested format's framing
+        output_format = requested_output_formats()[0]
+        if output_format not in OUTPUT_FORMATS:
+            return jsonify({'error': f'Unknown output format: {output_format}'}), 400
+
+        bg_color_hex = background_color.lstrip('#')
+        bg_color_rgb = tuple(int(bg_color_hex[i:i+2], 16) for i in (0, 2, 4))
+
+        # Preview uploads are throwaway (the final render uploads again), so
+        # they are decoded straight from the request's spool at preview size
+        # and never enter the asset store
+        image_files = [path for path in map(spooled_path, image_uploads(template)) if path]
+        keyframes = render_keyframes(
+            template,
+            image_files,
+            template.text_overlays(custom_text),
+            background_color=bg_color_rgb,
+            background_style=background_style,
+            output_format=output_format
+        )
+
+        return jsonify({
+            'success': True,
+            'frames': [{
+                'time': frame['time'],
+                'image': 'data:image/jpeg;base64,' + base64.b64encode(frame['jpeg']).decode('ascii')
+            } for frame in keyframes]
+        })
+
+    except RequestEntityTooLarge:
+        raise
+    except Exception as e:
+        print(f"Error generating preview: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/generate_sora_video', methods=['POST'])
 def generate_sora_video_route():
     """Generate video using OpenAI Sora or Replicate API"""
@@ -237,36 +586,24 @@ def generate_sora_video_route():
         print(f"Session OpenAI key present: {bool(session_openai_key)}")
         print(f"Session Replicate key present: {bool(session_replicate_key)}")
 
-        # Text-to-video generation (no image)
-        if api_provider == 'replicate':
-            result = generate_video_with_replicate(
-                prompt=prompt,
-                duration=duration,
-                size=size,
-                output_path=video_path,
-                session_api_key=session_replicate_key
-            )
-        else:
-            result = generate_video_with_sora(
-                prompt=prompt,
-                duration=duration,
-                size=size,
-                output_path=video_path,
-                session_api_key=session_openai_key
-            )
+        # Text-to-video generation (no image), tracked by the background poller
+        job = submit_remote(
+            provider='replicate' if api_provider == 'replicate' else 'sora',
+            prompt=prompt,
+            duration=duration,
+            size=size,
+            output_path=video_path,
+            session_api_key=session_replicate_key if api_provider == 'replicate' else session_openai_key
+        )
 
-        if result.get('success'):
-            session['last_video'] = video_filename
-            return jsonify({
-                'success': True,
-                'video_url': f'/download_video/{video_filename}',
-                'video_id': result.get('video_id', ''),
-                'message': f'{api_provider.capitalize()} video generated successfully!'
-            }), 200
-        else:
-            error_msg = result.get('error', 'Unknown error occurred')
-            print(f"Video generation failed: {error_msg}")
-            return jsonify({'error': error_msg}), 400
+        session['last_video'] = video_filename
+        return jsonify({
+            'success': True,
+            'job_id': job['id'],
+            'status_url': f"/jobs/{job['id']}",
+            'video_url': f'/download_video/{video_filename}',
+            'message': f'{api_provider.capitalize()} video generation started'
+        }), 202
 
     except Exception as e:
         error_msg = str(e)
@@ -0,0 +1,236 @@
+import contextlib
+import fcntl
+import json
+import os
+import time
+
+from storage import UPLOAD_FOLDER
+
+ASSETS_FOLDER = os.path.join(UPLOAD_FOLDER, 'assets')
+
+ASSET_KINDS = ('image', 'audio')
+
+
+class AssetNotFound(Exception):
+    pass
+
+
+def is_asset_id(asset_id):
+    return (isinstance(asset_id, str) and len(asset_id) == 64
+            and all(c in '0123456789abcdef' for c in asset_id))
+
+
+def _shard_folder(asset_id):
+    # Two levels of 256 folders keep every directory small however many
+    # assets accumulate
+    return os.path.join(ASSETS_FOLDER, asset_id[:2], asset_id[2:4])
+
+
+def asset_path(asset_id):
+    """Path of the stored original for asset_id"""
+    if not is_asset_id(asset_id):
+        raise AssetNotFound(f'Invalid asset id: {asset_id!r}')
+    return os.path.join(_shard_folder(asset_id), asset_id)
+
+
+def derived_path(asset_id, name):
+    """Path for a file derived from the asset (e.g. a resized image), removed along with it"""
+    return f"{asset_path(asset_id)}.{name}"
+
+
+def _meta_path(asset_id):
+    return derived_path(asset_id, 'json')
+
+
+def _read_meta(asset_id):
+    try:
+        with open(_meta_path(asset_id)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _write_meta(meta):
+    path = _meta_path(meta['id'])
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(temp_path, path)
+
+
+@contextlib.contextmanager
+def _locked(asset_id):
+    """Hold the shard's lock, serializing refcount changes across processes"""
+    folder = _shard_folder(asset_id)
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, '.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def put(src_path, asset_id, kind):
+    """
+    Add a file to the store under its content digest and take a reference
+
+    If the content is already stored the new copy is simply deleted, so
+    each distinct upload occupies disk once however often it is sent.
+
+    Args:
+        src_path: File to move into the store (consumed either way)
+        asset_id: SHA-256 hex digest of the file's contents
+        kind: 'image' or 'audio'
+
+    Returns:
+        asset_id
+    """
+    if kind not in ASSET_KINDS:
+        raise ValueError(f'Unknown asset kind: {kind}')
+    path = asset_path(asset_id)
+    with _locked(asset_id):
+        meta = _read_meta(asset_id)
+        if meta is None or not os.path.exists(path):
+            os.replace(src_path, path)
+            meta = {
+                'id': asset_id,
+                'kind': kind,
+                'size': os.path.getsize(path),
+                'refs': 0,
+                'created_at': time.time(),
+            }
+        else:
+            os.remove(src_path)
+        meta['refs'] += 1
+        meta['last_used'] = time.time()
+        _write_meta(meta)
+    return asset_id
+
+
+def get_asset(asset_id):
+    """Return the asset's metadata record, or None if it is not stored"""
+    if not is_asset_id(asset_id):
+        return None
+    return _read_meta(asset_id)
+
+
+def resolve(asset_id):
+    """
+    Path of a stored asset
+
+    Raises:
+        AssetNotFound: if the asset is not in the store
+    """
+    path = asset_path(asset_id)
+    if not os.path.exists(path):
+        raise AssetNotFound(f'Asset not found: {asset_id}')
+    return path
+
+
+def acquire(asset_id):
+    """Take another reference on a stored asset"""
+    with _locked(asset_id):
+        meta = _read_meta(asset_id)
+        if meta is None:
+            raise AssetNotFound(f'Asset not found: {asset_id}')
+        meta['refs'] += 1
+        meta['last_used'] = time.time()
+        _write_meta(meta)
+
+
+def _remove_files(asset_id):
+    folder = _shard_folder(asset_id)
+    with os.scandir(folder) as it:
+        for entry in it:
+            if entry.name == asset_id or entry.name.startswith(f"{asset_id}."):
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+
+def release(asset_id):
+    """
+    Drop a reference
+
+    Unreferenced assets stay on disk so a repeat upload reuses them (and
+    their derived files); the retention collector removes them once idle.
+    """
+    with _locked(asset_id):
+        meta = _read_meta(asset_id)
+        if meta is None:
+            return
+        meta['refs'] = max(meta['refs'] - 1, 0)
+        meta['last_used'] = time.time()
+        _write_meta(meta)
+
+
+def iter_assets():
+    """Yield the metadata record of every stored asset"""
+    try:
+        outer = os.listdir(ASSETS_FOLDER)
+    except FileNotFoundError:
+        return
+    for first in outer:
+        try:
+            inner = os.listdir(os.path.join(ASSETS_FOLDER, first))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        for second in inner:
+            try:
+                names = os.listdir(os.path.join(ASSETS_FOLDER, first, second))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            for name in names:
+                if name.endswith('.json') and is_asset_id(name[:-len('.json')]):
+                    meta = _read_meta(name[:-len('.json')])
+                    if meta is not None:
+                        yield meta
+
+
+def disk_usage(asset_id):
+    """Bytes used by the asset and its derived files"""
+    total = 0
+    with os.scandir(_shard_folder(asset_id)) as it:
+        for entry in it:
+            if entry.name == asset_id or entry.name.startswith(f"{asset_id}."):
+                try:
+                    total += entry.stat().st_size
+                except FileNotFoundError:
+                    pass
+    return total
+
+
+def remove_unreferenced(asset_id, idle_before=None, stale_before=None):
+    """
+    Delete an asset and its derived files if nothing references it
+
+    Args:
+        asset_id: Asset to remove
+        idle_before: Only remove it if it was last used before this time
+        stale_before: Treat references untouched since this time as leaked
+            (e.g. by a web worker killed mid-request) and ignore them
+
+    Returns:
+        Bytes freed (0 if the asset was kept)
+    """
+    with _locked(asset_id):
+        meta = _read_meta(asset_id)
+        if meta is None:
+            return 0
+        last_used = meta.get('last_used', meta['created_at'])
+        if meta['refs'] > 0 and (stale_before is None or last_used >= stale_before):
+            return 0
+        if idle_before is not None and last_used >= idle_before:
+            return 0
+        freed = disk_usage(asset_id)
+        _remove_files(asset_id)
+    return freed
+
+
+def release_all(asset_ids):
+    for asset_id in asset_ids:
+        if not asset_id:
+            continue
+        try:
+            release(asset_id)
+        except Exception as e:
+            print(f"Error releasing asset {asset_id}: {e}")
@@ -0,0 +1,72 @@
+import os
+import subprocess
+
+from moviepy.config import FFMPEG_BINARY
+
+from render_cache import file_digest
+from storage import UPLOAD_FOLDER
+
+AUDIO_CACHE_FOLDER = os.path.join(UPLOAD_FOLDER, 'audio_cache')
+
+# Every prepared track has the same layout, so it can be stream-copied into
+# any render without re-encoding.
+AUDIO_SAMPLE_RATE = 48000
+AUDIO_CHANNELS = 2
+AUDIO_BITRATE = '160k'
+AUDIO_LOUDNESS_FILTER = 'loudnorm=I=-16:TP=-1.5:LRA=11'
+
+
+class AudioPrepError(Exception):
+    pass
+
+
+def prepared_audio_path(digest):
+    return os.path.join(AUDIO_CACHE_FOLDER, f"{digest}.m4a")
+
+
+def prepare_audio(audio_file, digest=None):
+    """
+    Normalize an uploaded track once into a cached AAC asset
+
+    The track is resampled, loudness-normalized and encoded to AAC by ffmpeg.
+    The result is keyed by the upload's content digest, so repeat renders
+    with the same music reuse it and only ever stream-copy the audio.
+
+    Args:
+        audio_file: Path to the uploaded audio file
+        digest: The file's content digest, if already known
+
+    Returns:
+        Path to the prepared .m4a file
+
+    Raises:
+        AudioPrepError: if ffmpeg cannot decode the upload
+    """
+    digest = digest or file_digest(audio_file)
+    prepared_path = prepared_audio_path(digest)
+    if os.path.exists(prepared_path):
+        os.utime(prepared_path)
+        return prepared_path
+
+    os.makedirs(AUDIO_CACHE_FOLDER, exist_ok=True)
+    partial_path = os.path.join(AUDIO_CACHE_FOLDER, f".{os.getpid()}.{digest}.m4a")
+    cmd = [
+        FFMPEG_BINARY, '-y', '-loglevel', 'error',
+        '-i', audio_file,
+        '-vn', '-map', '0:a:0',
+        '-af', AUDIO_LOUDNESS_FILTER,
+        '-ar', str(AUDIO_SAMPLE_RATE), '-ac', str(AUDIO_CHANNELS),
+        '-c:a', 'aac', '-b:a', AUDIO_BITRATE,
+        '-movflags', '+faststart',
+        partial_path,
+    ]
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            raise AudioPrepError(result.stderr.decode('utf-8', 'replace').strip()
+                                 or 'ffmpeg could not decode the audio file')
+        os.replace(partial_path, prepared_path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    return prepared_path
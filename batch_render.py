@@ -0,0 +1,292 @@
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+
+import asset_store
+import render_cache
+from job_store import create_job, get_job, list_jobs, update_job
+from render_jobs import submit_render_many
+from storage import UPLOAD_FOLDER
+from video_effects import BACKGROUND_STYLES
+from video_generator import RENDER_PROFILES, DEFAULT_RENDER_PROFILE, OUTPUT_FORMATS, DEFAULT_OUTPUT_FORMAT
+
+# Cap on variants per batch; bigger runs should be split client-side
+BATCH_MAX_VARIANTS = int(os.environ.get('BATCH_MAX_VARIANTS', 5000))
+
+VARIANT_FIELDS = ('name', 'custom_text', 'background_color', 'background_style', 'render_profile', 'output_format')
+
+
+class BatchError(ValueError):
+    pass
+
+
+def hex_to_rgb(value):
+    """'#1e3c72' -> (30, 60, 114)"""
+    value = value.lstrip('#')
+    if len(value) != 6:
+        raise ValueError(f'Invalid color: {value!r}')
+    return tuple(int(value[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def parse_variants(text, filename=''):
+    """
+    Parse variant parameters from CSV (with a header row) or JSONL
+
+    JSONL is assumed when the filename ends in .jsonl/.ndjson or the first
+    non-blank character is '{'. Recognised columns are VARIANT_FIELDS;
+    anything else is ignored.
+
+    Returns:
+        list of dicts
+
+    Raises:
+        BatchError: on malformed input, naming the offending line
+    """
+    stripped = text.lstrip()
+    if filename.endswith(('.jsonl', '.ndjson')) or stripped.startswith('{'):
+        variants = []
+        for line_number, line in enumerate(text.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                variant = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise BatchError(f'Line {line_number}: {e}') from e
+            if not isinstance(variant, dict):
+                raise BatchError(f'Line {line_number}: expected a JSON object')
+            variants.append(variant)
+    else:
+        variants = list(csv.DictReader(io.StringIO(text)))
+
+    if not variants:
+        raise BatchError('No variants given')
+    if len(variants) > BATCH_MAX_VARIANTS:
+        raise BatchError(f'At most {BATCH_MAX_VARIANTS} variants per batch')
+    return [{field: variant[field] for field in VARIANT_FIELDS if variant.get(field) not in (None, '')}
+            for variant in variants]
+
+
+def _variant_settings(variant, defaults, number):
+    settings = dict(defaults)
+    settings.update(variant)
+    try:
+        color = hex_to_rgb(settings.get('background_color', '#1e3c72'))
+    except ValueError as e:
+        raise BatchError(f'Variant {number}: {e}') from e
+    style = settings.get('background_style') or None
+    if style is not None and style not in BACKGROUND_STYLES:
+        raise BatchError(f'Variant {number}: unknown background style {style!r}')
+    profile = settings.get('render_profile', DEFAULT_RENDER_PROFILE)
+    if profile not in RENDER_PROFILES:
+        raise BatchError(f'Variant {number}: unknown render profile {profile!r}')
+    output_format = settings.get('output_format', DEFAULT_OUTPUT_FORMAT)
+    if output_format not in OUTPUT_FORMATS:
+        raise BatchError(f'Variant {number}: unknown output format {output_format!r}')
+    return str(settings.get('custom_text', '')), color, style, profile, output_format
+
+
+def submit_batch(template, variants, image_assets=(), audio_asset=None, defaults=None):
+    """
+    Queue one render per variant of a template
+
+    Variants whose render is already cached, or already being rendered,
+    reuse it; the rest are packed onto the render pool by
+    render_jobs.submit_render_many. The caller keeps its own references
+    on image_assets/audio_asset; the render tasks take theirs.
+
+    Args:
+        template: CompiledTemplate
+        variants: list of dicts from parse_variants
+        image_assets: Asset ids shared by every variant, one per image slot
+        audio_asset: Asset id of the shared background music, or None
+        defaults: Variant settings used where a variant leaves them out
+
+    Returns:
+        dict with the batch job record
+
+    Raises:
+        BatchError: if a variant is invalid (nothing is queued)
+        render_jobs.RenderQueueFull: if the pool cannot take the batch
+    """
+    defaults = defaults or {}
+    image_assets = list(image_assets)
+    entries = []
+    renders = []
+    seen = {}
+    for number, variant in enumerate(variants, 1):
+        custom_text, color, style, profile, output_format = _variant_settings(variant, defaults, number)
+        text_overlays = template.text_overlays(custom_text)
+        cache_key = render_cache.render_key(
+            template, text_overlays, image_assets, audio_asset, color, profile,
+            background_style=style, output_format=output_format
+        )
+        video_filename = render_cache.cached_filename(cache_key)
+        entry = {'name': variant.get('name') or str(number), 'video_filename': video_filename, 'job_id': None}
+        entries.append(entry)
+
+        if render_cache.lookup(cache_key):
+            continue
+        if cache_key in seen:
+            # Duplicate rows render once
+            seen[cache_key].append(entry)
+            continue
+        inflight = render_cache.inflight_job(cache_key)
+        if inflight:
+            entry['job_id'] = inflight['id']
+            continue
+        seen[cache_key] = [entry]
+        renders.append((video_filename, cache_key, dict(
+            template=template,
+            image_assets=image_assets,
+            text_overlays=text_overlays,
+            audio_asset=audio_asset,
+            output_path=os.path.join(UPLOAD_FOLDER, video_filename),
+            background_color=color,
+            background_style=style,
+            render_profile=profile,
+            output_format=output_format,
+        )))
+
+    assets = image_assets + ([audio_asset] if audio_asset else [])
+    jobs = submit_render_many(renders, assets=assets)
+    for (_, cache_key, _), job in zip(renders, jobs):
+        for entry in seen[cache_key]:
+            entry['job_id'] = job['id']
+
+    print(f"Batch of {len(entries)} variants for template {template.id}: {len(jobs)} renders queued")
+    if not any(entry['job_id'] for entry in entries):
+        # Every variant was already rendered
+        return create_job('batch', template_id=template.id, variants=entries, status='done', progress=1.0)
+    return create_job('batch', template_id=template.id, variants=entries)
+
+
+def batch_status(batch):
+    """
+    Summarize a batch job record from its variants' render jobs
+
+    Only reads; the record's own status is settled by settle_batches.
+
+    Returns:
+        dict with overall 'status', per-status 'counts' and 'variants'
+    """
+    variants = []
+    counts = {'queued': 0, 'running': 0, 'done': 0, 'failed': 0}
+    jobs = {}
+    for entry in batch['variants']:
+        job_id = entry['job_id']
+        if job_id and job_id not in jobs:
+            jobs[job_id] = get_job(job_id)
+        job = jobs.get(job_id)
+        if job_id is None:
+            status, error = 'done', None
+        elif job is None:
+            # The record ages out before the video does
+            if os.path.exists(os.path.join(UPLOAD_FOLDER, entry['video_filename'])):
+                status, error = 'done', None
+            else:
+                status, error = 'failed', 'Job record expired'
+        else:
+            status, error = job['status'], job['error']
+        counts[status] += 1
+        variants.append({
+            'name': entry['name'],
+            'status': status,
+            'error': error,
+            'job_id': job_id,
+            'video_url': f"/download_video/{entry['video_filename']}" if status == 'done' else None,
+        })
+
+    if counts['queued'] or counts['running']:
+        status = 'running' if counts['running'] or counts['done'] or counts['failed'] else 'queued'
+    else:
+        status = 'failed' if counts['failed'] == len(variants) else 'done'
+    return {'status': status, 'total': len(variants), 'counts': counts, 'variants': variants}
+
+
+def settle_batches():
+    """
+    Mark batch records whose variants have all finished as done or failed
+
+    Run by the retention collector before it expires finished jobs, so a
+    batch ages out like any other job whether or not anyone polls it.
+
+    Returns:
+        Number of batches settled
+    """
+    settled = 0
+    for batch in list_jobs(kind='batch', statuses=('queued', 'running')):
+        status = batch_status(batch)['status']
+        if status in ('done', 'failed'):
+            update_job(batch['id'], status=status, progress=1.0)
+            settled += 1
+    return settled
+
+
+def _store_file(path, kind):
+    """Copy a local file into the asset store (CLI use)"""
+    from upload_stream import INCOMING_FOLDER
+    import shutil
+    import uuid
+    os.makedirs(INCOMING_FOLDER, exist_ok=True)
+    temp_path = os.path.join(INCOMING_FOLDER, f".cli_{uuid.uuid4().hex}")
+    shutil.copyfile(path, temp_path)
+    return asset_store.put(temp_path, render_cache.file_digest(temp_path), kind)
+
+
+def main(argv=None):
+    from image_ingest import display_image
+    from template_registry import get_template
+    from video_generator import VIDEO_SIZE
+
+    parser = argparse.ArgumentParser(description='Render one template for every row of a CSV or JSONL file')
+    parser.add_argument('template_id', type=int)
+    parser.add_argument('variants', help='CSV (with header) or JSONL file of variant parameters')
+    parser.add_argument('--image', action='append', default=[], help='Image for the next image slot')
+    parser.add_argument('--audio', help='Background music shared by every variant')
+    parser.add_argument('--profile', default=DEFAULT_RENDER_PROFILE, choices=sorted(RENDER_PROFILES))
+    parser.add_argument('--background-color', default='#1e3c72')
+    parser.add_argument('--background-style', choices=BACKGROUND_STYLES)
+    parser.add_argument('--output-format', default=DEFAULT_OUTPUT_FORMAT, choices=sorted(OUTPUT_FORMATS))
+    args = parser.parse_args(argv)
+
+    template = get_template(args.template_id)
+    if template is None:
+        parser.error(f'Unknown template {args.template_id}')
+    # utf-8-sig, like the upload route, so a spreadsheet's BOM doesn't rename the first column
+    with open(args.variants, encoding='utf-8-sig') as f:
+        variants = parse_variants(f.read(), args.variants)
+
+    image_assets = [_store_file(path, 'image') for path in args.image[:template.image_slots]]
+    for asset_id in image_assets:
+        display_image(asset_id, VIDEO_SIZE)
+    audio_asset = _store_file(args.audio, 'audio') if args.audio else None
+    defaults = {'render_profile': args.profile, 'background_color': args.background_color,
+                'output_format': args.output_format}
+    if args.background_style:
+        defaults['background_style'] = args.background_style
+
+    started = time.time()
+    try:
+        batch = submit_batch(template, variants, image_assets, audio_asset, defaults=defaults)
+        while True:
+            summary = batch_status(get_job(batch['id']))
+            print(f"\r{summary['counts']['done']}/{summary['total']} done, "
+                  f"{summary['counts']['failed']} failed", end='', flush=True)
+            if summary['status'] in ('done', 'failed'):
+                break
+            time.sleep(1)
+    finally:
+        asset_store.release_all(image_assets + ([audio_asset] if audio_asset else []))
+    print(f"\nFinished in {time.time() - started:.1f}s")
+    for variant in summary['variants']:
+        location = os.path.join(UPLOAD_FOLDER, os.path.basename(variant['video_url'])) if variant['video_url'] else variant['error']
+        print(f"{variant['name']}\t{variant['status']}\t{location}")
+    return 0 if summary['counts']['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,363 @@
+"""
+Benchmark the template render pipeline
+
+Renders every catalog template with synthetic images at several resolutions
+and a synthetic music track, and writes the measurements to a JSON file
+named after the commit, so runs can be compared across commits:
+
+    python benchmark_render.py --profile fast --repeat 3
+    python benchmark_render.py --compare benchmark_results/a.json benchmark_results/b.json
+
+Inputs are generated from a fixed seed, so every run renders the same
+bytes. Each run starts cold: it gets a fresh uploads/ tree (asset store,
+derived images, prepared audio) in a temporary directory and empty
+in-process caches, unless --warm is given.
+"""
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+from PIL import Image
+
+import asset_store
+import metrics
+import video_effects
+import video_generator
+from render_cache import file_digest
+from storage import UPLOAD_FOLDER
+from template_registry import all_templates
+from video_generator import (RENDER_PROFILES, OUTPUT_FORMATS, DEFAULT_OUTPUT_FORMAT, generate_video,
+                             profile_fps, profile_video_size)
+
+RESULTS_FOLDER = 'benchmark_results'
+DEFAULT_IMAGE_SIZES = ('640x480', '1920x1080', '4032x3024')
+BENCHMARK_SEED = 1234
+AUDIO_SECONDS = 30
+AUDIO_SAMPLE_RATE = 44100
+
+# Medians reported per case and compared by --compare; lower is better for all
+SUMMARY_FIELDS = ('wall_seconds', 'cpu_seconds', 'peak_rss_bytes', 'output_bytes')
+
+
+def parse_size(value):
+    """'1920x1080' -> (1920, 1080)"""
+    try:
+        width, height = (int(part) for part in value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Expected WIDTHxHEIGHT, got {value!r}')
+    if width <= 0 or height <= 0:
+        raise argparse.ArgumentTypeError(f'Expected a positive size, got {value!r}')
+    return width, height
+
+
+def make_image(path, size, seed):
+    """A photo-like JPEG: smooth colour gradients with fine noise, so it compresses like a real upload"""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    y = np.linspace(0.0, 1.0, height, dtype=np.float32)[:, None]
+    x = np.linspace(0.0, 1.0, width, dtype=np.float32)[None, :]
+    channels = []
+    for _ in range(3):
+        fx, fy, phase = rng.uniform(1.0, 4.0), rng.uniform(1.0, 4.0), rng.uniform(0.0, math.tau)
+        channels.append(0.5 + 0.35 * np.sin(math.tau * (fx * x + fy * y) + phase))
+    pixels = np.stack(channels, axis=-1) * 255.0
+    pixels += rng.normal(0.0, 12.0, size=pixels.shape).astype(np.float32)
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(path, format='JPEG', quality=90)
+
+
+def make_audio(path, seconds=AUDIO_SECONDS, sample_rate=AUDIO_SAMPLE_RATE):
+    """A stereo 16-bit WAV of a slowly beating chord"""
+    t = np.arange(int(seconds * sample_rate), dtype=np.float64) / sample_rate
+    left = sum(np.sin(math.tau * freq * t) for freq in (220.0, 277.18, 329.63))
+    right = sum(np.sin(math.tau * freq * t) for freq in (220.5, 277.68, 330.13))
+    samples = np.stack([left, right], axis=-1) / 3 * 0.6 * 32767
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(samples.astype('<i2').tobytes())
+
+
+def make_inputs(folder, image_sizes, image_count):
+    """
+    Write the synthetic inputs to folder
+
+    Returns:
+        ({size: [image paths]}, audio path)
+    """
+    images = {}
+    for size in image_sizes:
+        images[size] = []
+        for slot in range(image_count):
+            path = os.path.join(folder, f'image_{size[0]}x{size[1]}_{slot}.jpg')
+            make_image(path, size, BENCHMARK_SEED + slot)
+            images[size].append(path)
+    audio_path = os.path.join(folder, 'music.wav')
+    make_audio(audio_path)
+    return images, audio_path
+
+
+def _store(path, kind):
+    """Copy an input into the (current directory's) asset store"""
+    os.makedirs(asset_store.ASSETS_FOLDER, exist_ok=True)
+    temp_path = os.path.join(asset_store.ASSETS_FOLDER, f'.bench_{os.path.basename(path)}')
+    shutil.copyfile(path, temp_path)
+    return asset_store.put(temp_path, file_digest(temp_path), kind)
+
+
+def clear_caches():
+    """Empty the per-process image, text and background caches"""
+    for cached in (video_generator.load_image_array, video_effects.load_font, video_effects.render_text,
+                   video_effects.dissolve_noise, video_effects.create_background_array):
+        cached.cache_clear()
+
+
+def _cpu_seconds(who):
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_case(template, image_paths, audio_path, profile_name, output_format):
+    """
+    Render one template once in the current directory and measure it
+
+    CPU time covers this process and the ffmpeg children it waited for.
+    peak_rss_bytes is this process's high-water mark during the render;
+    the encoders' peak is a maximum over every child so far, as the kernel
+    does not reset it.
+
+    Returns:
+        dict of measurements
+    """
+    image_assets = [_store(path, 'image') for path in image_paths]
+    audio_asset = _store(audio_path, 'audio')
+    output_path = os.path.join(UPLOAD_FOLDER, 'benchmark.mp4')
+    text_overlays = template.text_overlays('Benchmark')
+    stages_before = metrics.local_totals('render_stage_seconds')
+    frames_before = sum(metrics.local_totals('render_frames_encoded_total').values())
+
+    metrics.reset_peak_rss()
+    cpu_self = _cpu_seconds(resource.RUSAGE_SELF)
+    cpu_children = _cpu_seconds(resource.RUSAGE_CHILDREN)
+    started = time.perf_counter()
+    generate_video(template, image_assets, text_overlays, audio_asset, output_path,
+                   render_profile=profile_name, output_format=output_format)
+    wall = time.perf_counter() - started
+    cpu_self = _cpu_seconds(resource.RUSAGE_SELF) - cpu_self
+    cpu_children = _cpu_seconds(resource.RUSAGE_CHILDREN) - cpu_children
+    peak_rss = metrics.peak_rss()
+
+    frames = sum(metrics.local_totals('render_frames_encoded_total').values()) - frames_before
+    stages = {}
+    for labels, seconds in metrics.local_totals('render_stage_seconds').items():
+        stage = dict(labels)['stage']
+        stages[stage] = round(seconds - stages_before.get(labels, 0.0), 4)
+    return {
+        'wall_seconds': round(wall, 4),
+        'cpu_seconds': round(cpu_self + cpu_children, 4),
+        'cpu_seconds_python': round(cpu_self, 4),
+        'cpu_seconds_encoder': round(cpu_children, 4),
+        'frames': frames,
+        'frames_per_second': round(frames / wall, 2) if wall > 0 else None,
+        'peak_rss_bytes': peak_rss,
+        'encoder_peak_rss_bytes': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024,
+        'output_bytes': os.path.getsize(output_path),
+        'stages': stages,
+    }
+
+
+def _git(*args):
+    try:
+        result = subprocess.run(['git', *args], capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def environment():
+    """What the numbers depend on besides the code"""
+    ffmpeg_version = None
+    try:
+        result = subprocess.run([video_generator.FFMPEG_BINARY, '-version'], capture_output=True, text=True)
+        ffmpeg_version = result.stdout.splitlines()[0] if result.stdout else None
+    except OSError:
+        pass
+    return {
+        'commit': _git('rev-parse', 'HEAD'),
+        'dirty': bool(_git('status', '--porcelain', '--untracked-files=no')),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pillow': Image.__version__,
+        'ffmpeg': ffmpeg_version,
+        'encoder_threads': video_generator.ENCODER_THREADS,
+        'scratch_dir': video_generator.RENDER_SCRATCH_DIR,
+    }
+
+
+def run_benchmark(templates, image_sizes, profile_name, output_format, repeat, warm=False):
+    """
+    Run every (template, image size) case repeat times
+
+    Returns:
+        list of case dicts with every run and the per-field medians
+    """
+    image_count = max((template.image_slots for template in templates), default=0)
+    profile = RENDER_PROFILES[profile_name]
+    cases = []
+    home = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='benchmark_') as root:
+        inputs_folder = os.path.join(root, 'inputs')
+        os.makedirs(inputs_folder)
+        images, audio_path = make_inputs(inputs_folder, image_sizes, image_count)
+
+        workspace = None
+        try:
+            for template in templates:
+                for size in image_sizes:
+                    runs = []
+                    for run in range(repeat):
+                        if workspace is None or not warm:
+                            workspace = tempfile.mkdtemp(prefix='run_', dir=root)
+                            os.chdir(workspace)
+                            clear_caches()
+                        measured = run_case(template, images[size][:template.image_slots], audio_path,
+                                            profile_name, output_format)
+                        runs.append(measured)
+                        print(f"template {template.id} ({template.name}) {size[0]}x{size[1]} run {run + 1}/{repeat}: "
+                              f"{measured['wall_seconds']:.2f}s wall, {measured['cpu_seconds']:.2f}s CPU, "
+                              f"{measured['frames_per_second']} fps, {measured['peak_rss_bytes'] // 1024 ** 2} MB peak")
+                    cases.append({
+                        'template_id': template.id,
+                        'template_name': template.name,
+                        'duration': template.duration,
+                        'image_slots': template.image_slots,
+                        'image_size': f'{size[0]}x{size[1]}',
+                        'video_size': list(profile_video_size(profile, output_format)),
+                        'fps': profile_fps(profile, output_format),
+                        'runs': runs,
+                        'median': {field: statistics.median(run[field] for run in runs) for field in SUMMARY_FIELDS},
+                    })
+        finally:
+            # Flush the render metrics into the scratch tree, not the app's uploads/
+            metrics.flush()
+            os.chdir(home)
+    return cases
+
+
+def _case_key(case):
+    return case['template_id'], case['image_size']
+
+
+def compare(base_path, new_path, threshold=5.0):
+    """
+    Print the change in every median between two result files
+
+    Changes beyond threshold percent are flagged; comparisons across
+    different profiles or formats are refused since they measure different
+    renders.
+
+    Returns:
+        Number of flagged regressions
+    """
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    for setting in ('profile', 'output_format', 'warm'):
+        if base['settings'][setting] != new['settings'][setting]:
+            raise SystemExit(f"Runs differ in {setting}, not comparable: "
+                             f"{base['settings'][setting]!r} vs {new['settings'][setting]!r}")
+
+    print(f"base {(base['environment']['commit'] or '?')[:12]}  new {(new['environment']['commit'] or '?')[:12]}")
+    base_cases = {_case_key(case): case for case in base['cases']}
+    regressions = 0
+    for case in new['cases']:
+        old = base_cases.get(_case_key(case))
+        if old is None:
+            continue
+        changes = []
+        for field in SUMMARY_FIELDS:
+            before, after = old['median'][field], case['median'][field]
+            change = (after - before) / before * 100 if before else 0.0
+            marker = ''
+            if change > threshold:
+                marker = ' !'
+                regressions += 1
+            elif change < -threshold:
+                marker = ' +'
+            changes.append(f"{field} {change:+.1f}%{marker}")
+        print(f"template {case['template_id']:>3} {case['image_size']:>9}  " + '  '.join(changes))
+    print(f"{regressions} regressions beyond {threshold}% (! = slower/bigger, + = faster/smaller)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark rendering every catalog template')
+    parser.add_argument('--profile', default='final', choices=sorted(RENDER_PROFILES))
+    parser.add_argument('--output-format', default=DEFAULT_OUTPUT_FORMAT, choices=sorted(OUTPUT_FORMATS))
+    parser.add_argument('--image-size', action='append', type=parse_size,
+                        help=f"Synthetic image resolution, repeatable (default: {', '.join(DEFAULT_IMAGE_SIZES)})")
+    parser.add_argument('--template', action='append', type=int, help='Only this template id, repeatable')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per case; medians are reported')
+    parser.add_argument('--warm', action='store_true', help='Keep caches between runs of a case')
+    parser.add_argument('--output', help=f'Result file (default: {RESULTS_FOLDER}/<commit>-<time>.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help='Compare two result files and exit')
+    parser.add_argument('--threshold', type=float, default=5.0, help='Percent change flagged by --compare')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return 1 if compare(*args.compare, threshold=args.threshold) else 0
+    if args.repeat < 1:
+        parser.error('--repeat must be at least 1')
+
+    templates = all_templates()
+    if args.template:
+        templates = [template for template in templates if template.id in args.template]
+        if not templates:
+            parser.error('No matching templates')
+    image_sizes = args.image_size or [parse_size(size) for size in DEFAULT_IMAGE_SIZES]
+
+    env = environment()
+    started = datetime.datetime.now(datetime.timezone.utc)
+    output_path = os.path.abspath(args.output or os.path.join(
+        RESULTS_FOLDER, f"{(env['commit'] or 'unknown')[:12]}-{started.strftime('%Y%m%dT%H%M%SZ')}.json"
+    ))
+    cases = run_benchmark(templates, image_sizes, args.profile, args.output_format, args.repeat, warm=args.warm)
+
+    result = {
+        'created_at': started.isoformat(),
+        'environment': env,
+        'settings': {
+            'profile': args.profile,
+            'output_format': args.output_format,
+            'repeat': args.repeat,
+            'warm': args.warm,
+            'seed': BENCHMARK_SEED,
+        },
+        'cases': cases,
+    }
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(result, f, indent=2)
+    total = sum(case['median']['wall_seconds'] for case in cases)
+    print(f"{len(cases)} cases, {total:.1f}s total median wall time. Results written to {output_path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,233 @@
+import bisect
+import math
+
+import numpy as np
+from PIL import Image
+
+from video_effects import LayerState, dissolve_noise
+
+
+class Layer:
+    """
+    An image shown on top of the background between start and end
+
+    Args:
+        pixels: HxWx3 (opaque) or HxWx4 (RGBA) uint8 array
+        start: Time in seconds the layer appears
+        end: Time in seconds the layer disappears
+        position: 'center' or an (x, y) pixel offset of the top-left corner
+        effects: list of video_effects.Effect animating the layer
+    """
+
+    def __init__(self, pixels, start, end, position='center', effects=()):
+        if pixels.shape[2] == 4 and pixels[..., 3].min() == 255:
+            # Fully opaque RGBA (e.g. a normalized photo) blends as a plain copy
+            pixels = np.ascontiguousarray(pixels[..., :3])
+        self.pixels = pixels
+        self.start = start
+        self.end = end
+        self.position = position
+        self.effects = list(effects)
+        self._scaled = {}
+
+    def offset(self, frame_size, pixels=None):
+        pixels = self.pixels if pixels is None else pixels
+        if self.position == 'center':
+            h, w = pixels.shape[:2]
+            return (frame_size[0] - w) // 2, (frame_size[1] - h) // 2
+        return self.position
+
+    def state_at(self, t):
+        state = LayerState()
+        for effect in self.effects:
+            if effect.start <= t < effect.end:
+                effect.apply(state, t)
+        return state
+
+    def scaled(self, scale):
+        """Pixels resized by scale, cached because effect budgets bound the distinct scales"""
+        key = round(scale, 4)
+        if key not in self._scaled:
+            h, w = self.pixels.shape[:2]
+            size = (max(int(round(w * key)), 1), max(int(round(h * key)), 1))
+            self._scaled[key] = np.asarray(Image.fromarray(self.pixels).resize(size, Image.BILINEAR))
+        return self._scaled[key]
+
+
+class Segment:
+    """
+    A span of the timeline in which every frame is identical
+
+    layers holds (Layer, LayerState) pairs: the visible layers and how each
+    is drawn throughout the span.
+    """
+
+    def __init__(self, start, end, layers, first_frame, frame_count):
+        self.start = start
+        self.end = end
+        self.layers = layers
+        self.first_frame = first_frame
+        self.frame_count = frame_count
+
+
+def _frame_index(t, fps):
+    # Index of the first frame at or after time t; the epsilon absorbs float
+    # error in template times like 0.1 * 24.
+    return int(math.ceil(t * fps - 1e-6))
+
+
+def build_timeline(layers, duration, fps):
+    """
+    Split [0, duration) into segments where every frame is identical
+
+    Boundaries fall where a layer appears or disappears and between the
+    steps of each layer effect, so animated spans become a bounded number
+    of short constant segments.
+
+    Returns:
+        list of Segment, in time order, skipping spans that contain no frame
+    """
+    total_frames = _frame_index(duration, fps)
+    boundaries = {0.0, float(duration)}
+    for layer in layers:
+        for t in (layer.start, layer.end):
+            if 0 < t < duration:
+                boundaries.add(float(t))
+        for effect in layer.effects:
+            for t in [effect.start, effect.end] + effect.step_times():
+                if 0 < t < duration:
+                    boundaries.add(float(t))
+    boundaries = sorted(boundaries)
+
+    segments = []
+    for start, end in zip(boundaries, boundaries[1:]):
+        first_frame = _frame_index(start, fps)
+        frame_count = min(_frame_index(end, fps), total_frames) - first_frame
+        if frame_count <= 0:
+            continue
+        middle = (start + end) / 2
+        visible = [(layer, layer.state_at(middle))
+                   for layer in layers if layer.start <= start and layer.end >= end]
+        segments.append(Segment(start, end, visible, first_frame, frame_count))
+    return segments
+
+
+def blend(frame, pixels, x, y, alpha=None):
+    """
+    Alpha-blend pixels onto frame in place with its top-left corner at (x, y)
+
+    alpha, if given, is an HxW uint8 mask that replaces the pixels' own alpha.
+    """
+    frame_h, frame_w = frame.shape[:2]
+    h, w = pixels.shape[:2]
+
+    # Clip the layer rectangle against the frame
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + w, frame_w), min(y + h, frame_h)
+    if x0 >= x1 or y0 >= y1:
+        return frame
+
+    src = pixels[y0 - y:y1 - y, x0 - x:x1 - x]
+    dst = frame[y0:y1, x0:x1]
+
+    if alpha is not None:
+        alpha = alpha[y0 - y:y1 - y, x0 - x:x1 - x, None].astype(np.uint16)
+    elif src.shape[2] == 3:
+        dst[...] = src
+        return frame
+    else:
+        alpha = src[..., 3:4].astype(np.uint16)
+    blended = (src[..., :3].astype(np.uint16) * alpha
+               + dst.astype(np.uint16) * (255 - alpha) + 127) // 255
+    dst[...] = blended.astype(np.uint8)
+    return frame
+
+
+class Compositor:
+    """
+    Renders a template timeline by compositing each constant segment once
+
+    Every frame inside a segment is identical, so a 10 second template with a
+    handful of layer changes costs a handful of composites instead of 240.
+
+    Args:
+        size: (width, height) of the output frame
+        background: HxWx3 uint8 array used as the base of every frame; it is
+            only ever read, so a shared read-only buffer is fine
+        layers: list of Layer, drawn in order on top of the background
+        duration: Video duration in seconds
+        fps: Output frame rate
+    """
+
+    def __init__(self, size, background, layers, duration, fps):
+        self.size = size
+        self.background = background
+        self.layers = layers
+        self.duration = duration
+        self.fps = fps
+        self.timeline = build_timeline(layers, duration, fps)
+        self._segment_starts = [segment.first_frame for segment in self.timeline]
+        self._frame = np.empty_like(background)
+        self._cached_index = None
+        self._cached_frame = None
+
+    @property
+    def is_static(self):
+        """True when no layer is animated, so the video is a slideshow of stills"""
+        return not any(layer.effects for layer in self.layers)
+
+    @property
+    def frame_count(self):
+        return sum(segment.frame_count for segment in self.timeline)
+
+    def render_segment(self, segment):
+        """
+        Composite one segment into the compositor's frame buffer
+
+        The same buffer is reused for every segment, so the returned frame is
+        only valid until the next call.
+        """
+        frame = self._frame
+        np.copyto(frame, self.background)
+        for layer, state in segment.layers:
+            self.draw_layer(frame, layer, state)
+        return frame
+
+    def draw_layer(self, frame, layer, state):
+        if state.opacity <= 0.0 or state.dissolve >= 1.0:
+            return
+        if state.is_identity:
+            x, y = layer.offset(self.size)
+            blend(frame, layer.pixels, x, y)
+            return
+
+        pixels = layer.scaled(state.scale) if state.scale != 1.0 else layer.pixels
+        x, y = layer.offset(self.size, pixels)
+        x, y = x + state.dx, y + state.dy
+
+        alpha = None
+        if state.opacity < 1.0 or state.dissolve > 0.0:
+            if pixels.shape[2] == 4:
+                alpha = pixels[..., 3]
+            else:
+                alpha = np.full(pixels.shape[:2], 255, dtype=np.uint8)
+            if state.dissolve > 0.0:
+                hidden = dissolve_noise(pixels.shape[:2]) < int(state.dissolve * 255)
+                alpha = np.where(hidden, 0, alpha).astype(np.uint8)
+            if state.opacity < 1.0:
+                alpha = (alpha * state.opacity).astype(np.uint8)
+        blend(frame, pixels, x, y, alpha)
+
+    def iter_segments(self):
+        """Yield (frame, frame_count) for each segment of the timeline"""
+        for segment in self.timeline:
+            yield self.render_segment(segment), segment.frame_count
+
+    def frame_at(self, t):
+        """Return the frame shown at time t, reusing the current segment's render"""
+        frame_index = min(int(round(t * self.fps)), max(self.frame_count - 1, 0))
+        index = max(bisect.bisect_right(self._segment_starts, frame_index) - 1, 0)
+        if index != self._cached_index:
+            self._cached_frame = self.render_segment(self.timeline[index])
+            self._cached_index = index
+        return self._cached_frame
@@ -0,0 +1,85 @@
+import functools
+import os
+
+from flask import current_app, request
+from werkzeug.utils import send_file
+
+import retention
+from render_cache import file_digest
+
+# Outputs are never rewritten under the same name, so clients may cache
+# them for as long as they like.
+VIDEO_MAX_AGE = int(os.environ.get('VIDEO_MAX_AGE', 365 * 86400))
+# nginx internal location that maps to the uploads folder, e.g. '/protected-videos/'.
+# When set, responses carry X-Accel-Redirect and nginx streams the body.
+VIDEO_ACCEL_REDIRECT = os.environ.get('VIDEO_ACCEL_REDIRECT', '')
+
+
+@functools.lru_cache(maxsize=1024)
+def _content_digest(path, inode, size):
+    return file_digest(path)
+
+
+def video_etag(filepath):
+    """
+    Strong ETag for a video: the SHA-256 of its contents
+
+    Outputs are published by atomic rename, so (inode, size) identifies the
+    bytes and each file is hashed once per process. mtime is deliberately
+    not part of the key because render cache hits touch it.
+    """
+    stat = os.stat(filepath)
+    return _content_digest(filepath, stat.st_ino, stat.st_size)
+
+
+def send_video(filepath, as_attachment=False, download_name=None):
+    """
+    Serve a rendered video with range, ETag and immutable caching support
+
+    Byte ranges and If-None-Match / If-Range are answered by Werkzeug's
+    conditional handling. With USE_X_SENDFILE or VIDEO_ACCEL_REDIRECT the
+    body is left to the front proxy, which also serves the ranges.
+
+    A retention lease is held until the response is closed, so the file
+    cannot be collected mid-download. Offloaded responses release it
+    straight away; the proxy opens the file right after.
+    """
+    lease = retention.acquire_lease(filepath)
+    if lease is None:
+        return "Video not found", 404
+
+    try:
+        offload = current_app.config.get('USE_X_SENDFILE') or bool(VIDEO_ACCEL_REDIRECT)
+        response = send_file(
+            os.path.abspath(filepath),
+            request.environ,
+            mimetype='video/mp4',
+            as_attachment=as_attachment,
+            download_name=download_name,
+            conditional=not offload,
+            etag=video_etag(filepath),
+            max_age=VIDEO_MAX_AGE,
+            use_x_sendfile=offload,
+            response_class=current_app.response_class,
+        )
+        response.cache_control.immutable = True
+        if offload:
+            # Only answer validators here; the proxy handles Range itself
+            response = response.make_conditional(request.environ)
+            sendfile_path = response.headers.pop('X-Sendfile', None)
+            if VIDEO_ACCEL_REDIRECT and sendfile_path and response.status_code == 200:
+                response.headers['X-Accel-Redirect'] = (
+                    VIDEO_ACCEL_REDIRECT.rstrip('/') + '/' + os.path.basename(filepath)
+                )
+            elif sendfile_path and response.status_code == 200:
+                response.headers['X-Sendfile'] = sendfile_path
+    except Exception:
+        lease.close()
+        raise
+
+    if offload:
+        lease.close()
+    else:
+        response.call_on_close(lease.close)
+    retention.record_access(filepath)
+    return response
@@ -0,0 +1,91 @@
+import os
+
+from PIL import Image, ImageOps
+
+import asset_store
+import metrics
+
+# Uploaded images are shown at 60% of the frame height, or 80% of the frame
+# width for very wide images.
+IMAGE_HEIGHT_FRACTION = 0.6
+IMAGE_WIDTH_FRACTION = 0.8
+
+_EXIF_ORIENTATION = 0x0112
+_ROTATED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def fit_size(width, height, video_size):
+    """On-screen (width, height) of a width x height image in a video_size frame"""
+    target_h = int(video_size[1] * IMAGE_HEIGHT_FRACTION)
+    target_w = max(1, round(width * target_h / height))
+    if target_w > video_size[0]:
+        target_w = int(video_size[0] * IMAGE_WIDTH_FRACTION)
+        target_h = max(1, round(height * target_w / width))
+    return target_w, target_h
+
+
+def ingest_image(src_path, dest_path, video_size=(1280, 720)):
+    """
+    Decode an uploaded image once and store it at its final on-screen size
+
+    JPEGs are decoded with draft mode so the decoder itself downsamples by
+    up to 8x, EXIF orientation is applied, and any remaining reduction is
+    done with a cheap integer reduce() before a single high-quality resize.
+    The result is saved as an RGBA PNG that renders can use without resizing.
+
+    Args:
+        src_path: Path of the uploaded file
+        dest_path: Path of the normalized PNG to write
+        video_size: (width, height) of the video the image will appear in
+
+    Returns:
+        (width, height) of the stored image
+    """
+    with Image.open(src_path) as img:
+        width, height = img.size
+        orientation = img.getexif().get(_EXIF_ORIENTATION)
+        if orientation in _ROTATED_ORIENTATIONS:
+            width, height = height, width
+        target_w, target_h = fit_size(width, height, video_size)
+
+        if img.format == 'JPEG':
+            draft_size = (target_w, target_h)
+            if orientation in _ROTATED_ORIENTATIONS:
+                draft_size = (target_h, target_w)
+            img.draft('RGB', draft_size)
+
+        img = ImageOps.exif_transpose(img)
+        img = img.convert('RGBA')
+
+        factor = min(img.width // target_w, img.height // target_h)
+        if factor >= 2:
+            img = img.reduce(factor)
+        if img.size != (target_w, target_h):
+            img = img.resize((target_w, target_h), Image.LANCZOS)
+
+        img.save(dest_path, format='PNG', compress_level=1)
+        return img.size
+
+
+def display_image(asset_id, video_size=(1280, 720)):
+    """
+    Path of an image asset normalized for a video_size frame
+
+    The normalized PNG is stored next to the original in the asset store
+    and made on first use, so each upload is decoded once per frame size.
+
+    Raises:
+        asset_store.AssetNotFound: if the asset is not in the store
+    """
+    path = asset_store.derived_path(asset_id, f"{video_size[0]}x{video_size[1]}.png")
+    if os.path.exists(path):
+        return path
+    partial_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with metrics.timed('render_stage_seconds', stage='image_ingest'):
+            ingest_image(asset_store.resolve(asset_id), partial_path, video_size)
+        os.replace(partial_path, path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    return path
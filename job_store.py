@@ -0,0 +1,122 @@
+import json
+import os
+import time
+import uuid
+
+from storage import UPLOAD_FOLDER, pid_alive
+
+JOBS_FOLDER = os.path.join(UPLOAD_FOLDER, 'jobs')
+
+JOB_STATUSES = ('queued', 'running', 'done', 'failed')
+
+
+def _job_path(job_id):
+    return os.path.join(JOBS_FOLDER, f"{job_id}.json")
+
+
+def _write_job(job):
+    """Atomically replace the job's state file so readers never see a partial write."""
+    os.makedirs(JOBS_FOLDER, exist_ok=True)
+    path = _job_path(job['id'])
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(job, f)
+    os.replace(temp_path, path)
+
+
+def create_job(kind, **fields):
+    """
+    Create a new job record in the 'queued' state
+
+    Job state lives on disk rather than in process memory so that any
+    gunicorn worker (and any render worker process) can read and update it.
+
+    Args:
+        kind: Job type, e.g. 'render'
+        **fields: Extra fields stored on the job record
+
+    Returns:
+        dict with the job record
+    """
+    now = time.time()
+    job = {
+        'id': uuid.uuid4().hex,
+        'kind': kind,
+        'status': 'queued',
+        'progress': 0.0,
+        'created_at': now,
+        'updated_at': now,
+        'error': None,
+        'result': None,
+    }
+    job.update(fields)
+    _write_job(job)
+    return job
+
+
+def get_job(job_id):
+    """Return the job record, or None if the id is unknown"""
+    if not job_id or not all(c in '0123456789abcdef' for c in job_id):
+        return None
+    try:
+        with open(_job_path(job_id)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def update_job(job_id, **fields):
+    """Merge fields into an existing job record and return it"""
+    job = get_job(job_id)
+    if job is None:
+        return None
+    job.update(fields)
+    job['updated_at'] = time.time()
+    _write_job(job)
+    return job
+
+
+def delete_job(job_id):
+    """Remove a job record; returns False if it did not exist"""
+    if get_job(job_id) is None:
+        return False
+    try:
+        os.remove(_job_path(job_id))
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def job_orphaned(job, stale_after, now=None):
+    """
+    Whether an unfinished job has lost the process that was running it
+
+    Args:
+        job: Job record with an owner_pid
+        stale_after: Seconds without an update after which the job counts as
+            abandoned even if its owner is alive (e.g. its task was lost)
+        now: Current time, defaults to time.time()
+    """
+    now = now or time.time()
+    return not pid_alive(job.get('owner_pid')) or job['updated_at'] < now - stale_after
+
+
+def list_jobs(kind=None, statuses=None):
+    """Return all job records, optionally filtered by kind and status"""
+    try:
+        names = os.listdir(JOBS_FOLDER)
+    except FileNotFoundError:
+        return []
+    jobs = []
+    for name in names:
+        if not name.endswith('.json'):
+            continue
+        job = get_job(name[:-len('.json')])
+        if job is None:
+            continue
+        if kind is not None and job['kind'] != kind:
+            continue
+        if statuses is not None and job['status'] not in statuses:
+            continue
+        jobs.append(job)
+    return jobs
@@ -0,0 +1,532 @@
+"""
+HTTP load test for the web app, with stand-in Sora and Replicate servers
+
+Two commands. `stub` serves the parts of the OpenAI videos API and the
+Replicate predictions API the app uses, with configurable latency, failure
+rate and rate limiting:
+
+    python load_test.py stub --port 8090 --latency 0.2 --generation-time 20 --failure-rate 0.05
+
+Start the app against it (the SDKs read their base URLs from the
+environment; lower REMOTE_POLL_INTERVAL to poll it like production would):
+
+    OPENAI_BASE_URL=http://127.0.0.1:8090/v1 REPLICATE_BASE_URL=http://127.0.0.1:8090 \\
+        REMOTE_POLL_INTERVAL=2 gunicorn -w 4 -b 127.0.0.1:5000 main:app
+
+`run` then drives the app at a fixed concurrency and reports latency
+percentiles for every step (submit, time until the job settles, download):
+
+    python load_test.py run --url http://127.0.0.1:5000 --scenario template,sora,replicate,download \\
+        --concurrency 16 --duration 120 --output load.json
+"""
+import argparse
+import io
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+SCENARIOS = ('template', 'sora', 'replicate', 'download')
+PERCENTILES = (50, 90, 95, 99)
+STUB_API_KEY = 'stub-key'
+
+
+# Stand-in provider servers
+
+class StubState:
+    """Generations created on the stub and the per-key rate limit buckets"""
+
+    def __init__(self, latency, jitter, generation_time, failure_rate, error_rate, rate_limit, video):
+        self.latency = latency
+        self.jitter = jitter
+        self.generation_time = generation_time
+        self.failure_rate = failure_rate
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.video = video
+        self.generations = {}
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def create(self, kind):
+        """Start a generation that settles after about generation_time seconds"""
+        generation = {
+            'id': f"{'video' if kind == 'sora' else 'pred'}_{uuid.uuid4().hex}",
+            'created_at': time.time(),
+            'duration': max(self.generation_time * random.uniform(0.75, 1.25), 0.0),
+            'fails': random.random() < self.failure_rate,
+        }
+        with self.lock:
+            self.generations[generation['id']] = generation
+        return generation
+
+    def get(self, generation_id):
+        with self.lock:
+            return self.generations.get(generation_id)
+
+    def take_token(self, api_key):
+        """Token bucket of rate_limit requests/second (and burst) per API key"""
+        if not self.rate_limit:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(api_key, (self.rate_limit, now))
+            tokens = min(self.rate_limit, tokens + (now - updated) * self.rate_limit)
+            allowed = tokens >= 1
+            self.buckets[api_key] = (tokens - 1 if allowed else tokens, now)
+        return allowed
+
+
+def _progress(generation):
+    """(state, percent) of a generation: 'queued', 'running', 'completed' or 'failed'"""
+    elapsed = time.time() - generation['created_at']
+    if elapsed >= generation['duration']:
+        return ('failed' if generation['fails'] else 'completed'), 100
+    if elapsed < generation['duration'] * 0.1:
+        return 'queued', 0
+    return 'running', int(elapsed / generation['duration'] * 100)
+
+
+def _sora_video(generation):
+    state, percent = _progress(generation)
+    return {
+        'id': generation['id'],
+        'object': 'video',
+        'model': 'sora-2',
+        'status': {'running': 'in_progress'}.get(state, state),
+        'progress': percent,
+        'seconds': '8',
+        'size': '1280x720',
+        'created_at': int(generation['created_at']),
+        'completed_at': int(generation['created_at'] + generation['duration']) if state == 'completed' else None,
+        'error': {'code': 'stub_failure', 'message': 'Generation failed (stub)'} if state == 'failed' else None,
+    }
+
+
+def _replicate_prediction(generation, base_url):
+    state, _ = _progress(generation)
+    status = {'queued': 'starting', 'running': 'processing', 'completed': 'succeeded'}.get(state, state)
+    return {
+        'id': generation['id'],
+        'model': 'stability-ai/stable-video-diffusion',
+        'version': generation.get('version', ''),
+        'status': status,
+        'input': {},
+        'output': f"{base_url}/files/{generation['id']}.mp4" if status == 'succeeded' else None,
+        'error': 'Generation failed (stub)' if status == 'failed' else None,
+        'logs': '',
+        'metrics': {},
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(generation['created_at'])),
+        'urls': {'get': f"{base_url}/v1/predictions/{generation['id']}",
+                 'cancel': f"{base_url}/v1/predictions/{generation['id']}/cancel"},
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type='application/json', headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if 'json' in (self.headers.get('Content-Type') or ''):
+            try:
+                return json.loads(body or b'{}')
+            except json.JSONDecodeError:
+                return {}
+        # Multipart bodies (Sora with input_reference) are only drained
+        return {}
+
+    def _error(self, status, message, code):
+        if self.path.startswith('/v1/videos'):
+            body = {'error': {'message': message, 'type': code, 'code': code}}
+        else:
+            body = {'title': code, 'detail': message, 'status': status}
+        self._send(status, body, headers={'Retry-After': '1'} if status == 429 else None)
+
+    def _handle(self, method):
+        state = self.state
+        body = self._read_json() if method == 'POST' else {}
+        if state.latency or state.jitter:
+            time.sleep(max(state.latency + random.uniform(-state.jitter, state.jitter), 0.0))
+
+        path = self.path.split('?', 1)[0]
+        if path.startswith('/files/'):
+            # Replicate output delivery; not rate limited, like a CDN
+            if method != 'GET' or state.get(path[len('/files/'):].removesuffix('.mp4')) is None:
+                return self._send(404, {'detail': 'Not found'})
+            return self._send(200, state.video, content_type='video/mp4')
+
+        api_key = (self.headers.get('Authorization') or '').removeprefix('Bearer ').removeprefix('Token ')
+        if not api_key:
+            return self._error(401, 'Missing API key', 'invalid_api_key')
+        if not state.take_token(api_key):
+            return self._error(429, 'Rate limit reached (stub)', 'rate_limit_exceeded')
+        if random.random() < state.error_rate:
+            return self._error(500, 'Internal error (stub)', 'server_error')
+
+        base_url = f"http://{self.headers.get('Host')}"
+        if method == 'POST' and path == '/v1/videos':
+            return self._send(200, _sora_video(state.create('sora')))
+        if method == 'POST' and (path == '/v1/predictions' or re.fullmatch(r'/v1/models/[^/]+/[^/]+/predictions', path)):
+            generation = state.create('replicate')
+            generation['version'] = body.get('version', '')
+            return self._send(201, _replicate_prediction(generation, base_url))
+        if method == 'GET' and re.fullmatch(r'/v1/models/[^/]+/[^/]+/versions/[^/]+', path):
+            return self._send(200, {'id': path.rsplit('/', 1)[1], 'created_at': '2024-01-01T00:00:00Z',
+                                    'cog_version': '0.9.0', 'openapi_schema': {}})
+
+        match = re.fullmatch(r'/v1/(videos|predictions)/([^/]+)(/content|/cancel)?', path)
+        generation = state.get(match.group(2)) if match else None
+        if generation is None:
+            return self._error(404, 'Not found', 'not_found')
+        if match.group(1) == 'videos':
+            if match.group(3) == '/content':
+                if _progress(generation)[0] != 'completed':
+                    return self._error(404, 'Video is not ready', 'not_found')
+                return self._send(200, state.video, content_type='video/mp4')
+            return self._send(200, _sora_video(generation))
+        if match.group(3) == '/cancel':
+            generation['fails'] = True
+            generation['duration'] = 0.0
+        return self._send(200, _replicate_prediction(generation, base_url))
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+
+def _sample_video():
+    """A short test-pattern MP4 served as every generation's output"""
+    from moviepy.config import FFMPEG_BINARY
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'sample.mp4')
+        subprocess.run([
+            FFMPEG_BINARY, '-y', '-loglevel', 'error', '-f', 'lavfi', '-i', 'testsrc2=size=1280x720:rate=24',
+            '-t', '4', '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p',
+            '-movflags', '+faststart', path
+        ], check=True)
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+def run_stub(args):
+    if args.video_file:
+        with open(args.video_file, 'rb') as f:
+            video = f.read()
+    else:
+        video = _sample_video()
+    StubHandler.state = StubState(args.latency, args.jitter, args.generation_time, args.failure_rate,
+                                  args.error_rate, args.rate_limit, video)
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    server.daemon_threads = True
+    print(f"Stub providers on http://{args.host}:{args.port} "
+          f"(OPENAI_BASE_URL=http://{args.host}:{args.port}/v1 REPLICATE_BASE_URL=http://{args.host}:{args.port})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+# Load generator
+
+class Recorder:
+    """Latencies and outcomes per step, shared by every virtual user"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.steps = {}
+
+    def record(self, step, seconds, ok, detail=None):
+        with self.lock:
+            entry = self.steps.setdefault(step, {'latencies': [], 'errors': 0, 'outcomes': {}})
+            entry['latencies'].append(seconds)
+            if not ok:
+                entry['errors'] += 1
+            key = str(detail) if detail is not None else ('ok' if ok else 'error')
+            entry['outcomes'][key] = entry['outcomes'].get(key, 0) + 1
+
+    def summary(self, elapsed):
+        steps = {}
+        with self.lock:
+            for step, entry in self.steps.items():
+                latencies = sorted(entry['latencies'])
+                count = len(latencies)
+                steps[step] = {
+                    'count': count,
+                    'errors': entry['errors'],
+                    'per_second': round(count / elapsed, 3) if elapsed else None,
+                    'mean': round(sum(latencies) / count, 4),
+                    **{f'p{p}': round(percentile(latencies, p), 4) for p in PERCENTILES},
+                    'max': round(latencies[-1], 4),
+                    'outcomes': dict(entry['outcomes']),
+                }
+        return steps
+
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+def _jpeg(seed, size=(1600, 1200)):
+    """A distinct small photo-like JPEG per seed"""
+    from benchmark_render import make_image
+    buffer = io.BytesIO()
+    make_image(buffer, size, seed)
+    return buffer.getvalue()
+
+
+class VirtualUser:
+    """One browser session: its own cookies and keep-alive connections"""
+
+    def __init__(self, args, recorder, images):
+        self.args = args
+        self.recorder = recorder
+        self.images = images
+        self.client = httpx.Client(base_url=args.url, timeout=args.timeout, follow_redirects=True)
+
+    def close(self):
+        self.client.close()
+
+    def _request(self, step, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            self.recorder.record(step, time.perf_counter() - started, False, type(e).__name__)
+            return None
+        self.recorder.record(step, time.perf_counter() - started, response.status_code < 400, response.status_code)
+        return response
+
+    def _download(self, video_url):
+        started = time.perf_counter()
+        try:
+            with self.client.stream('GET', video_url) as response:
+                size = sum(len(chunk) for chunk in response.iter_bytes())
+        except httpx.HTTPError as e:
+            self.recorder.record('download', time.perf_counter() - started, False, type(e).__name__)
+            return False
+        ok = response.status_code == 200 and size > 0
+        self.recorder.record('download', time.perf_counter() - started, ok, response.status_code)
+        return ok
+
+    def _wait(self, step, job_id):
+        """Poll a job until it settles, recording the time from submit as step"""
+        started = time.perf_counter()
+        deadline = started + self.args.job_timeout
+        while time.perf_counter() < deadline:
+            time.sleep(self.args.poll_interval)
+            try:
+                response = self.client.get(f'/jobs/{job_id}')
+            except httpx.HTTPError:
+                continue
+            if response.status_code != 200:
+                continue
+            status = response.json()['status']
+            if status in ('done', 'failed'):
+                self.recorder.record(step, time.perf_counter() - started, status == 'done', status)
+                return status == 'done'
+        self.recorder.record(step, time.perf_counter() - started, False, 'timeout')
+        return False
+
+    def login(self):
+        """Store the stub API keys in this session, as the settings page would"""
+        self._request('save_settings', 'POST', '/save_settings', json={
+            'openai_api_key': self.args.api_key, 'replicate_api_key': self.args.api_key
+        })
+
+    def template(self, n):
+        data = {'template_id': str(self.args.template_id), 'custom_text': self.args.custom_text.format(n=n)}
+        if self.args.profile:
+            data['render_profile'] = self.args.profile
+        files = [(f'image_{i}', (f'image_{i}.jpg', image, 'image/jpeg')) for i, image in enumerate(self.images)]
+        response = self._request('generate_video', 'POST', '/generate_video', data=data, files=files)
+        if response is None or response.status_code not in (200, 202):
+            return
+        body = response.json()
+        if response.status_code == 202 and self.args.wait and not self._wait('render', body['job_id']):
+            return
+        if self.args.wait:
+            self._download(body['video_url'])
+
+    def remote(self, provider, n):
+        response = self._request(f'generate_{provider}', 'POST', '/generate_sora_video', json={
+            'prompt': self.args.prompt.format(n=n), 'duration': 8, 'api_provider': provider
+        })
+        if response is None or response.status_code != 202:
+            return
+        body = response.json()
+        if self.args.wait and self._wait(f'{provider}_job', body['job_id']):
+            self._download(body['video_url'])
+
+    def run(self, scenario, n):
+        if scenario == 'template':
+            self.template(n)
+        elif scenario in ('sora', 'replicate'):
+            self.remote(scenario, n)
+        else:
+            self._download(self.args.download_url)
+
+
+def _prepare_download(args, images):
+    """Render one video to download in the download scenario, unless a URL was given"""
+    if args.download_url:
+        return args.download_url
+    user = VirtualUser(args, Recorder(), images)
+    try:
+        response = user.client.post('/generate_video', data={'template_id': str(args.template_id)}, files=[
+            (f'image_{i}', (f'image_{i}.jpg', image, 'image/jpeg')) for i, image in enumerate(images)
+        ])
+        response.raise_for_status()
+        body = response.json()
+        if response.status_code == 202 and not user._wait('setup', body['job_id']):
+            raise SystemExit('Could not render a video for the download scenario')
+        return body['video_url']
+    finally:
+        user.close()
+
+
+def run_load(args):
+    scenarios = [name.strip() for name in args.scenario.split(',') if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"Unknown scenario {', '.join(unknown)}; choose from {', '.join(SCENARIOS)}")
+    if not args.requests and not args.duration:
+        raise SystemExit('Give --requests or --duration')
+
+    images = [_jpeg(seed) for seed in range(args.images)]
+    if 'download' in scenarios:
+        args.download_url = _prepare_download(args, images)
+
+    recorder = Recorder()
+    iterations = [0]
+    iterations_lock = threading.Lock()
+    started = time.perf_counter()
+    deadline = started + args.duration if args.duration else None
+
+    def next_iteration():
+        with iterations_lock:
+            n = iterations[0]
+            if (args.requests and n >= args.requests) or (deadline and time.perf_counter() >= deadline):
+                return None
+            iterations[0] += 1
+            return n
+
+    def worker():
+        user = VirtualUser(args, recorder, images)
+        try:
+            if {'sora', 'replicate'} & set(scenarios):
+                user.login()
+            while True:
+                n = next_iteration()
+                if n is None:
+                    return
+                user.run(scenarios[n % len(scenarios)], n)
+        finally:
+            user.close()
+
+    threads = [threading.Thread(target=worker, name=f'user-{i}', daemon=True) for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    steps = recorder.summary(elapsed)
+    print(f"{'step':<20}{'count':>7}{'errors':>8}{'/s':>8}" + ''.join(f"{f'p{p}':>9}" for p in PERCENTILES) + f"{'max':>9}")
+    for step, entry in steps.items():
+        print(f"{step:<20}{entry['count']:>7}{entry['errors']:>8}{entry['per_second']:>8}"
+              + ''.join(f"{entry[f'p{p}']:>9.3f}" for p in PERCENTILES) + f"{entry['max']:>9.3f}")
+    print(f"{iterations[0]} iterations in {elapsed:.1f}s "
+          f"with {args.concurrency} concurrent users")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'url': args.url,
+                'scenarios': scenarios,
+                'concurrency': args.concurrency,
+                'elapsed': round(elapsed, 3),
+                'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                'steps': steps,
+            }, f, indent=2)
+    return 0 if all(entry['errors'] == 0 for entry in steps.values()) else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    stub = commands.add_parser('stub', help='Serve stand-in OpenAI videos and Replicate predictions APIs')
+    stub.add_argument('--host', default='127.0.0.1')
+    stub.add_argument('--port', type=int, default=8090)
+    stub.add_argument('--latency', type=float, default=0.1, help='Seconds added to every API call')
+    stub.add_argument('--jitter', type=float, default=0.05, help='Random +/- seconds on top of --latency')
+    stub.add_argument('--generation-time', type=float, default=20.0,
+                      help='Seconds until a generation settles (+/- 25%%)')
+    stub.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of generations that fail')
+    stub.add_argument('--error-rate', type=float, default=0.0, help='Fraction of API calls answered with 500')
+    stub.add_argument('--rate-limit', type=float, default=0.0,
+                      help='Requests/second allowed per API key before 429s (0 = unlimited)')
+    stub.add_argument('--video-file', help='MP4 served as every output (default: a generated test pattern)')
+
+    run = commands.add_parser('run', help='Drive the app at a fixed concurrency')
+    run.add_argument('--url', default='http://127.0.0.1:5000')
+    run.add_argument('--scenario', default='template',
+                     help=f"Comma-separated scenarios, run in rotation: {', '.join(SCENARIOS)}")
+    run.add_argument('--concurrency', type=int, default=8, help='Concurrent virtual users')
+    run.add_argument('--requests', type=int, default=0, help='Stop after this many iterations')
+    run.add_argument('--duration', type=float, default=0.0, help='Stop starting iterations after this many seconds')
+    run.add_argument('--no-wait', dest='wait', action='store_false',
+                     help='Only submit; do not wait for jobs or download')
+    run.add_argument('--template-id', type=int, default=1)
+    run.add_argument('--profile', help='render_profile sent with template renders')
+    run.add_argument('--custom-text', default='Load test {n}',
+                     help='Custom text; {n} makes every render distinct, a fixed text measures cache hits')
+    run.add_argument('--images', type=int, default=3, help='Synthetic images uploaded per template render')
+    run.add_argument('--prompt', default='A load test clip number {n}')
+    run.add_argument('--api-key', default=STUB_API_KEY, help='Provider key saved in each session')
+    run.add_argument('--download-url', help='Video fetched by the download scenario (default: render one)')
+    run.add_argument('--poll-interval', type=float, default=1.0)
+    run.add_argument('--job-timeout', type=float, default=600.0)
+    run.add_argument('--timeout', type=float, default=60.0, help='Per-request timeout in seconds')
+    run.add_argument('--output', help='Write the summary as JSON')
+
+    args = parser.parse_args(argv)
+    if args.command == 'stub':
+        return run_stub(args)
+    return run_load(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,294 @@
+import atexit
+import contextlib
+import fcntl
+import json
+import os
+import resource
+import threading
+import time
+import uuid
+
+from storage import UPLOAD_FOLDER, pid_alive
+
+METRICS_FOLDER = os.path.join(UPLOAD_FOLDER, 'metrics')
+# How often a process writes its snapshot while it keeps recording; render
+# workers also flush after every render
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+BYTES_BUCKETS = tuple(2 ** n * 1024 ** 2 for n in range(5, 14))  # 32 MiB .. 8 GiB
+
+# name: (type, help, buckets)
+METRICS = {
+    'render_stage_seconds': (
+        'histogram', 'Time spent in each render stage, summed per render (upload_save and image_ingest per file)',
+        SECONDS_BUCKETS
+    ),
+    'render_duration_seconds': ('histogram', 'Wall time of a render job', SECONDS_BUCKETS),
+    'render_peak_rss_bytes': ('histogram', 'Peak resident memory of the render worker during a render', BYTES_BUCKETS),
+    'render_frames_encoded_total': ('counter', 'Frames written to the encoder', None),
+    'render_output_bytes_total': ('counter', 'Bytes of published render output', None),
+    'provider_request_seconds': ('histogram', 'Latency of remote provider API calls', SECONDS_BUCKETS),
+    'provider_wait_seconds': (
+        'histogram', 'Time from submitting a remote generation until it settles', SECONDS_BUCKETS
+    ),
+}
+
+_lock = threading.Lock()
+_values = {}
+_owner_pid = None
+_snapshot_name = None
+_last_flush = 0.0
+_dirty = False
+
+
+def _labels_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _check_owner():
+    """Start from empty values in a forked child, which must not report its parent's numbers"""
+    global _owner_pid, _snapshot_name, _values, _dirty
+    pid = os.getpid()
+    if pid != _owner_pid:
+        _owner_pid = pid
+        _snapshot_name = f"{pid}-{uuid.uuid4().hex[:8]}.json"
+        _values = {}
+        _dirty = False
+
+
+def observe(name, value, **labels):
+    """Add one observation to a histogram"""
+    global _dirty
+    buckets = METRICS[name][2]
+    with _lock:
+        _check_owner()
+        entry = _values.setdefault((name, _labels_key(labels)), {
+            'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0
+        })
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                entry['buckets'][i] += 1
+        entry['sum'] += value
+        entry['count'] += 1
+        _dirty = True
+    _maybe_flush()
+
+
+def inc(name, amount=1, **labels):
+    """Add to a counter"""
+    global _dirty
+    with _lock:
+        _check_owner()
+        key = (name, _labels_key(labels))
+        _values[key] = _values.get(key, 0) + amount
+        _dirty = True
+    _maybe_flush()
+
+
+@contextlib.contextmanager
+def timed(name, **labels):
+    """Observe the wall time of the block, whether or not it raises"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+class Stages:
+    """
+    Per-render stage timings
+
+    A stage may be entered many times (e.g. once per image); the time is
+    summed and observed once per render by observe().
+    """
+
+    def __init__(self):
+        self.seconds = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name, seconds):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+    def observe(self):
+        for name, seconds in self.seconds.items():
+            observe('render_stage_seconds', seconds, stage=name)
+        self.seconds = {}
+
+
+def reset_peak_rss():
+    """
+    Restart peak memory tracking for this process (Linux only)
+
+    Without it the peak only ever grows over the worker's lifetime, which
+    hides which render actually needed the memory.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss():
+    """Peak resident set size in bytes since the last reset_peak_rss()"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in KiB on Linux (and never resets)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def local_totals(name):
+    """
+    This process's running totals for one metric, {labels dict items: total}
+
+    Counters give their value and histograms the sum of their observations;
+    used by benchmark_render to attribute a single render's stages and frames.
+    """
+    with _lock:
+        _check_owner()
+        return {labels: value['sum'] if isinstance(value, dict) else value
+                for (metric, labels), value in _values.items() if metric == name}
+
+
+def _snapshot():
+    return [[name, dict(labels), value] for (name, labels), value in _values.items()]
+
+
+def flush():
+    """Write this process's values to its snapshot file"""
+    global _last_flush, _dirty
+    with _lock:
+        _check_owner()
+        _last_flush = time.time()
+        if not _dirty:
+            return
+        data = {'pid': _owner_pid, 'values': _snapshot()}
+        _dirty = False
+        name = _snapshot_name
+    os.makedirs(METRICS_FOLDER, exist_ok=True)
+    path = os.path.join(METRICS_FOLDER, name)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+def _maybe_flush():
+    if time.time() - _last_flush >= METRICS_FLUSH_INTERVAL:
+        try:
+            flush()
+        except OSError as e:
+            print(f"Error writing metrics: {e}")
+
+
+atexit.register(flush)
+
+
+def _merge(merged, values):
+    for name, labels, value in values:
+        if name not in METRICS:
+            continue
+        key = (name, _labels_key(labels))
+        if isinstance(value, dict):
+            entry = merged.setdefault(key, {'buckets': [0] * len(value['buckets']), 'sum': 0.0, 'count': 0})
+            entry['buckets'] = [a + b for a, b in zip(entry['buckets'], value['buckets'])]
+            entry['sum'] += value['sum']
+            entry['count'] += value['count']
+        else:
+            merged[key] = merged.get(key, 0) + value
+
+
+def _read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def collect():
+    """
+    Merge every process's snapshot into {(name, labels): value}
+
+    Snapshots of exited processes are folded into archive.json so their
+    totals are kept (counters never go backwards) without the folder
+    growing with every worker restart.
+    """
+    flush()
+    os.makedirs(METRICS_FOLDER, exist_ok=True)
+    merged = {}
+    with open(os.path.join(METRICS_FOLDER, '.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        archive_path = os.path.join(METRICS_FOLDER, 'archive.json')
+        archive = _read_snapshot(archive_path) or {'values': []}
+        archived = {}
+        _merge(archived, archive['values'])
+        dead = []
+        for entry in os.scandir(METRICS_FOLDER):
+            if not entry.name.endswith('.json') or entry.name == 'archive.json':
+                continue
+            snapshot = _read_snapshot(entry.path)
+            if snapshot is None:
+                continue
+            if pid_alive(snapshot['pid']):
+                _merge(merged, snapshot['values'])
+            else:
+                _merge(archived, snapshot['values'])
+                dead.append(entry.path)
+        if dead:
+            temp_path = f"{archive_path}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump({'values': [[name, dict(labels), value] for (name, labels), value in archived.items()]}, f)
+            os.replace(temp_path, archive_path)
+            for path in dead:
+                os.remove(path)
+    _merge(merged, [[name, dict(labels), value] for (name, labels), value in archived.items()])
+    return merged
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus():
+    """All metrics in the Prometheus text exposition format"""
+    values = collect()
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        series = sorted((labels, value) for (metric, labels), value in values.items() if metric == name)
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in series:
+            if kind == 'histogram':
+                for bound, count in zip(buckets, value['buckets']):
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', _format_number(bound))])} {count}")
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {value['count']}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_number(value['sum'])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+            else:
+                lines.append(f"{name}{_format_labels(labels)} {_format_number(value)}")
+    return '\n'.join(lines) + '\n'
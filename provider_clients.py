@@ -0,0 +1,153 @@
+import contextlib
+import os
+import threading
+from collections import OrderedDict
+
+import httpx
+import replicate
+from openai import OpenAI, DefaultHttpxClient
+
+# In-flight API calls and downloads per provider, across every API key
+PROVIDER_MAX_CONNECTIONS = int(os.environ.get('PROVIDER_MAX_CONNECTIONS', 8))
+# Distinct API keys (session keys included) whose clients are kept warm
+PROVIDER_CLIENT_CACHE_SIZE = int(os.environ.get('PROVIDER_CLIENT_CACHE_SIZE', 64))
+PROVIDER_KEEPALIVE_EXPIRY = float(os.environ.get('PROVIDER_KEEPALIVE_EXPIRY', 60))
+PROVIDER_DOWNLOAD_TIMEOUT = float(os.environ.get('PROVIDER_DOWNLOAD_TIMEOUT', 300))
+
+_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+_lock = threading.Lock()
+_owner_pid = None
+_clients = OrderedDict()
+_slots = {}
+_download_client = None
+
+
+def _check_owner():
+    """Start from an empty pool in a forked child; the parent's sockets are not ours to reuse"""
+    global _owner_pid, _clients, _slots, _download_client
+    pid = os.getpid()
+    if pid != _owner_pid:
+        _owner_pid = pid
+        _clients = OrderedDict()
+        _slots = {}
+        _download_client = None
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=PROVIDER_MAX_CONNECTIONS,
+        max_keepalive_connections=PROVIDER_MAX_CONNECTIONS,
+        keepalive_expiry=PROVIDER_KEEPALIVE_EXPIRY,
+    )
+
+
+def _close_entry(entry):
+    try:
+        entry['close']()
+    except Exception as e:
+        print(f"Error closing provider client: {e}")
+
+
+@contextlib.contextmanager
+def _pooled(provider, api_key, build):
+    """
+    Lease the client for (provider, api_key), built on first use
+
+    Clients are thread-safe and keep their connections alive, so every
+    poll after the first skips the TCP and TLS handshakes. The least
+    recently used client is evicted once PROVIDER_CLIENT_CACHE_SIZE keys are
+    held, and its connections are closed as soon as no thread is leasing it.
+
+    Args:
+        build: Returns (client, close), close releasing the client's connections
+    """
+    evicted = []
+    with _lock:
+        _check_owner()
+        key = (provider, api_key)
+        entry = _clients.get(key)
+        if entry is not None:
+            _clients.move_to_end(key)
+        else:
+            client, close = build()
+            entry = _clients[key] = {'client': client, 'close': close, 'users': 0, 'evicted': False}
+            while len(_clients) > PROVIDER_CLIENT_CACHE_SIZE:
+                _, old = _clients.popitem(last=False)
+                old['evicted'] = True
+                if not old['users']:
+                    evicted.append(old)
+        entry['users'] += 1
+    for old in evicted:
+        _close_entry(old)
+    try:
+        yield entry['client']
+    finally:
+        with _lock:
+            entry['users'] -= 1
+            closing = entry['evicted'] and not entry['users']
+        if closing:
+            _close_entry(entry)
+
+
+def openai_client(api_key):
+    """Lease the shared OpenAI client for api_key (the base URL still comes from OPENAI_BASE_URL)"""
+    def build():
+        client = OpenAI(api_key=api_key, http_client=DefaultHttpxClient(limits=_limits()))
+        return client, client.close
+    return _pooled('sora', api_key, build)
+
+
+def replicate_client(api_key):
+    """
+    Lease the shared Replicate client for api_key
+
+    The token is passed to the client rather than set in
+    REPLICATE_API_TOKEN, so concurrent requests with different session keys
+    never see each other's token. replicate.Client has no close(), so its
+    connections are released by closing the transport it was given.
+    """
+    def build():
+        transport = httpx.HTTPTransport(limits=_limits())
+        return replicate.Client(api_token=api_key, transport=transport), transport.close
+    return _pooled('replicate', api_key, build)
+
+
+@contextlib.contextmanager
+def provider_slot(provider):
+    """Hold one of the provider's PROVIDER_MAX_CONNECTIONS call slots"""
+    with _lock:
+        _check_owner()
+        slot = _slots.get(provider)
+        if slot is None:
+            slot = _slots[provider] = threading.BoundedSemaphore(PROVIDER_MAX_CONNECTIONS)
+    with slot:
+        yield
+
+
+def _get_download_client():
+    global _download_client
+    with _lock:
+        _check_owner()
+        if _download_client is None:
+            _download_client = httpx.Client(
+                limits=_limits(),
+                timeout=httpx.Timeout(PROVIDER_DOWNLOAD_TIMEOUT, connect=10.0),
+                follow_redirects=True,
+            )
+        return _download_client
+
+
+def download(url, output_path, provider):
+    """
+    Stream a provider's output file to output_path over a shared connection pool
+
+    Raises:
+        httpx.HTTPError: if the request fails or returns an error status
+    """
+    with provider_slot(provider):
+        with _get_download_client().stream('GET', url) as response:
+            response.raise_for_status()
+            with open(output_path, 'wb') as f:
+                for chunk in response.iter_bytes(_DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
@@ -0,0 +1,201 @@
+import asyncio
+import fcntl
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from job_store import JOBS_FOLDER, create_job, list_jobs, update_job
+from sora_generator import submit_sora_video, check_sora_video, download_sora_video
+from replicate_generator import submit_replicate_video, check_replicate_video, download_replicate_video
+from storage import pid_alive
+
+REMOTE_POLL_INTERVAL = float(os.environ.get('REMOTE_POLL_INTERVAL', 10))
+REMOTE_MAX_WAIT = float(os.environ.get('REMOTE_MAX_WAIT', 300))
+# A queued or running job not updated for this long (every poll updates it) is failed
+REMOTE_STALE_AFTER = float(os.environ.get('REMOTE_STALE_AFTER', 3600))
+# Provider SDK calls are blocking, so each poll runs on this small pool; the
+# waiting between polls costs nothing but a suspended coroutine.
+REMOTE_IO_THREADS = int(os.environ.get('REMOTE_IO_THREADS', 8))
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _provider_calls(provider):
+    if provider == 'replicate':
+        return submit_replicate_video, check_replicate_video
+    return submit_sora_video, check_sora_video
+
+
+def _download(provider, status, remote_id, output_path, api_key):
+    # Download beside the final path and rename, so a half-written video is
+    # never served (or given an ETag)
+    partial_path = f"{output_path}.{os.getpid()}.part"
+    try:
+        if provider == 'replicate':
+            result = download_replicate_video(status['output_url'], partial_path)
+        else:
+            result = download_sora_video(remote_id, partial_path, api_key)
+        if result.get('success'):
+            os.replace(partial_path, output_path)
+            result['video_path'] = output_path
+        return result
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+
+def _get_loop():
+    """Start the poller's event loop thread on first use"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            loop.set_default_executor(ThreadPoolExecutor(
+                max_workers=REMOTE_IO_THREADS, thread_name_prefix='remote-io'
+            ))
+            thread = threading.Thread(target=loop.run_forever, name='remote-poller', daemon=True)
+            thread.start()
+            _loop = loop
+        return _loop
+
+
+async def _track(job_id, provider, params, api_key, output_path, remote_id=None, started_at=None):
+    """Submit (unless resuming) and poll one remote generation until it settles"""
+    submit, check = _provider_calls(provider)
+    started_at = started_at or time.time()
+
+    try:
+        if remote_id is None:
+            submitted = await asyncio.to_thread(
+                submit, params['prompt'], params['duration'], params['size'], api_key
+            )
+            if not submitted.get('success'):
+                update_job(job_id, status='failed', error=submitted.get('error'))
+                return
+            remote_id = submitted['video_id']
+            update_job(job_id, status='running', remote_id=remote_id, submitted_at=started_at)
+            print(f"{provider} job {job_id} submitted as {remote_id}")
+
+        while True:
+            if time.time() - started_at > REMOTE_MAX_WAIT:
+                metrics.observe('provider_wait_seconds', time.time() - started_at, provider=provider, outcome='timeout')
+                update_job(job_id, status='failed',
+                           error=f'Video generation timed out after {REMOTE_MAX_WAIT:g} seconds')
+                return
+
+            await asyncio.sleep(REMOTE_POLL_INTERVAL)
+            status = await asyncio.to_thread(check, remote_id, api_key)
+            if not status.get('success') or status['status'] in ('completed', 'failed'):
+                outcome = status['status'] if status.get('success') else 'failed'
+                metrics.observe('provider_wait_seconds', time.time() - started_at, provider=provider, outcome=outcome)
+            if not status.get('success'):
+                update_job(job_id, status='failed', error=status.get('error'))
+                return
+
+            if status['status'] == 'completed':
+                break
+            if status['status'] == 'failed':
+                update_job(job_id, status='failed', error=status.get('error'))
+                return
+            update_job(job_id, progress=round((status.get('progress') or 0) / 100, 3))
+
+        downloaded = await asyncio.to_thread(_download, provider, status, remote_id, output_path, api_key)
+        if not downloaded.get('success'):
+            update_job(job_id, status='failed', error=downloaded.get('error'))
+            return
+
+        video_filename = os.path.basename(output_path)
+        update_job(job_id, status='done', progress=1.0, result={
+            'video_filename': video_filename,
+            'video_url': f'/download_video/{video_filename}',
+            'video_id': remote_id
+        })
+    except Exception as e:
+        print(f"Remote job {job_id} failed: {e}")
+        update_job(job_id, status='failed', error=str(e))
+
+
+def submit_remote(provider, prompt, duration, size, output_path, session_api_key=None):
+    """
+    Queue a Sora or Replicate generation on the background poller
+
+    The provider job is created and polled from the poller's event loop, so
+    this returns immediately with a job record that /jobs/<id> reports on.
+
+    Args:
+        provider: 'sora' or 'replicate'
+        prompt: Text description for the video
+        duration: Video duration in seconds
+        size: Video resolution
+        output_path: Path where the video will be saved
+        session_api_key: Optional API key from session (kept in memory only)
+
+    Returns:
+        dict with the queued job record
+    """
+    params = {'prompt': prompt, 'duration': duration, 'size': size}
+    job = create_job(
+        'remote',
+        provider=provider,
+        params=params,
+        output_path=output_path,
+        video_filename=os.path.basename(output_path),
+        remote_id=None,
+        owner_pid=os.getpid()
+    )
+    asyncio.run_coroutine_threadsafe(
+        _track(job['id'], provider, params, session_api_key, output_path),
+        _get_loop()
+    )
+    return job
+
+
+def resume_remote_jobs():
+    """
+    Re-attach remote jobs orphaned by a worker restart
+
+    Only jobs whose owning process has exited are adopted. Session API keys
+    are never written to disk, so resumed jobs poll with the server's keys.
+    """
+    os.makedirs(JOBS_FOLDER, exist_ok=True)
+    with open(os.path.join(JOBS_FOLDER, '.remote.lock'), 'w') as lock_file:
+        # Serialize adoption across gunicorn workers starting at the same time
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        for job in list_jobs(kind='remote', statuses=('queued', 'running')):
+            if pid_alive(job.get('owner_pid')):
+                continue
+            if not job.get('remote_id'):
+                update_job(job['id'], status='failed', error='Server restarted before the job was submitted')
+                continue
+            update_job(job['id'], owner_pid=os.getpid())
+            print(f"Resuming {job['provider']} job {job['id']} ({job['remote_id']})")
+            asyncio.run_coroutine_threadsafe(
+                _track(job['id'], job['provider'], job['params'], None, job['output_path'],
+                       remote_id=job['remote_id'], started_at=job.get('submitted_at')),
+                _get_loop()
+            )
+
+
+def fail_stale_remote_jobs(now=None):
+    """
+    Fail queued or running remote jobs that have stopped being polled
+
+    Jobs whose owner merely exited are resumed by resume_remote_jobs; this
+    catches the ones nobody is tracking any more, which would otherwise
+    never settle or expire.
+
+    Returns:
+        Number of jobs failed
+    """
+    now = now or time.time()
+    failed = 0
+    for job in list_jobs(kind='remote', statuses=('queued', 'running')):
+        if job['updated_at'] < now - REMOTE_STALE_AFTER:
+            update_job(job['id'], status='failed', error='Video generation stopped responding')
+            failed += 1
+    if failed:
+        print(f"Failed {failed} stale remote jobs")
+    return failed
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+
+from job_store import JOBS_FOLDER, get_job, job_orphaned
+from storage import UPLOAD_FOLDER
+
+CACHE_FOLDER = UPLOAD_FOLDER
+CACHE_PREFIX = 'video_'
+INFLIGHT_FOLDER = os.path.join(JOBS_FOLDER, 'inflight')
+RENDER_CACHE_MAX_BYTES = int(os.environ.get('RENDER_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+
+# Bump whenever a renderer change alters output for the same inputs, so stale
+# renders stop matching.
+RENDER_CACHE_VERSION = 6
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(path):
+    """SHA-256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def render_key(template, text_overlays, image_assets, audio_asset, background_color, render_profile,
+               background_style=None, output_format='landscape'):
+    """
+    Content-addressed key for a template render
+
+    Uploads are identified by their asset ids, which are already content
+    digests, so identical uploads share a key without being read again.
+    """
+    payload = {
+        'version': RENDER_CACHE_VERSION,
+        'template': template.as_dict(),
+        'text_overlays': text_overlays,
+        'images': list(image_assets),
+        'audio': audio_asset,
+        'background_color': list(background_color) if background_color is not None else None,
+        'background_style': background_style,
+        'render_profile': render_profile,
+        'output_format': output_format,
+    }
+    encoded = json.dumps(payload, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def cached_filename(key):
+    return f"{CACHE_PREFIX}{key}.mp4"
+
+
+def lookup(key):
+    """Return the cached video filename for key, or None on a miss"""
+    filename = cached_filename(key)
+    path = os.path.join(CACHE_FOLDER, filename)
+    try:
+        # Touch on hit so eviction is least-recently-used rather than oldest-first
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return filename
+
+
+def _inflight_path(key):
+    return os.path.join(INFLIGHT_FOLDER, key)
+
+
+def inflight_job(key):
+    """
+    Return the queued/running job already rendering key, if any
+
+    A job whose web worker has exited, or that has not moved for
+    RENDER_STALE_AFTER, is never joined; its marker is dropped so the next
+    request renders afresh.
+    """
+    from render_jobs import RENDER_STALE_AFTER
+
+    try:
+        with open(_inflight_path(key)) as f:
+            job = get_job(f.read().strip())
+    except FileNotFoundError:
+        return None
+    if not job or job['status'] not in ('queued', 'running'):
+        return None
+    if job_orphaned(job, RENDER_STALE_AFTER):
+        clear_inflight(key, job['id'])
+        return None
+    return job
+
+
+def record_inflight(key, job_id):
+    os.makedirs(INFLIGHT_FOLDER, exist_ok=True)
+    temp_path = f"{_inflight_path(key)}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        f.write(job_id)
+    os.replace(temp_path, _inflight_path(key))
+
+
+def clear_inflight(key, job_id=None):
+    """Remove key's in-flight marker, only if it still names job_id when given"""
+    try:
+        if job_id is not None:
+            with open(_inflight_path(key)) as f:
+                if f.read().strip() != job_id:
+                    return
+        os.remove(_inflight_path(key))
+    except FileNotFoundError:
+        pass
+
+
+def evict(max_bytes=RENDER_CACHE_MAX_BYTES):
+    """Delete least recently used cached renders until the cache fits in max_bytes"""
+    from retention import remove_file
+
+    entries = []
+    total = 0
+    with os.scandir(CACHE_FOLDER) as it:
+        for entry in it:
+            if not (entry.name.startswith(CACHE_PREFIX) and entry.name.endswith('.mp4')):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+    if total <= max_bytes:
+        return 0
+
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        # Renders being downloaded are leased and skipped
+        if remove_file(path) is None:
+            continue
+        total -= size
+        removed += 1
+    print(f"Render cache evicted {removed} videos")
+    return removed
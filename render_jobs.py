@@ -0,0 +1,349 @@
+import contextlib
+import fcntl
+import functools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import asset_store
+import metrics
+import render_cache
+from job_store import create_job, get_job, job_orphaned, list_jobs, update_job
+from storage import UPLOAD_FOLDER, pid_alive
+
+# Renders running at once on this machine. Every web worker has its own pool
+# of up to this many processes (started on demand), but they all share these
+# slots, so adding gunicorn workers does not multiply render concurrency.
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', os.cpu_count() or 1))
+# Renders queued or running across all web workers
+RENDER_QUEUE_LIMIT = int(os.environ.get('RENDER_QUEUE_LIMIT', RENDER_WORKERS * 8))
+# A queued or running render not updated for this long is treated as lost
+RENDER_STALE_AFTER = float(os.environ.get('RENDER_STALE_AFTER', 3600))
+STREAM_FOLDER = os.path.join(UPLOAD_FOLDER, 'streams')
+RENDER_SLOTS_FOLDER = os.path.join(UPLOAD_FOLDER, 'render_slots')
+RENDER_QUEUE_FOLDER = os.path.join(UPLOAD_FOLDER, 'render_queue')
+RENDER_SLOT_POLL_INTERVAL = 0.5
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = 0
+
+
+class RenderQueueFull(Exception):
+    pass
+
+
+def stream_path(job_id):
+    """Where a streamed render writes its fragmented MP4 while encoding"""
+    return os.path.join(STREAM_FOLDER, f"{job_id}.mp4")
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # 'spawn' keeps render workers independent of any threads running in
+            # the web worker that owns the pool.
+            _executor = ProcessPoolExecutor(
+                max_workers=RENDER_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _executor
+
+
+def _publish_pending():
+    """Write this web worker's pending count where the other workers can read it"""
+    path = os.path.join(RENDER_QUEUE_FOLDER, str(os.getpid()))
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        f.write(str(_pending))
+    os.replace(temp_path, path)
+
+
+def _pending_elsewhere():
+    """Renders queued or running for the other live web workers"""
+    total = 0
+    for entry in os.scandir(RENDER_QUEUE_FOLDER):
+        if not entry.name.isdigit() or int(entry.name) == os.getpid():
+            continue
+        if not pid_alive(int(entry.name)):
+            # Its pool died with it
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(entry.path)
+            continue
+        try:
+            with open(entry.path) as f:
+                total += int(f.read() or 0)
+        except (FileNotFoundError, ValueError):
+            continue
+    return total
+
+
+def _reserve(count):
+    """
+    Count renders against RENDER_QUEUE_LIMIT, which all web workers share
+
+    Raises:
+        RenderQueueFull: if they do not fit
+    """
+    global _pending
+    os.makedirs(RENDER_QUEUE_FOLDER, exist_ok=True)
+    with open(os.path.join(RENDER_QUEUE_FOLDER, '.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        elsewhere = _pending_elsewhere()
+        with _executor_lock:
+            if elsewhere + _pending + count > RENDER_QUEUE_LIMIT:
+                raise RenderQueueFull('Render queue is full. Please try again shortly.')
+            _pending += count
+            _publish_pending()
+
+
+def _release(count):
+    global _pending
+    with _executor_lock:
+        _pending -= count
+        _publish_pending()
+
+
+def _acquire_render_slot():
+    """
+    Block until one of the machine's RENDER_WORKERS render slots is free
+
+    Slots are flocks, so one held by a killed worker frees itself.
+
+    Returns:
+        Open file holding the slot; closing it releases the slot
+    """
+    os.makedirs(RENDER_SLOTS_FOLDER, exist_ok=True)
+    while True:
+        for index in range(RENDER_WORKERS):
+            slot = open(os.path.join(RENDER_SLOTS_FOLDER, f'{index}.lock'), 'w')
+            try:
+                fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return slot
+            except BlockingIOError:
+                slot.close()
+        time.sleep(RENDER_SLOT_POLL_INTERVAL)
+
+
+def _run_render(job_id, render_kwargs, video_filename, cache_key=None, extra_outputs=None):
+    """Entry point executed inside a render worker process"""
+    # The job stays queued until a slot frees up
+    with _acquire_render_slot():
+        _render(job_id, render_kwargs, video_filename, cache_key, extra_outputs)
+
+
+def _render(job_id, render_kwargs, video_filename, cache_key=None, extra_outputs=None):
+    from video_generator import generate_video
+
+    extra_outputs = extra_outputs or {}
+    cache_keys = [key for key in [cache_key] + [key for _, key in extra_outputs.values()] if key]
+    update_job(job_id, status='running', progress=0.0)
+    render_profile = render_kwargs.get('render_profile', 'final')
+    metrics.reset_peak_rss()
+    started = time.perf_counter()
+    status = 'failed'
+
+    last_reported = [0.0]
+
+    def report_progress(fraction):
+        # Throttle writes to the job file to every 5%
+        if fraction - last_reported[0] >= 0.05 or fraction >= 1.0:
+            last_reported[0] = fraction
+            update_job(job_id, progress=round(min(fraction, 1.0), 3))
+
+    try:
+        generate_video(progress=report_progress, **render_kwargs)
+        status = 'done'
+    except Exception as e:
+        print(f"Render job {job_id} failed: {e}")
+        update_job(job_id, status='failed', error=str(e))
+        return
+    finally:
+        for key in cache_keys:
+            render_cache.clear_inflight(key)
+        metrics.observe('render_duration_seconds', time.perf_counter() - started,
+                        profile=render_profile, status=status)
+        metrics.observe('render_peak_rss_bytes', metrics.peak_rss(), profile=render_profile)
+        # The web process serving /metrics only sees this worker's snapshot
+        metrics.flush()
+
+    result = {
+        'video_filename': video_filename,
+        'video_url': f'/download_video/{video_filename}'
+    }
+    if extra_outputs:
+        filenames = {render_kwargs.get('output_format', 'landscape'): video_filename}
+        filenames.update((name, filename) for name, (filename, _) in extra_outputs.items())
+        result['outputs'] = {
+            name: {'video_filename': filename, 'video_url': f'/download_video/{filename}'}
+            for name, filename in filenames.items()
+        }
+    update_job(job_id, status='done', progress=1.0, result=result)
+
+    if cache_keys:
+        try:
+            render_cache.evict()
+        except Exception as e:
+            print(f"Error evicting render cache: {e}")
+
+
+def _run_render_many(renders):
+    """Worker entry point for a batch task: renders share this process's caches"""
+    for job_id, render_kwargs, video_filename, cache_key in renders:
+        _run_render(job_id, render_kwargs, video_filename, cache_key)
+
+
+def _on_finished(job_ids, assets, future):
+    global _executor
+    exc = future.exception()
+    # Runs in the web worker, so the job's asset references are dropped even
+    # when the render process itself died
+    asset_store.release_all(assets)
+    _release(1)
+    with _executor_lock:
+        if isinstance(exc, BrokenProcessPool):
+            # A broken pool rejects all further work; start a fresh one next time.
+            _executor = None
+    if exc is not None:
+        # The worker process itself died (e.g. OOM kill); its unfinished jobs
+        # never reached their own error handler.
+        print(f"Render worker crashed for jobs {', '.join(job_ids)}: {exc}")
+        for job_id in job_ids:
+            job = get_job(job_id)
+            if job and job['status'] in ('queued', 'running'):
+                update_job(job_id, status='failed', error='Render worker crashed')
+
+
+def submit_render(video_filename, cache_key=None, assets=(), stream=False, extra_outputs=None, **render_kwargs):
+    """
+    Queue a template render on the render worker pool
+
+    Args:
+        video_filename: Name of the output file inside the uploads folder
+        cache_key: Optional render cache key, recorded so identical requests
+            can join this job while it is in flight
+        assets: Asset store ids the render holds a reference on; they are
+            released when the job finishes, whatever the outcome, or
+            straight away if it cannot be queued
+        stream: Encode a fragmented MP4 at stream_path(job id) as the render
+            runs, so it can be played before the job finishes
+        extra_outputs: {output format: (video_filename, cache_key)} of further
+            formats rendered by the same job, next to video_filename
+        **render_kwargs: Arguments passed through to generate_video
+
+    Returns:
+        dict with the queued job record
+
+    Raises:
+        RenderQueueFull: if too many renders are already waiting
+    """
+    executor = _get_executor()
+    try:
+        _reserve(1)
+    except RenderQueueFull:
+        asset_store.release_all(assets)
+        raise
+
+    cache_keys = [key for key in [cache_key] + [key for _, key in (extra_outputs or {}).values()] if key]
+    job = create_job('render', video_filename=video_filename, owner_pid=os.getpid(), cache_keys=cache_keys)
+    if stream:
+        os.makedirs(STREAM_FOLDER, exist_ok=True)
+        render_kwargs['stream_path'] = stream_path(job['id'])
+        job = update_job(job['id'], stream_path=render_kwargs['stream_path'])
+    if extra_outputs:
+        output_folder = os.path.dirname(render_kwargs['output_path'])
+        render_kwargs['extra_outputs'] = {
+            name: os.path.join(output_folder, filename) for name, (filename, _) in extra_outputs.items()
+        }
+    for key in cache_keys:
+        render_cache.record_inflight(key, job['id'])
+    try:
+        future = executor.submit(_run_render, job['id'], render_kwargs, video_filename, cache_key, extra_outputs)
+    except Exception as e:
+        _release(1)
+        asset_store.release_all(assets)
+        update_job(job['id'], status='failed', error=str(e))
+        raise
+    future.add_done_callback(functools.partial(_on_finished, [job['id']], list(assets)))
+    return job
+
+
+def submit_render_many(renders, assets=()):
+    """
+    Queue many template renders packed into at most RENDER_WORKERS tasks
+
+    Each task renders its share one after another in a single worker, so the
+    decoded images, fonts, text rasters, backgrounds and prepared audio
+    cached by its first render are reused by the rest.
+
+    Args:
+        renders: list of (video_filename, cache_key, render_kwargs)
+        assets: Asset store ids every render uses; each task takes its own
+            reference, released when the task finishes
+
+    Returns:
+        list of queued job records, in the order of renders
+
+    Raises:
+        RenderQueueFull: if the tasks do not fit in the queue
+    """
+    if not renders:
+        return []
+    executor = _get_executor()
+    task_count = min(RENDER_WORKERS, len(renders))
+    _reserve(task_count)
+
+    jobs = []
+    tasks = [[] for _ in range(task_count)]
+    for i, (video_filename, cache_key, render_kwargs) in enumerate(renders):
+        job = create_job('render', video_filename=video_filename, owner_pid=os.getpid(),
+                         cache_keys=[cache_key] if cache_key else [])
+        if cache_key:
+            render_cache.record_inflight(cache_key, job['id'])
+        jobs.append(job)
+        # Contiguous slices keep neighbouring variants (often the most alike) together
+        tasks[i * task_count // len(renders)].append((job['id'], render_kwargs, video_filename, cache_key))
+
+    for index, task in enumerate(tasks):
+        for asset_id in assets:
+            asset_store.acquire(asset_id)
+        try:
+            future = executor.submit(_run_render_many, task)
+        except Exception as e:
+            asset_store.release_all(assets)
+            _release(len(tasks) - index)
+            for job_id, _, _, _ in (render for rest in tasks[index:] for render in rest):
+                update_job(job_id, status='failed', error=str(e))
+            raise
+        future.add_done_callback(functools.partial(
+            _on_finished, [job_id for job_id, _, _, _ in task], list(assets)
+        ))
+    return jobs
+
+
+def fail_orphaned_renders(now=None):
+    """
+    Fail queued or running renders whose web worker exited or that stopped moving
+
+    The owning worker's pool dies with it, so these jobs would otherwise
+    stay unfinished forever and identical requests would keep joining them.
+    Their in-flight markers are dropped too.
+
+    Returns:
+        Number of jobs failed
+    """
+    failed = 0
+    for job in list_jobs(kind='render', statuses=('queued', 'running')):
+        if not job_orphaned(job, RENDER_STALE_AFTER, now=now):
+            continue
+        update_job(job['id'], status='failed', error='Render was interrupted by a server restart')
+        for key in job.get('cache_keys', []):
+            render_cache.clear_inflight(key, job['id'])
+        failed += 1
+    if failed:
+        print(f"Failed {failed} orphaned render jobs")
+    return failed
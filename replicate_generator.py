@@ -1,6 +1,156 @@
 import os
 import time
-import replicate
+
+import metrics
+from provider_clients import download, provider_slot, replicate_client
+
+SVD_MODEL = "stability-ai/stable-video-diffusion"
+SVD_VERSION = "3f0457e4619daac51203dedb472816fd4af51f3149fa7a9e0b5ffcf1b8172438"
+
+# Replicate prediction states mapped onto the job states used by remote_jobs
+_PREDICTION_STATUS = {
+    'starting': 'queued',
+    'processing': 'in_progress',
+    'succeeded': 'completed',
+    'failed': 'failed',
+    'canceled': 'failed',
+}
+
+
+def _replicate_error(error_message):
+    """Translate common Replicate API errors into user-facing messages"""
+    if "invalid_api_key" in error_message.lower() or "authentication" in error_message.lower():
+        return {
+            'success': False,
+            'error': 'Invalid Replicate API key. Get one at replicate.com and add it in Settings.'
+        }
+    elif "rate_limit" in error_message.lower():
+        return {
+            'success': False,
+            'error': 'Rate limit exceeded. Please wait and try again.'
+        }
+    elif "insufficient" in error_message.lower():
+        return {
+            'success': False,
+            'error': 'Insufficient credits. Visit replicate.com to add credits.'
+        }
+    else:
+        return {
+            'success': False,
+            'error': f'Replicate API error: {error_message}'
+        }
+
+
+def _output_url(output):
+    # Handle URL strings, FileOutput objects and lists of either
+    if isinstance(output, (list, tuple)):
+        output = output[0] if output else None
+    if output is None:
+        return None
+    return str(output) if not isinstance(output, str) else output
+
+
+def submit_replicate_video(prompt, duration=8, size="1280x720", session_api_key=None):
+    """
+    Create a Replicate prediction without waiting for it to finish
+
+    Args:
+        prompt: Text description for the video
+        duration: Video duration in seconds (ignored for SVD, uses ~2-4 seconds)
+        size: Video resolution
+        session_api_key: Optional API key from session
+
+    Returns:
+        dict with 'success', 'video_id', 'status' and 'error' keys
+    """
+    api_key = session_api_key or os.environ.get('REPLICATE_API_KEY')
+    if not api_key:
+        return {
+            'success': False,
+            'error': 'REPLICATE_API_KEY not found. Please add your API key in Settings.'
+        }
+
+    try:
+        print(f"Creating Replicate video generation job...")
+        print(f"Prompt: {prompt}")
+        print(f"Duration: {duration}s, Size: {size}")
+
+        with replicate_client(api_key) as client:
+            with provider_slot('replicate'), metrics.timed('provider_request_seconds', provider='replicate', call='submit'):
+                prediction = client.predictions.create(
+                    version=SVD_VERSION,
+                    input={
+                        "input_image": None,  # Text-to-video mode
+                        "prompt": prompt,
+                        "fps": 24,
+                        "motion_bucket_id": 127,
+                        "cond_aug": 0.02,
+                        "decoding_t": 14,
+                        "video_length": min(duration * 24, 96)  # Max 96 frames (4 seconds at 24fps)
+                    }
+                )
+
+        return {
+            'success': True,
+            'video_id': prediction.id,
+            'status': _PREDICTION_STATUS.get(prediction.status, 'queued')
+        }
+    except Exception as e:
+        print(f"ERROR: Replicate API error: {e}")
+        return _replicate_error(str(e))
+
+
+def check_replicate_video(prediction_id, session_api_key=None):
+    """
+    Retrieve the current status of a Replicate prediction
+
+    Returns:
+        dict with 'success', 'status', 'output_url' and 'error' keys; status is
+        one of 'queued', 'in_progress', 'completed' or 'failed'
+    """
+    api_key = session_api_key or os.environ.get('REPLICATE_API_KEY')
+    if not api_key:
+        return {
+            'success': False,
+            'error': 'REPLICATE_API_KEY not found. Please add your API key in Settings.'
+        }
+
+    try:
+        with replicate_client(api_key) as client:
+            with provider_slot('replicate'), metrics.timed('provider_request_seconds', provider='replicate', call='check'):
+                prediction = client.predictions.get(prediction_id)
+        status = _PREDICTION_STATUS.get(prediction.status, 'in_progress')
+        result = {
+            'success': True,
+            'status': status,
+            'progress': 0
+        }
+        if status == 'completed':
+            result['output_url'] = _output_url(prediction.output)
+            if not result['output_url']:
+                result['status'] = 'failed'
+                result['error'] = 'No output received from Replicate'
+        elif status == 'failed':
+            result['error'] = f"Video generation failed: {prediction.error or prediction.status}"
+        return result
+    except Exception as e:
+        return _replicate_error(str(e))
+
+
+def download_replicate_video(output_url, output_path):
+    """Download a finished Replicate output to output_path"""
+    try:
+        print(f"Downloading generated video from {output_url}")
+        with metrics.timed('provider_request_seconds', provider='replicate', call='download'):
+            download(output_url, output_path, 'replicate')
+        print(f"Video saved to {output_path}")
+        return {
+            'success': True,
+            'video_path': output_path
+        }
+    except Exception as e:
+        return _replicate_error(str(e))
+
 
 def generate_video_with_replicate(prompt, duration=8, size="1280x720", output_path="output.mp4", session_api_key=None):
     """
@@ -25,8 +175,6 @@ def generate_video_with_replicate(prompt, duration=8, size="1280x720", output_pa
         }
 
     try:
-        os.environ["REPLICATE_API_TOKEN"] = api_key
-
         # Map size to aspect ratio
         width, height = map(int, size.split('x'))
         aspect_ratio = f"{width}:{height}"
@@ -35,28 +183,35 @@ def generate_video_with_replicate(prompt, duration=8, size="1280x720", output_pa
         print(f"Prompt: {prompt}")
         print(f"Duration: {duration}s, Size: {size}")
 
-        # Use Stable Video Diffusion model
-        output = replicate.run(
-            "stability-ai/stable-video-diffusion:3f0457e4619daac51203dedb472816fd4af51f3149fa7a9e0b5ffcf1b8172438",
-            input={
-                "input_image": None,  # Text-to-video mode
-                "prompt": prompt,
-                "fps": 24,
-                "motion_bucket_id": 127,
-                "cond_aug": 0.02,
-                "decoding_t": 14,
-                "video_length": min(duration * 24, 96)  # Max 96 frames (4 seconds at 24fps)
-            }
-        )
+        # Use Stable Video Diffusion model; run() blocks until the prediction settles.
+        # It polls over the client's own bounded pool rather than holding a
+        # provider slot for minutes.
+        output = None
+        started = time.time()
+        try:
+            with replicate_client(api_key) as client:
+                output = client.run(
+                    f"{SVD_MODEL}:{SVD_VERSION}",
+                    input={
+                        "input_image": None,  # Text-to-video mode
+                        "prompt": prompt,
+                        "fps": 24,
+                        "motion_bucket_id": 127,
+                        "cond_aug": 0.02,
+                        "decoding_t": 14,
+                        "video_length": min(duration * 24, 96)  # Max 96 frames (4 seconds at 24fps)
+                    }
+                )
+        finally:
+            metrics.observe('provider_wait_seconds', time.time() - started, provider='replicate',
+                            outcome='completed' if output else 'failed')
 
         # Download the video
         if output:
             print("Downloading generated video...")
-            import urllib.request
-            # Handle both URL string and FileOutput object
-            video_url = str(output) if not isinstance(output, str) else output
+            video_url = _output_url(output)
             print(f"Video URL: {video_url}")
-            urllib.request.urlretrieve(video_url, output_path)
+            download(video_url, output_path, 'replicate')
 
             print(f"Video saved to {output_path}")
 
@@ -76,27 +231,7 @@ def generate_video_with_replicate(prompt, duration=8, size="1280x720", output_pa
         print(f"ERROR: Replicate API error: {error_message}")
         import traceback
         traceback.print_exc()
-
-        if "invalid_api_key" in error_message.lower() or "authentication" in error_message.lower():
-            return {
-                'success': False,
-                'error': 'Invalid Replicate API key. Get one at replicate.com and add it in Settings.'
-            }
-        elif "rate_limit" in error_message.lower():
-            return {
-                'success': False,
-                'error': 'Rate limit exceeded. Please wait and try again.'
-            }
-        elif "insufficient" in error_message.lower():
-            return {
-                'success': False,
-                'error': 'Insufficient credits. Visit replicate.com to add credits.'
-            }
-        else:
-            return {
-                'success': False,
-                'error': f'Replicate API error: {error_message}'
-            }
+        return _replicate_error(error_message)
 
 
 def generate_video_with_replicate_img2vid(prompt, image_path, duration=4, output_path="output.mp4"):
@@ -120,29 +255,31 @@ def generate_video_with_replicate_img2vid(prompt, image_path, duration=4, output
         }
 
     try:
-        os.environ["REPLICATE_API_TOKEN"] = replicate_api_key
-
         print(f"Creating Replicate image-to-video job...")
         print(f"Image: {image_path}")
 
-        with open(image_path, "rb") as img_file:
-            output = replicate.run(
-                "stability-ai/stable-video-diffusion:3f0457e4619daac51203dedb472816fd4af51f3149fa7a9e0b5ffcf1b8172438",
-                input={
-                    "input_image": img_file,
-                    "fps": 24,
-                    "motion_bucket_id": 127,
-                    "cond_aug": 0.02,
-                    "decoding_t": 14,
-                    "video_length": min(duration * 24, 96)
-                }
-            )
+        output = None
+        started = time.time()
+        with replicate_client(replicate_api_key) as client, open(image_path, "rb") as img_file:
+            try:
+                output = client.run(
+                    f"{SVD_MODEL}:{SVD_VERSION}",
+                    input={
+                        "input_image": img_file,
+                        "fps": 24,
+                        "motion_bucket_id": 127,
+                        "cond_aug": 0.02,
+                        "decoding_t": 14,
+                        "video_length": min(duration * 24, 96)
+                    }
+                )
+            finally:
+                metrics.observe('provider_wait_seconds', time.time() - started, provider='replicate',
+                                outcome='completed' if output else 'failed')
 
         if output:
-            import urllib.request
-            # Handle both URL string and FileOutput object
-            video_url = str(output) if not isinstance(output, str) else output
-            urllib.request.urlretrieve(video_url, output_path)
+            video_url = _output_url(output)
+            download(video_url, output_path, 'replicate')
 
             return {
                 'success': True,
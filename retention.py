@@ -0,0 +1,265 @@
+import fcntl
+import os
+import sqlite3
+import threading
+import time
+
+import asset_store
+from audio_prep import AUDIO_CACHE_FOLDER
+from batch_render import settle_batches
+from job_store import list_jobs, delete_job
+from render_jobs import STREAM_FOLDER, fail_orphaned_renders
+from storage import UPLOAD_FOLDER
+from upload_stream import INCOMING_FOLDER
+
+RETENTION_DB = os.path.join(UPLOAD_FOLDER, 'retention.db')
+OUTPUT_PREFIXES = ('video_', 'sora_', 'replicate_')
+
+# Policies, all in seconds or bytes
+RETENTION_INTERVAL = float(os.environ.get('RETENTION_INTERVAL', 3600))
+RETENTION_VIDEO_TTL = float(os.environ.get('RETENTION_VIDEO_TTL', 7 * 86400))
+RETENTION_ASSET_TTL = float(os.environ.get('RETENTION_ASSET_TTL', 86400))
+RETENTION_JOB_TTL = float(os.environ.get('RETENTION_JOB_TTL', 86400))
+RETENTION_INCOMING_TTL = float(os.environ.get('RETENTION_INCOMING_TTL', 3600))
+RETENTION_MAX_BYTES = int(os.environ.get('RETENTION_MAX_BYTES', 20 * 1024 ** 3))
+
+_collector = None
+_collector_lock = threading.Lock()
+
+
+def _connect():
+    db = sqlite3.connect(RETENTION_DB, timeout=10)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute(
+        'CREATE TABLE IF NOT EXISTS files ('
+        'path TEXT PRIMARY KEY, category TEXT NOT NULL, size INTEGER NOT NULL, accessed_at REAL NOT NULL)'
+    )
+    return db
+
+
+def record_access(path):
+    """Note that path was just served, pushing back its expiry"""
+    try:
+        db = _connect()
+        try:
+            with db:
+                db.execute('UPDATE files SET accessed_at = ? WHERE path = ?', (time.time(), path))
+        finally:
+            db.close()
+    except sqlite3.Error as e:
+        # Access times are advisory; never fail a download over them
+        print(f"Error recording access to {path}: {e}")
+
+
+def acquire_lease(path):
+    """
+    Take a shared lease that stops the collector deleting path
+
+    The lease is an flock on the file itself, held until the returned file
+    is closed (e.g. via response.call_on_close once a download finishes).
+
+    Returns:
+        Open file holding the lease, or None if the file is gone
+    """
+    try:
+        lease = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    fcntl.flock(lease, fcntl.LOCK_SH)
+    if os.fstat(lease.fileno()).st_nlink == 0:
+        # Deleted between open and lock
+        lease.close()
+        return None
+    return lease
+
+
+def remove_file(path):
+    """
+    Delete path unless a download holds a lease on it
+
+    Returns:
+        Bytes freed, or None if the file is leased or already gone
+    """
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    with f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        size = os.fstat(f.fileno()).st_size
+        os.remove(path)
+    return size
+
+
+def _scan_files():
+    """(path, category, size, mtime) for every render output and prepared track"""
+    found = []
+    for folder, category in ((UPLOAD_FOLDER, 'video'), (AUDIO_CACHE_FOLDER, 'audio')):
+        try:
+            it = os.scandir(folder)
+        except FileNotFoundError:
+            continue
+        with it:
+            for entry in it:
+                if category == 'video' and not (entry.name.startswith(OUTPUT_PREFIXES)
+                                                and entry.name.endswith('.mp4')):
+                    continue
+                if category == 'audio' and not entry.name.endswith('.m4a'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.is_file():
+                    found.append((entry.path, category, stat.st_size, stat.st_mtime))
+    return found
+
+
+def _sync_index(db, found):
+    """Bring the index in line with the disk and return {path: (category, size, accessed_at)}"""
+    indexed = {path: accessed_at for path, accessed_at in db.execute('SELECT path, accessed_at FROM files')}
+    entries = {}
+    with db:
+        for path, category, size, mtime in found:
+            # mtime also counts as an access: render cache hits touch it
+            accessed_at = max(indexed.pop(path, 0.0), mtime)
+            db.execute(
+                'INSERT OR REPLACE INTO files (path, category, size, accessed_at) VALUES (?, ?, ?, ?)',
+                (path, category, size, accessed_at)
+            )
+            entries[path] = (category, size, accessed_at)
+        db.executemany('DELETE FROM files WHERE path = ?', [(path,) for path in indexed])
+    return entries
+
+
+def _forget(db, path):
+    with db:
+        db.execute('DELETE FROM files WHERE path = ?', (path,))
+
+
+def collect(now=None):
+    """
+    Run one garbage collection pass
+
+    Fails renders orphaned by a crashed web worker, adopts remote jobs
+    whose poller exited and fails those nobody has polled within
+    REMOTE_STALE_AFTER, and settles batches whose variants have all
+    finished. Then removes, in order: finished job records past
+    RETENTION_JOB_TTL, upload spools abandoned by crashed requests and old
+    render streams, render outputs and prepared audio not served within
+    RETENTION_VIDEO_TTL / RETENTION_ASSET_TTL, and unreferenced assets idle
+    past RETENTION_ASSET_TTL. If what is left still exceeds
+    RETENTION_MAX_BYTES, the least recently accessed files go first.
+    Files leased by an in-progress download are always skipped.
+
+    Returns:
+        dict with 'removed' (files) and 'freed' (bytes), or None if another
+        process is already collecting
+    """
+    now = now or time.time()
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    with open(os.path.join(UPLOAD_FOLDER, '.retention.lock'), 'w') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+
+        removed = 0
+        freed = 0
+
+        fail_orphaned_renders(now=now)
+        # Imported here so render workers, which evict through this module,
+        # don't load the provider SDKs
+        from remote_jobs import resume_remote_jobs, fail_stale_remote_jobs
+        resume_remote_jobs()
+        fail_stale_remote_jobs(now=now)
+        settle_batches()
+        for job in list_jobs(statuses=('done', 'failed')):
+            if job['updated_at'] < now - RETENTION_JOB_TTL and delete_job(job['id']):
+                removed += 1
+
+        # Upload spools and live render streams are only useful while their
+        # request or render is running
+        for folder in (INCOMING_FOLDER, STREAM_FOLDER):
+            try:
+                with os.scandir(folder) as it:
+                    for entry in it:
+                        try:
+                            if entry.stat().st_mtime < now - RETENTION_INCOMING_TTL:
+                                freed += entry.stat().st_size
+                                os.remove(entry.path)
+                                removed += 1
+                        except FileNotFoundError:
+                            continue
+            except FileNotFoundError:
+                pass
+
+        db = _connect()
+        try:
+            entries = _sync_index(db, _scan_files())
+            ttls = {'video': RETENTION_VIDEO_TTL, 'audio': RETENTION_ASSET_TTL}
+            for path, (category, size, accessed_at) in list(entries.items()):
+                if accessed_at < now - ttls[category]:
+                    size = remove_file(path)
+                    if size is not None:
+                        _forget(db, path)
+                        del entries[path]
+                        removed += 1
+                        freed += size
+
+            idle_assets = []
+            for meta in asset_store.iter_assets():
+                asset_freed = asset_store.remove_unreferenced(
+                    meta['id'], idle_before=now - RETENTION_ASSET_TTL, stale_before=now - RETENTION_JOB_TTL
+                )
+                if asset_freed:
+                    removed += 1
+                    freed += asset_freed
+                elif meta['refs'] <= 0:
+                    idle_assets.append((meta.get('last_used', meta['created_at']), meta['id']))
+
+            total = sum(size for _, size, _ in entries.values())
+            total += sum(asset_store.disk_usage(asset_id) for _, asset_id in idle_assets)
+            if total > RETENTION_MAX_BYTES:
+                candidates = [(accessed_at, 'file', path) for path, (_, _, accessed_at) in entries.items()]
+                candidates += [(last_used, 'asset', asset_id) for last_used, asset_id in idle_assets]
+                for _, kind, target in sorted(candidates):
+                    if total <= RETENTION_MAX_BYTES:
+                        break
+                    if kind == 'asset':
+                        size = asset_store.remove_unreferenced(target) or None
+                    else:
+                        size = remove_file(target)
+                        if size is not None:
+                            _forget(db, target)
+                    if size is not None:
+                        total -= size
+                        removed += 1
+                        freed += size
+        finally:
+            db.close()
+
+    if removed:
+        print(f"Retention removed {removed} files, freed {freed // (1024 * 1024)} MB")
+    return {'removed': removed, 'freed': freed}
+
+
+def _collect_forever():
+    while True:
+        try:
+            collect()
+        except Exception as e:
+            print(f"Error collecting uploads: {e}")
+        time.sleep(RETENTION_INTERVAL)
+
+
+def start_collector():
+    """Start this process's collector thread; passes are serialized across processes"""
+    global _collector
+    with _collector_lock:
+        if _collector is None and RETENTION_INTERVAL > 0:
+            _collector = threading.Thread(target=_collect_forever, name='retention', daemon=True)
+            _collector.start()
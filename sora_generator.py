@@ -1,247 +1,259 @@
 import os
 import time
-from openai import OpenAI
 
-def generate_video_with_sora(prompt, duration=8, size="1280x720", output_path="output.mp4", session_api_key=None):
+import metrics
+from provider_clients import openai_client, provider_slot
+
+SORA_MODEL = "sora-2"
+SORA_POLL_INTERVAL = 10
+SORA_MAX_WAIT = 300  # 5 minutes max
+
+
+def _get_api_key(session_api_key=None):
+    return session_api_key or os.environ.get('OPENAI_API_KEY')
+
+
+def _missing_key_error():
+    return {
+        'success': False,
+        'error': 'OPENAI_API_KEY not found. Please add your OpenAI API key in Secrets or provide it for the session.'
+    }
+
+
+def _sora_duration(duration):
+    """Validate and convert duration to one of Sora's allowed string values"""
+    allowed_durations = ['4', '8', '12']
+    if isinstance(duration, int):
+        # Map any duration to nearest allowed value
+        if duration <= 4:
+            duration_str = '4'
+        elif duration <= 8:
+            duration_str = '8'
+        else:
+            duration_str = '12'
+    else:
+        duration_str = str(duration)
+
+    if duration_str not in allowed_durations:
+        duration_str = '8'  # Default to 8 if invalid
+    return duration_str
+
+
+def _sora_error(error_message):
+    """Translate common Sora API errors into user-facing messages"""
+    if "organization must be verified" in error_message.lower():
+        return {
+            'success': False,
+            'error': 'Your OpenAI organization needs verification. Visit platform.openai.com/settings/organization/general'
+        }
+    elif "rate_limit" in error_message.lower():
+        return {
+            'success': False,
+            'error': 'Rate limit exceeded. Please wait and try again.'
+        }
+    elif "insufficient_quota" in error_message.lower():
+        return {
+            'success': False,
+            'error': 'Insufficient API credits. Please check your OpenAI account balance.'
+        }
+    elif "invalid_api_key" in error_message.lower():
+        return {
+            'success': False,
+            'error': 'Invalid API key. Please check your OPENAI_API_KEY in Secrets or session.'
+        }
+    else:
+        return {
+            'success': False,
+            'error': f'Sora API error: {error_message}'
+        }
+
+
+def submit_sora_video(prompt, duration=8, size="1280x720", session_api_key=None, image_path=None):
     """
-    Generate video using OpenAI Sora API
+    Create a Sora generation job without waiting for it to finish
 
     Args:
         prompt: Text description for the video
         duration: Video duration in seconds (4-20)
         size: Video resolution (e.g., "1280x720", "1920x1080")
-        output_path: Path where the video will be saved
         session_api_key: Optional API key from session
+        image_path: Optional input reference image for image-to-video
 
     Returns:
-        dict with 'success', 'video_id', and 'error' keys
+        dict with 'success', 'video_id', 'status' and 'error' keys
     """
-    api_key = session_api_key or os.environ.get('OPENAI_API_KEY')
+    api_key = _get_api_key(session_api_key)
     if not api_key:
-        return {
-            'success': False,
-            'error': 'OPENAI_API_KEY not found. Please add your OpenAI API key in Secrets or provide it for the session.'
-        }
+        return _missing_key_error()
 
     try:
-        # Validate and convert duration to allowed string values
-        allowed_durations = ['4', '8', '12']
-        if isinstance(duration, int):
-            # Map any duration to nearest allowed value
-            if duration <= 4:
-                duration_str = '4'
-            elif duration <= 8:
-                duration_str = '8'
-            else:
-                duration_str = '12'
-        else:
-            duration_str = str(duration)
-
-        if duration_str not in allowed_durations:
-            duration_str = '8'  # Default to 8 if invalid
-
-        client = OpenAI(api_key=api_key)
+        duration_str = _sora_duration(duration)
 
         print(f"Creating Sora video generation job...")
         print(f"Prompt: {prompt}")
         print(f"Duration: {duration_str}s, Size: {size}")
 
-        # Create video generation job
-        video = client.videos.create(
-            model="sora-2",
-            prompt=prompt,
-            size=size,
-            seconds=duration_str
-        )
+        with openai_client(api_key) as client:
+            with provider_slot('sora'), metrics.timed('provider_request_seconds', provider='sora', call='submit'):
+                if image_path:
+                    print(f"Image: {image_path}")
+                    with open(image_path, "rb") as img_file:
+                        video = client.videos.create(
+                            model=SORA_MODEL,
+                            prompt=prompt,
+                            size=size,
+                            seconds=duration_str,
+                            input_reference=img_file
+                        )
+                else:
+                    video = client.videos.create(
+                        model=SORA_MODEL,
+                        prompt=prompt,
+                        size=size,
+                        seconds=duration_str
+                    )
 
         print(f"Video ID: {video.id}")
         print(f"Initial Status: {video.status}")
 
-        # Poll for completion
-        max_wait_time = 300  # 5 minutes max
-        start_time = time.time()
+        return {
+            'success': True,
+            'video_id': video.id,
+            'status': video.status
+        }
+    except Exception as e:
+        return _sora_error(str(e))
 
-        while video.status in ["queued", "in_progress"]:
-            if time.time() - start_time > max_wait_time:
-                return {
-                    'success': False,
-                    'error': 'Video generation timed out after 5 minutes'
-                }
 
-            time.sleep(10)
-            video = client.videos.retrieve(video.id)
-            progress = getattr(video, 'progress', 0)
-            print(f"Progress: {progress}% - Status: {video.status}")
+def check_sora_video(video_id, session_api_key=None):
+    """
+    Retrieve the current status of a Sora generation job
 
-        if video.status == "completed":
-            # Download the video
-            print("Downloading generated video...")
-            video_data = client.videos.download(video.id)
+    Returns:
+        dict with 'success', 'status', 'progress' and 'error' keys; status is
+        one of 'queued', 'in_progress', 'completed' or 'failed'
+    """
+    api_key = _get_api_key(session_api_key)
+    if not api_key:
+        return _missing_key_error()
 
-            with open(output_path, "wb") as f:
-                f.write(video_data)
+    try:
+        with openai_client(api_key) as client:
+            with provider_slot('sora'), metrics.timed('provider_request_seconds', provider='sora', call='check'):
+                video = client.videos.retrieve(video_id)
+        progress = getattr(video, 'progress', 0) or 0
+        print(f"Progress: {progress}% - Status: {video.status}")
+
+        result = {
+            'success': True,
+            'status': video.status,
+            'progress': progress
+        }
+        if video.status not in ["queued", "in_progress", "completed"]:
+            error_msg = getattr(video, 'error', None) or 'Unknown error'
+            result['error'] = f"Video generation failed: {error_msg}"
+        return result
+    except Exception as e:
+        return _sora_error(str(e))
 
-            print(f"Video saved to {output_path}")
 
-            return {
-                'success': True,
-                'video_path': output_path,
-                'video_id': video.id
-            }
-        else:
-            error_msg = getattr(video, 'error', 'Unknown error')
-            return {
-                'success': False,
-                'error': f"Video generation failed: {error_msg}"
-            }
+def download_sora_video(video_id, output_path, session_api_key=None):
+    """
+    Download a completed Sora video to output_path
+
+    Returns:
+        dict with 'success', 'video_path', 'video_id' and 'error' keys
+    """
+    api_key = _get_api_key(session_api_key)
+    if not api_key:
+        return _missing_key_error()
+
+    try:
+        print("Downloading generated video...")
+        with openai_client(api_key) as client:
+            with provider_slot('sora'), metrics.timed('provider_request_seconds', provider='sora', call='download'):
+                # Streamed to disk rather than held in memory
+                with client.videos.with_streaming_response.download_content(video_id) as response:
+                    response.stream_to_file(output_path)
+
+        print(f"Video saved to {output_path}")
 
+        return {
+            'success': True,
+            'video_path': output_path,
+            'video_id': video_id
+        }
     except Exception as e:
-        error_message = str(e)
+        return _sora_error(str(e))
 
-        # Handle common errors
-        if "organization must be verified" in error_message.lower():
-            return {
-                'success': False,
-                'error': 'Your OpenAI organization needs verification. Visit platform.openai.com/settings/organization/general'
-            }
-        elif "rate_limit" in error_message.lower():
-            return {
-                'success': False,
-                'error': 'Rate limit exceeded. Please wait and try again.'
-            }
-        elif "insufficient_quota" in error_message.lower():
-            return {
-                'success': False,
-                'error': 'Insufficient API credits. Please check your OpenAI account balance.'
-            }
-        elif "invalid_api_key" in error_message.lower():
-            return {
-                'success': False,
-                'error': 'Invalid API key. Please check your OPENAI_API_KEY in Secrets or session.'
-            }
-        else:
+
+def _wait_for_sora_video(video_id, output_path, session_api_key):
+    # Poll for completion
+    start_time = time.time()
+    status = check_sora_video(video_id, session_api_key)
+
+    while status.get('success') and status['status'] in ["queued", "in_progress"]:
+        if time.time() - start_time > SORA_MAX_WAIT:
+            metrics.observe('provider_wait_seconds', time.time() - start_time, provider='sora', outcome='timeout')
             return {
                 'success': False,
-                'error': f'Sora API error: {error_message}'
+                'error': 'Video generation timed out after 5 minutes'
             }
 
+        time.sleep(SORA_POLL_INTERVAL)
+        status = check_sora_video(video_id, session_api_key)
 
-def generate_video_with_image(prompt, image_path, duration=8, size="1280x720", output_path="output.mp4", session_api_key=None):
+    outcome = status['status'] if status.get('success') else 'failed'
+    metrics.observe('provider_wait_seconds', time.time() - start_time, provider='sora', outcome=outcome)
+    if not status.get('success'):
+        return status
+    if status['status'] == "completed":
+        return download_sora_video(video_id, output_path, session_api_key)
+    return {
+        'success': False,
+        'error': status.get('error', 'Video generation failed: Unknown error')
+    }
+
+
+def generate_video_with_sora(prompt, duration=8, size="1280x720", output_path="output.mp4", session_api_key=None):
     """
-    Generate video from image using OpenAI Sora API
+    Generate video using OpenAI Sora API
+
+    This blocks until the video is ready; the web app submits jobs through
+    remote_jobs instead so no request thread waits on Sora.
 
     Args:
         prompt: Text description for the video
-        image_path: Path to the input image
         duration: Video duration in seconds (4-20)
-        size: Video resolution
+        size: Video resolution (e.g., "1280x720", "1920x1080")
         output_path: Path where the video will be saved
         session_api_key: Optional API key from session
 
     Returns:
         dict with 'success', 'video_id', and 'error' keys
     """
-    api_key = session_api_key or os.environ.get('OPENAI_API_KEY')
-    if not api_key:
-        return {
-            'success': False,
-            'error': 'OPENAI_API_KEY not found. Please add your OpenAI API key in Secrets or provide it for the session.'
-        }
-
-    try:
-        # Validate and convert duration to allowed string values
-        allowed_durations = ['4', '8', '12']
-        if isinstance(duration, int):
-            if duration <= 4:
-                duration_str = '4'
-            elif duration <= 8:
-                duration_str = '8'
-            else:
-                duration_str = '12'
-        else:
-            duration_str = str(duration)
-
-        if duration_str not in allowed_durations:
-            duration_str = '8'
-
-        client = OpenAI(api_key=api_key)
-
-        print(f"Creating Sora image-to-video job...")
-        print(f"Image: {image_path}")
-        print(f"Prompt: {prompt}")
-        print(f"Duration: {duration_str}s")
-
-        with open(image_path, "rb") as img_file:
-            video = client.videos.create(
-                model="sora-2",
-                prompt=prompt,
-                size=size,
-                seconds=duration_str,
-                input_reference=img_file
-            )
-
-        print(f"Video ID: {video.id}")
-
-        # Poll for completion
-        max_wait_time = 300
-        start_time = time.time()
-
-        while video.status in ["queued", "in_progress"]:
-            if time.time() - start_time > max_wait_time:
-                return {
-                    'success': False,
-                    'error': 'Video generation timed out'
-                }
-
-            time.sleep(10)
-            video = client.videos.retrieve(video.id)
-            progress = getattr(video, 'progress', 0)
-            print(f"Progress: {progress}% - Status: {video.status}")
+    submitted = submit_sora_video(prompt, duration, size, session_api_key)
+    if not submitted.get('success'):
+        return submitted
+    return _wait_for_sora_video(submitted['video_id'], output_path, session_api_key)
 
-        if video.status == "completed":
-            video_data = client.videos.download(video.id)
 
-            with open(output_path, "wb") as f:
-                f.write(video_data)
-
-            return {
-                'success': True,
-                'video_path': output_path,
-                'video_id': video.id
-            }
-        else:
-            error_msg = getattr(video, 'error', 'Unknown error')
-            return {
-                'success': False,
-                'error': f"Video generation failed: {error_msg}"
-            }
+def generate_video_with_image(prompt, image_path, duration=8, size="1280x720", output_path="output.mp4", session_api_key=None):
+    """
+    Generate video from image using OpenAI Sora API
 
-    except Exception as e:
-        error_message = str(e)
+    Args:
+        prompt: Text description for the video
+        image_path: Path to the input image
+        duration: Video duration in seconds (4-20)
+        size: Video resolution
+        output_path: Path where the video will be saved
+        session_api_key: Optional API key from session
 
-        # Handle common errors
-        if "organization must be verified" in error_message.lower():
-            return {
-                'success': False,
-                'error': 'Your OpenAI organization needs verification. Visit platform.openai.com/settings/organization/general'
-            }
-        elif "rate_limit" in error_message.lower():
-            return {
-                'success': False,
-                'error': 'Rate limit exceeded. Please wait and try again.'
-            }
-        elif "insufficient_quota" in error_message.lower():
-            return {
-                'success': False,
-                'error': 'Insufficient API credits. Please check your OpenAI account balance.'
-            }
-        elif "invalid_api_key" in error_message.lower():
-            return {
-                'success': False,
-                'error': 'Invalid API key. Please check your OPENAI_API_KEY in Secrets or session.'
-            }
-        else:
-            return {
-                'success': False,
-                'error': f'Sora API error: {error_message}'
-            }
\ No newline at end of file
+    Returns:
+        dict with 'success', 'video_id', and 'error' keys
+    """
+    submitted = submit_sora_video(prompt, duration, size, session_api_key, image_path=image_path)
+    if not submitted.get('success'):
+        return submitted
+    return _wait_for_sora_video(submitted['video_id'], output_path, session_api_key)
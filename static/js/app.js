@@ -91,6 +91,52 @@ document.getElementById('templateSelect').addEventListener('change', function()
         });
 });
 
+// One download button per extra output format of a template render
+function showFormatLinks(outputs) {
+    const container = document.getElementById('formatLinks');
+    if (!container) return;
+    container.innerHTML = '';
+    if (!outputs || Object.keys(outputs).length < 2) return;
+    Object.entries(outputs).forEach(([name, output]) => {
+        const link = document.createElement('a');
+        link.className = 'btn btn-outline-success';
+        link.href = output.video_url;
+        link.setAttribute('download', '');
+        link.textContent = `Download ${name.replace('_', ' ')}`;
+        container.appendChild(link);
+    });
+}
+
+// Poll a background job until it finishes, updating the progress bar
+function waitForJob(statusUrl) {
+    const progressBar = document.getElementById('progressBar');
+    return new Promise((resolve, reject) => {
+        const poll = () => {
+            fetch(statusUrl)
+                .then(response => {
+                    if (!response.ok) {
+                        throw new Error(`HTTP error! status: ${response.status}`);
+                    }
+                    return response.json();
+                })
+                .then(job => {
+                    if (progressBar && job.progress) {
+                        progressBar.style.width = `${Math.max(5, Math.round(job.progress * 100))}%`;
+                    }
+                    if (job.status === 'done') {
+                        resolve(Object.assign({ success: true }, job.result));
+                    } else if (job.status === 'failed') {
+                        resolve({ success: false, error: job.error });
+                    } else {
+                        setTimeout(poll, 1000);
+                    }
+                })
+                .catch(reject);
+        };
+        poll();
+    });
+}
+
 document.getElementById('videoForm').addEventListener('submit', function(e) {
     e.preventDefault();
     
@@ -124,6 +170,16 @@ document.getElementById('videoForm').addEventListener('submit', function(e) {
     if (settings.background_color && generationMode === 'template') {
         formData.append('background_color', settings.background_color);
     }
+    if (settings.background_style && generationMode === 'template') {
+        formData.append('background_style', settings.background_style);
+    }
+    if (settings.output_formats && settings.output_formats.length && generationMode === 'template') {
+        formData.append('output_format', settings.output_formats.join(','));
+    }
+    if (settings.live_stream && generationMode === 'template') {
+        // Start playback from the live stream while the render is encoding
+        formData.append('stream', '1');
+    }
     
     let endpoint = '/generate_video';
     let requestBody = formData;
@@ -146,6 +202,7 @@ document.getElementById('videoForm').addEventListener('submit', function(e) {
     document.getElementById('btnText').classList.add('d-none');
     document.getElementById('btnSpinner').classList.remove('d-none');
     document.getElementById('progressSection').classList.remove('d-none');
+    document.getElementById('progressBar').style.width = '100%';
     document.getElementById('resultSection').classList.add('d-none');
     const errorSection = document.getElementById('errorSection');
     if (errorSection) errorSection.classList.add('d-none');
@@ -161,6 +218,8 @@ document.getElementById('videoForm').addEventListener('submit', function(e) {
         };
     }
     
+    let outputs = null;
+    let videoUrl = null;
     fetch(endpoint, fetchOptions)
     .then(response => {
         if (!response.ok) {
@@ -168,6 +227,23 @@ document.getElementById('videoForm').addEventListener('submit', function(e) {
         }
         return response.json();
     })
+    .then(data => {
+        outputs = data.outputs || null;
+        // The job polled below may be rendering another format when the
+        // requested one is already cached, so keep the requested format's URL
+        videoUrl = data.video_url || null;
+        if (data.success && data.stream_url) {
+            const videoPreview = document.getElementById('videoPreview');
+            videoPreview.src = data.stream_url;
+            videoPreview.dataset.streaming = 'true';
+            videoPreview.play().catch(() => {});
+            document.getElementById('resultSection').classList.remove('d-none');
+        }
+        if (data.success && data.status_url) {
+            return waitForJob(data.status_url);
+        }
+        return data;
+    })
     .then(data => {
         document.getElementById('generateBtn').disabled = false;
         document.getElementById('btnText').classList.remove('d-none');
@@ -178,8 +254,14 @@ document.getElementById('videoForm').addEventListener('submit', function(e) {
             const videoPreview = document.getElementById('videoPreview');
             const downloadLink = document.getElementById('downloadLink');
             
-            videoPreview.src = data.video_url.replace('/download_video/', '/preview_video/');
-            downloadLink.href = data.video_url;
+            // Swap the live stream for the seekable file unless it is still playing
+            const resultUrl = videoUrl || data.video_url;
+            if (videoPreview.dataset.streaming !== 'true' || videoPreview.paused || videoPreview.ended) {
+                videoPreview.src = resultUrl.replace('/download_video/', '/preview_video/');
+            }
+            delete videoPreview.dataset.streaming;
+            downloadLink.href = resultUrl;
+            showFormatLinks(outputs);
             
             document.getElementById('resultSection').classList.remove('d-none');
             
@@ -199,3 +281,59 @@ document.getElementById('videoForm').addEventListener('submit', function(e) {
         document.getElementById('errorSection').classList.remove('d-none');
     });
 });
+
+// Quick preview: render a strip of keyframes without encoding a video
+document.getElementById('previewBtn').addEventListener('click', function() {
+    if (generationMode !== 'template' || !currentTemplate) {
+        alert('Please select a video template');
+        return;
+    }
+
+    const formData = new FormData(document.getElementById('videoForm'));
+    const savedSettings = localStorage.getItem('videoGenSettings');
+    if (savedSettings) {
+        try {
+            const settings = JSON.parse(savedSettings);
+            if (settings.background_color) formData.append('background_color', settings.background_color);
+            if (settings.background_style) formData.append('background_style', settings.background_style);
+            if (settings.output_formats && settings.output_formats.length) {
+                formData.append('output_format', settings.output_formats.join(','));
+            }
+        } catch (e) {
+            console.error('Error loading settings:', e);
+        }
+    }
+
+    const previewBtn = this;
+    const strip = document.getElementById('keyframeStrip');
+    previewBtn.disabled = true;
+
+    fetch('/preview_video', { method: 'POST', body: formData })
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+            return response.json();
+        })
+        .then(data => {
+            previewBtn.disabled = false;
+            if (!data.success) {
+                throw new Error(data.error || 'Failed to render preview');
+            }
+            strip.innerHTML = '';
+            data.frames.forEach(frame => {
+                const img = document.createElement('img');
+                img.src = frame.image;
+                img.title = `${frame.time}s`;
+                img.style.width = '23%';
+                img.style.borderRadius = '6px';
+                strip.appendChild(img);
+            });
+            strip.classList.remove('d-none');
+        })
+        .catch(error => {
+            previewBtn.disabled = false;
+            document.getElementById('errorMessage').textContent = error.message || 'Failed to render preview';
+            document.getElementById('errorSection').classList.remove('d-none');
+        });
+});
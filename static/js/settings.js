@@ -39,6 +39,9 @@ document.getElementById('settingsForm').addEventListener('submit', function(e) {
 
     const settings = {
         background_color: document.getElementById('bgColor').value,
+        background_style: document.getElementById('bgStyle').value,
+        output_formats: Array.from(document.querySelectorAll('.output-format:checked')).map(input => input.value),
+        live_stream: document.getElementById('liveStream').checked,
         openai_api_key: document.getElementById('openaiApiKey').value,
         replicate_api_key: document.getElementById('replicateApiKey').value
     };
@@ -63,7 +66,10 @@ document.getElementById('settingsForm').addEventListener('submit', function(e) {
         if (data.success) {
             // Save only non-sensitive settings to localStorage
             localStorage.setItem('videoGenSettings', JSON.stringify({
-                background_color: settings.background_color
+                background_color: settings.background_color,
+                background_style: settings.background_style,
+                output_formats: settings.output_formats,
+                live_stream: settings.live_stream
             }));
 
             // Show success message
@@ -103,6 +109,15 @@ function loadSettings() {
                 document.getElementById('bgColorHex').value = settings.background_color;
                 document.getElementById('colorPreview').style.backgroundColor = settings.background_color;
             }
+            if (settings.background_style) {
+                document.getElementById('bgStyle').value = settings.background_style;
+            }
+            if (settings.output_formats) {
+                document.querySelectorAll('.output-format').forEach(input => {
+                    input.checked = settings.output_formats.includes(input.value);
+                });
+            }
+            document.getElementById('liveStream').checked = settings.live_stream === true;
         } catch (e) {
             console.error('Error loading settings:', e);
         }
@@ -0,0 +1,17 @@
+import os
+
+# Root of everything the app writes: uploads, renders, job records and caches
+UPLOAD_FOLDER = 'uploads'
+
+
+def pid_alive(pid):
+    """Whether the process that owns a job or snapshot is still running on this host"""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,355 @@
+import copy
+import json
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+from video_effects import BACKGROUND_STYLES, CROSSFADE_DURATION, EFFECT_NAMES
+
+# Used when the user leaves the custom text empty
+PLACEHOLDER_DEFAULTS = {
+    'Business Name': 'Your Business',
+    'Product Name': 'Product',
+    'Service Type': 'Service',
+    'Event Name': 'Event',
+    'App Name': 'App',
+}
+
+DEFAULT_BG_COLOR = (30, 60, 114)
+
+# One template per file; YAML files are read too when PyYAML is installed
+TEMPLATE_CATALOG_DIR = os.environ.get('TEMPLATE_CATALOG_DIR', 'template_catalog')
+TEMPLATE_RELOAD_INTERVAL = float(os.environ.get('TEMPLATE_RELOAD_INTERVAL', 2))
+CATALOG_EXTENSIONS = ('.json', '.yaml', '.yml')
+
+_PLACEHOLDER_RE = re.compile(r'\[([^\[\]]+)\]')
+
+
+class TemplateError(ValueError):
+    pass
+
+
+class TextSlot(namedtuple('TextSlot', 'parts placeholder start end position')):
+    """
+    A template text overlay with its placeholders parsed out
+
+    parts alternates literal text and placeholder names (odd indexes), so
+    filling it in is a join rather than a chain of replaces. start/end are
+    already clipped to the template duration.
+    """
+
+    __slots__ = ()
+
+    def resolve(self, custom_text=''):
+        """The slot's text with custom_text in its first placeholder and defaults elsewhere"""
+        pieces = []
+        for i, part in enumerate(self.parts):
+            if i % 2 == 0:
+                pieces.append(part)
+            elif custom_text and part == self.placeholder:
+                pieces.append(custom_text)
+            else:
+                pieces.append(PLACEHOLDER_DEFAULTS.get(part, f'[{part}]'))
+        return ''.join(pieces)
+
+
+class ImageSpan(namedtuple('ImageSpan', 'start end crossfade_in')):
+    """When the i-th uploaded image is on screen; crossfade_in is already subtracted from start"""
+
+    __slots__ = ()
+
+
+class CompiledTemplate(namedtuple('CompiledTemplate', [
+    'id', 'name', 'description', 'duration', 'image_slots', 'text_slots',
+    'effect_names', 'bg_color', 'bg_color_end', 'bg_style', 'image_spans', 'source',
+])):
+    """
+    An immutable, validated template ready for rendering
+
+    image_spans[n] is the layout for n uploaded images, precomputed for every
+    count up to image_slots. source is the original definition, returned by
+    as_dict() for the API and for render cache keys.
+    """
+
+    __slots__ = ()
+
+    def as_dict(self):
+        return copy.deepcopy(self.source)
+
+    def spans_for(self, image_count):
+        if image_count < len(self.image_spans):
+            return self.image_spans[image_count]
+        return _image_spans(self.duration, image_count, 'crossfade' in self.effect_names)
+
+    def text_overlays(self, custom_text=''):
+        """list of {'text', 'start', 'duration'} with placeholders filled in"""
+        return [{
+            'text': slot.resolve(custom_text),
+            'start': slot.start,
+            'duration': slot.end - slot.start,
+        } for slot in self.text_slots]
+
+
+def _image_spans(duration, count, crossfade):
+    """Images share the duration equally; a crossfade starts each later image early"""
+    spans = []
+    slot_duration = duration / max(count, 1)
+    for i in range(count):
+        start = i * slot_duration
+        end = min(start + slot_duration, duration)
+        if end <= start:
+            continue
+        crossfade_in = min(CROSSFADE_DURATION, start) if crossfade and i > 0 else 0.0
+        spans.append(ImageSpan(start - crossfade_in, end, crossfade_in))
+    return tuple(spans)
+
+
+def _color(value, field, template_id):
+    if (not isinstance(value, (list, tuple)) or len(value) != 3
+            or not all(isinstance(c, int) and 0 <= c <= 255 for c in value)):
+        raise TemplateError(f'Template {template_id}: {field} must be three 0-255 integers')
+    return tuple(value)
+
+
+def _number(value, field, template_id, minimum=0):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < minimum:
+        raise TemplateError(f'Template {template_id}: {field} must be a number >= {minimum}')
+    return value
+
+
+def _compile_text_slot(slot, duration, template_id):
+    if not isinstance(slot, dict) or not isinstance(slot.get('text'), str):
+        raise TemplateError(f'Template {template_id}: every text slot needs a text string')
+    start = _number(slot.get('start'), 'text slot start', template_id)
+    length = _number(slot.get('duration'), 'text slot duration', template_id)
+    parts = tuple(_PLACEHOLDER_RE.split(slot['text']))
+    placeholder = parts[1] if len(parts) > 1 else None
+    return TextSlot(parts, placeholder, start, min(start + length, duration), slot.get('position', 'center'))
+
+
+def compile_template(definition):
+    """
+    Validate a template definition and compile it
+
+    Args:
+        definition: dict parsed from a catalog file
+
+    Returns:
+        CompiledTemplate
+
+    Raises:
+        TemplateError: if the definition is malformed
+    """
+    if not isinstance(definition, dict):
+        raise TemplateError('Template definition must be a mapping')
+    template_id = definition.get('id')
+    if isinstance(template_id, bool) or not isinstance(template_id, int):
+        raise TemplateError(f'Template id must be an integer, got {template_id!r}')
+    for field in ('name', 'description'):
+        if not isinstance(definition.get(field), str):
+            raise TemplateError(f'Template {template_id}: {field} must be a string')
+
+    duration = _number(definition.get('duration'), 'duration', template_id, minimum=0.1)
+    image_slots = definition.get('image_slots', 0)
+    if isinstance(image_slots, bool) or not isinstance(image_slots, int) or image_slots < 0:
+        raise TemplateError(f'Template {template_id}: image_slots must be a non-negative integer')
+
+    effect_names = tuple(definition.get('transitions', [])) + tuple(definition.get('effects', []))
+    unknown = [name for name in effect_names if name not in EFFECT_NAMES]
+    if unknown:
+        raise TemplateError(f'Template {template_id}: unknown effects {unknown}')
+
+    bg_style = definition.get('bg_style', 'solid')
+    if bg_style not in BACKGROUND_STYLES:
+        raise TemplateError(f'Template {template_id}: unknown bg_style {bg_style!r}')
+    bg_color = _color(definition.get('bg_color', DEFAULT_BG_COLOR), 'bg_color', template_id)
+    bg_color_end = definition.get('bg_color_end')
+    if bg_color_end is not None:
+        bg_color_end = _color(bg_color_end, 'bg_color_end', template_id)
+
+    text_slots = tuple(
+        _compile_text_slot(slot, duration, template_id) for slot in definition.get('text_slots', [])
+    )
+    text_slots = tuple(slot for slot in text_slots if slot.end > slot.start)
+
+    crossfade = 'crossfade' in effect_names
+    image_spans = tuple(_image_spans(duration, count, crossfade) for count in range(image_slots + 1))
+
+    return CompiledTemplate(
+        id=template_id,
+        name=definition['name'],
+        description=definition['description'],
+        duration=duration,
+        image_slots=image_slots,
+        text_slots=text_slots,
+        effect_names=effect_names,
+        bg_color=bg_color,
+        bg_color_end=bg_color_end,
+        bg_style=bg_style,
+        image_spans=image_spans,
+        source=copy.deepcopy(definition),
+    )
+
+
+class TemplateIndex:
+    """Compiled templates by id, ordered by id; never modified once built"""
+
+    def __init__(self, templates):
+        self.by_id = {}
+        for template in templates:
+            if template.id in self.by_id:
+                raise TemplateError(f'Duplicate template id {template.id}')
+            self.by_id[template.id] = template
+        self.ordered = tuple(sorted(templates, key=lambda template: template.id))
+
+
+def _parse_file(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if path.endswith('.json'):
+        return json.loads(data)
+    if yaml is None:
+        raise TemplateError('PyYAML is not installed')
+    return yaml.safe_load(data)
+
+
+def _catalog_files(directory):
+    """{path: (mtime_ns, size)} of every template file in directory; empty if it doesn't exist"""
+    files = {}
+    try:
+        it = os.scandir(directory)
+    except FileNotFoundError:
+        print(f"Template catalog {directory} not found; no templates loaded")
+        return files
+    with it:
+        for entry in it:
+            if entry.name.startswith('.') or not entry.name.endswith(CATALOG_EXTENSIONS):
+                continue
+            stat = entry.stat()
+            files[entry.path] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+def load_catalog(files, previous=None):
+    """
+    Compile the given catalog files
+
+    Only files whose (mtime, size) differ from previous are read and
+    parsed again, so a reload of a large catalog costs one directory scan.
+    A file that cannot be parsed or is invalid (e.g. half-written) is logged
+    and keeps its last valid version, if it had one; otherwise it is left
+    out. One bad file never costs the rest of the catalog.
+
+    Args:
+        files: {path: (mtime_ns, size)} from _catalog_files
+        previous: The mapping returned by the last load_catalog call
+
+    Returns:
+        {path: ((mtime_ns, size), CompiledTemplate)}
+    """
+    previous = previous or {}
+    compiled = {}
+    for path, signature in files.items():
+        cached = previous.get(path)
+        if cached is not None and cached[0] == signature:
+            compiled[path] = cached
+            continue
+        try:
+            compiled[path] = (signature, compile_template(_parse_file(path)))
+        except Exception as e:
+            print(f"Skipping invalid template file {path}: {e}")
+            if cached is not None:
+                compiled[path] = cached
+    return compiled
+
+
+def _unique_templates(compiled):
+    """The compiled templates, keeping the first file (by path) for each id"""
+    templates = {}
+    for path in sorted(compiled):
+        template = compiled[path][1]
+        if template.id in templates:
+            print(f"Skipping template file {path}: duplicate template id {template.id}")
+            continue
+        templates[template.id] = template
+    return list(templates.values())
+
+
+_index = None
+_compiled_files = {}
+_catalog_signatures = None
+_reload_lock = threading.Lock()
+_reloader = None
+
+
+def reload_catalog(directory=None):
+    """
+    Pick up added, changed and removed catalog files
+
+    The new index is built off to the side and swapped in with a single
+    assignment, so lookups see either the old catalog or the new one.
+    Invalid files and duplicate ids are logged and skipped (see
+    load_catalog), and a missing directory is an empty catalog, so a
+    reload always produces an index. An invalid file is parsed again only
+    once it changes.
+
+    Returns:
+        True if a new index was swapped in
+    """
+    global _index, _compiled_files, _catalog_signatures
+    directory = directory or TEMPLATE_CATALOG_DIR
+    with _reload_lock:
+        files = _catalog_files(directory)
+        if _index is not None and files == _catalog_signatures:
+            return False
+        compiled = load_catalog(files, _compiled_files)
+        index = TemplateIndex(_unique_templates(compiled))
+        _compiled_files = compiled
+        _catalog_signatures = files
+        _index = index
+    print(f"Loaded {len(index.ordered)} templates from {directory}")
+    return True
+
+
+def _get_index():
+    if _index is None:
+        reload_catalog()
+    return _index
+
+
+def _watch_catalog():
+    while True:
+        time.sleep(TEMPLATE_RELOAD_INTERVAL)
+        try:
+            reload_catalog()
+        except Exception as e:
+            print(f"Error reloading templates, keeping the current catalog: {e}")
+
+
+def start_reloader():
+    """Poll the catalog directory for changes from a daemon thread"""
+    global _reloader
+    with _reload_lock:
+        if _reloader is None and TEMPLATE_RELOAD_INTERVAL > 0:
+            _reloader = threading.Thread(target=_watch_catalog, name='template-reload', daemon=True)
+            _reloader.start()
+
+
+def get_template(template_id):
+    """Return the CompiledTemplate for template_id (int or numeric string), or None"""
+    try:
+        template_id = int(template_id)
+    except (TypeError, ValueError):
+        return None
+    return _get_index().by_id.get(template_id)
+
+
+def all_templates():
+    return _get_index().ordered
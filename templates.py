@@ -1,146 +1,3 @@
-VIDEO_TEMPLATES = [
-    {
-        "id": 1,
-        "name": "Corporate Introduction",
-        "description": "Professional introduction for your business",
-        "transitions": ["fadein", "fadeout"],
-        "duration": 10,
-        "text_slots": [
-            {"text": "Welcome to [Business Name]", "position": "center", "start": 1, "duration": 3},
-            {"text": "Innovative Solutions for You", "position": "center", "start": 5, "duration": 3}
-        ],
-        "image_slots": 2,
-        "effects": ["disintegrate"],
-        "bg_color": (30, 60, 114)
-    },
-    {
-        "id": 2,
-        "name": "Product Launch",
-        "description": "Exciting announcement for new products",
-        "transitions": ["zoom", "slide"],
-        "duration": 12,
-        "text_slots": [
-            {"text": "Introducing [Product Name]", "position": "center", "start": 2, "duration": 4},
-            {"text": "Get Yours Today!", "position": "center", "start": 7, "duration": 3}
-        ],
-        "image_slots": 3,
-        "effects": ["reintegrate"],
-        "bg_color": (220, 50, 50)
-    },
-    {
-        "id": 3,
-        "name": "Testimonial Video",
-        "description": "Showcase customer success stories",
-        "transitions": ["crossfade"],
-        "duration": 15,
-        "text_slots": [
-            {"text": "What Our Customers Are Saying", "position": "center", "start": 1, "duration": 4},
-            {"text": "Real Stories, Real Results", "position": "center", "start": 9, "duration": 4}
-        ],
-        "image_slots": 2,
-        "effects": ["disintegrate", "reintegrate"],
-        "bg_color": (70, 130, 180)
-    },
-    {
-        "id": 4,
-        "name": "Sale Promotion",
-        "description": "Drive urgency with special offers",
-        "transitions": ["fadein", "zoom"],
-        "duration": 8,
-        "text_slots": [
-            {"text": "Limited Time Offer!", "position": "center", "start": 1, "duration": 3},
-            {"text": "Up to 50% Off", "position": "center", "start": 4, "duration": 3}
-        ],
-        "image_slots": 2,
-        "effects": ["zoom"],
-        "bg_color": (255, 140, 0)
-    },
-    {
-        "id": 5,
-        "name": "Event Announcement",
-        "description": "Promote upcoming conferences and seminars",
-        "transitions": ["slide", "fadeout"],
-        "duration": 10,
-        "text_slots": [
-            {"text": "Join Us at [Event Name]", "position": "center", "start": 1, "duration": 4},
-            {"text": "Register Now", "position": "center", "start": 6, "duration": 3}
-        ],
-        "image_slots": 2,
-        "effects": ["fadein"],
-        "bg_color": (138, 43, 226)
-    },
-    {
-        "id": 6,
-        "name": "Service Showcase",
-        "description": "Highlight your professional services",
-        "transitions": ["crossfade", "fadein"],
-        "duration": 12,
-        "text_slots": [
-            {"text": "Expert [Service Type]", "position": "center", "start": 2, "duration": 4},
-            {"text": "Quality You Can Trust", "position": "center", "start": 7, "duration": 3}
-        ],
-        "image_slots": 3,
-        "effects": ["reintegrate"],
-        "bg_color": (46, 139, 87)
-    },
-    {
-        "id": 7,
-        "name": "App Demo",
-        "description": "Showcase your mobile or web application",
-        "transitions": ["zoom", "slide"],
-        "duration": 15,
-        "text_slots": [
-            {"text": "Discover [App Name]", "position": "center", "start": 1, "duration": 4},
-            {"text": "Download Today", "position": "center", "start": 10, "duration": 3}
-        ],
-        "image_slots": 4,
-        "effects": ["disintegrate"],
-        "bg_color": (72, 209, 204)
-    },
-    {
-        "id": 8,
-        "name": "Restaurant Menu",
-        "description": "Showcase delicious dishes and specials",
-        "transitions": ["fadein", "crossfade"],
-        "duration": 12,
-        "text_slots": [
-            {"text": "Taste the Difference", "position": "center", "start": 2, "duration": 3},
-            {"text": "Visit Us Today", "position": "center", "start": 8, "duration": 3}
-        ],
-        "image_slots": 3,
-        "effects": ["zoom"],
-        "bg_color": (165, 42, 42)
-    },
-    {
-        "id": 9,
-        "name": "Fashion Collection",
-        "description": "Display your latest fashion line",
-        "transitions": ["slide", "zoom"],
-        "duration": 14,
-        "text_slots": [
-            {"text": "New Collection", "position": "center", "start": 2, "duration": 4},
-            {"text": "Shop Now", "position": "center", "start": 9, "duration": 3}
-        ],
-        "image_slots": 4,
-        "effects": ["reintegrate"],
-        "bg_color": (199, 21, 133)
-    },
-    {
-        "id": 10,
-        "name": "Fitness Program",
-        "description": "Promote health and fitness services",
-        "transitions": ["zoom", "fadeout"],
-        "duration": 10,
-        "text_slots": [
-            {"text": "Transform Your Life", "position": "center", "start": 1, "duration": 4},
-            {"text": "Start Your Journey", "position": "center", "start": 6, "duration": 3}
-        ],
-        "image_slots": 2,
-        "effects": ["fadein"],
-        "bg_color": (255, 99, 71)
-    }
-]
-
 TEXT_PROMPTS = [
     "Generate a promotional video for my [product/service].",
     "Create an ad to introduce our new collection of [clothing/accessories].",
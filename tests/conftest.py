@@ -0,0 +1,39 @@
+import concurrent.futures
+import importlib
+import os
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class RecordingExecutor:
+    """Stands in for the render pool and keeps what was submitted instead of running it"""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        self.submitted.append(args)
+        return concurrent.futures.Future()
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setenv('SESSION_SECRET', 'test')
+    monkeypatch.setenv('RETENTION_INTERVAL', '0')
+    monkeypatch.setenv('TEMPLATE_RELOAD_INTERVAL', '0')
+    # uploads/ (jobs, assets, renders) is relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    app = importlib.import_module('app')
+    import template_registry
+    template_registry.reload_catalog(os.path.join(REPO_ROOT, 'template_catalog'))
+    return app.app.test_client()
+
+
+@pytest.fixture
+def render_pool(monkeypatch):
+    import render_jobs
+    executor = RecordingExecutor()
+    monkeypatch.setattr(render_jobs, '_get_executor', lambda: executor)
+    return executor
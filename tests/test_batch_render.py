@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+from batch_render import batch_status, settle_batches
+from job_store import create_job, delete_job, get_job, update_job
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    # Job records live under uploads/ relative to the working directory
+    monkeypatch.chdir(tmp_path)
+
+
+def make_batch(*job_statuses):
+    variants = []
+    for number, status in enumerate(job_statuses, 1):
+        job = create_job('render', video_filename=f'video_{number}.mp4')
+        update_job(job['id'], status=status)
+        variants.append({'name': str(number), 'video_filename': f'video_{number}.mp4', 'job_id': job['id']})
+    return create_job('batch', template_id=1, variants=variants)
+
+
+def test_batch_status_does_not_write():
+    batch = make_batch('done', 'failed')
+
+    assert batch_status(get_job(batch['id']))['status'] == 'done'
+    assert get_job(batch['id']) == batch
+
+
+def test_settle_batches_marks_finished_batches():
+    finished = make_batch('done', 'done')
+    all_failed = make_batch('failed')
+    running = make_batch('done', 'running')
+
+    assert settle_batches() == 2
+    assert get_job(finished['id'])['status'] == 'done'
+    assert get_job(all_failed['id'])['status'] == 'failed'
+    assert get_job(running['id'])['status'] == 'queued'
+
+
+def test_expired_variant_with_video_is_done():
+    batch = make_batch('done', 'done')
+    for variant in batch['variants']:
+        delete_job(variant['job_id'])
+    open(os.path.join('uploads', 'video_1.mp4'), 'wb').close()
+
+    variants = batch_status(batch)['variants']
+    assert [variant['status'] for variant in variants] == ['done', 'failed']
+    assert variants[0]['video_url'] == '/download_video/video_1.mp4'
+    assert variants[1]['error'] == 'Job record expired'
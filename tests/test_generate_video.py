@@ -0,0 +1,38 @@
+import io
+
+from PIL import Image
+
+import asset_store
+import render_cache
+
+
+def png_upload():
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), 'red').save(buffer, format='PNG')
+    buffer.seek(0)
+    return buffer, 'photo.png'
+
+
+def test_failed_request_releases_uploaded_assets(client, render_pool, monkeypatch):
+    def broken_render_key(*args, **kwargs):
+        raise RuntimeError('render key failed')
+    monkeypatch.setattr(render_cache, 'render_key', broken_render_key)
+
+    response = client.post('/generate_video', data={
+        'template_id': '1', 'custom_text': 'Leak check', 'image_0': png_upload()
+    }, content_type='multipart/form-data')
+
+    assert response.status_code == 500
+    assets = list(asset_store.iter_assets())
+    assert len(assets) == 1
+    assert assets[0]['refs'] == 0
+    assert not render_pool.submitted
+
+
+def test_queued_render_keeps_uploaded_assets(client, render_pool):
+    response = client.post('/generate_video', data={
+        'template_id': '1', 'custom_text': 'Held by render', 'image_0': png_upload()
+    }, content_type='multipart/form-data')
+
+    assert response.status_code == 202
+    assert [meta['refs'] for meta in asset_store.iter_assets()] == [1]
@@ -0,0 +1,17 @@
+import os
+
+
+def test_cached_primary_keeps_its_video_url(client, render_pool):
+    form = {'template_id': '1', 'custom_text': 'Formats'}
+    landscape = client.post('/generate_video', data={**form, 'output_format': 'landscape'}).get_json()
+    # Finish the landscape render
+    filename = landscape['video_url'].rsplit('/', 1)[1]
+    open(os.path.join('uploads', filename), 'wb').close()
+
+    response = client.post('/generate_video', data={**form, 'output_format': 'landscape,square'})
+
+    assert response.status_code == 202
+    data = response.get_json()
+    assert data['video_url'] == landscape['video_url']
+    assert data['outputs']['landscape']['job_id'] is None
+    assert data['job_id'] == data['outputs']['square']['job_id']
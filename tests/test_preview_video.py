@@ -0,0 +1,55 @@
+import io
+
+from PIL import Image
+
+import asset_store
+import image_ingest
+
+
+def queued_profile(render_pool):
+    assert len(render_pool.submitted) == 1
+    _, render_kwargs, _, _, _ = render_pool.submitted[0]
+    return render_kwargs['render_profile']
+
+
+def test_preview_video_format_queues_preview_render(client, render_pool):
+    response = client.post('/preview_video', data={
+        'template_id': '1', 'custom_text': 'Preview profile', 'format': 'video'
+    })
+    assert response.status_code == 202
+    assert queued_profile(render_pool) == 'preview'
+
+
+def test_preview_video_format_overrides_requested_profile(client, render_pool):
+    response = client.post('/preview_video', data={
+        'template_id': '1', 'custom_text': 'Preview override', 'format': 'video', 'render_profile': 'final'
+    })
+    assert response.status_code == 202
+    assert queued_profile(render_pool) == 'preview'
+
+
+def test_generate_video_keeps_requested_profile(client, render_pool):
+    response = client.post('/generate_video', data={
+        'template_id': '1', 'custom_text': 'Final profile', 'render_profile': 'final'
+    })
+    assert response.status_code == 202
+    assert queued_profile(render_pool) == 'final'
+
+
+def test_keyframe_preview_does_not_store_uploads(client, monkeypatch):
+    ingested = []
+    ingest_image = image_ingest.ingest_image
+    monkeypatch.setattr('video_generator.ingest_image',
+                        lambda src, dest, size: ingested.append(size) or ingest_image(src, dest, size))
+    buffer = io.BytesIO()
+    Image.new('RGB', (1600, 1200), 'blue').save(buffer, format='JPEG')
+    buffer.seek(0)
+
+    response = client.post('/preview_video', data={
+        'template_id': '1', 'custom_text': 'Keyframes', 'image_0': (buffer, 'photo.jpg')
+    }, content_type='multipart/form-data')
+
+    assert response.status_code == 200
+    assert len(response.get_json()['frames']) == 8
+    assert ingested == [(480, 270)]
+    assert list(asset_store.iter_assets()) == []
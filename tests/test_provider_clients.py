@@ -0,0 +1,45 @@
+import pytest
+
+import provider_clients
+
+
+class FakeClient:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def small_pool(monkeypatch):
+    monkeypatch.setattr(provider_clients, 'PROVIDER_CLIENT_CACHE_SIZE', 1)
+    monkeypatch.setattr(provider_clients, '_owner_pid', None)
+
+
+def lease(api_key):
+    def build():
+        client = FakeClient()
+        return client, client.close
+    return provider_clients._pooled('test', api_key, build)
+
+
+def test_reuses_client_for_same_key():
+    with lease('a') as first, lease('a') as second:
+        assert first is second
+
+
+def test_closes_evicted_idle_client():
+    with lease('a') as evicted:
+        pass
+    with lease('b'):
+        assert evicted.closed
+
+
+def test_closes_evicted_client_after_last_user():
+    with lease('a') as evicted:
+        with lease('b') as current:
+            assert not evicted.closed
+        assert not evicted.closed
+    assert evicted.closed
+    assert not current.closed
@@ -0,0 +1,37 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+import remote_jobs
+from job_store import create_job, get_job, update_job
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+
+def make_remote(status='running'):
+    job = create_job('remote', provider='sora', params={}, output_path='uploads/sora_test.mp4',
+                     video_filename='sora_test.mp4', remote_id='remote-1', owner_pid=os.getpid())
+    return update_job(job['id'], status=status)
+
+
+def test_timeout_error_names_configured_wait(monkeypatch):
+    monkeypatch.setattr(remote_jobs, 'REMOTE_MAX_WAIT', 90)
+    job = make_remote()
+
+    asyncio.run(remote_jobs._track(job['id'], 'sora', {}, None, job['output_path'],
+                                   remote_id='remote-1', started_at=time.time() - 120))
+
+    assert get_job(job['id'])['error'] == 'Video generation timed out after 90 seconds'
+
+
+def test_fail_stale_remote_jobs():
+    job = make_remote()
+
+    assert remote_jobs.fail_stale_remote_jobs() == 0
+    assert remote_jobs.fail_stale_remote_jobs(now=time.time() + remote_jobs.REMOTE_STALE_AFTER + 1) == 1
+    assert get_job(job['id'])['status'] == 'failed'
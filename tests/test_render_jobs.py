@@ -0,0 +1,90 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import render_cache
+import render_jobs
+from job_store import create_job, get_job, update_job
+from render_jobs import RenderQueueFull, fail_orphaned_renders
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+
+@pytest.fixture(scope='module')
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def make_render(key, owner_pid, status='queued'):
+    job = create_job('render', video_filename=render_cache.cached_filename(key), owner_pid=owner_pid,
+                     cache_keys=[key])
+    update_job(job['id'], status=status)
+    render_cache.record_inflight(key, job['id'])
+    return job
+
+
+def test_inflight_job_joins_live_render():
+    job = make_render('live', os.getpid())
+    assert render_cache.inflight_job('live')['id'] == job['id']
+
+
+def test_inflight_job_drops_render_with_dead_owner(dead_pid):
+    make_render('dead', dead_pid)
+    assert render_cache.inflight_job('dead') is None
+    assert not os.path.exists(render_cache._inflight_path('dead'))
+
+
+def test_inflight_job_drops_stale_render(monkeypatch):
+    make_render('stale', os.getpid())
+    monkeypatch.setattr('render_jobs.RENDER_STALE_AFTER', -1)
+    assert render_cache.inflight_job('stale') is None
+
+
+def test_fail_orphaned_renders(dead_pid):
+    orphaned = make_render('dead', dead_pid, status='running')
+    live = make_render('live', os.getpid())
+
+    assert fail_orphaned_renders() == 1
+    assert get_job(orphaned['id'])['status'] == 'failed'
+    assert not os.path.exists(render_cache._inflight_path('dead'))
+    assert get_job(live['id'])['status'] == 'queued'
+
+    assert fail_orphaned_renders(now=time.time() + 7200) == 1
+    assert get_job(live['id'])['status'] == 'failed'
+
+
+def publish_pending(pid, count):
+    os.makedirs(render_jobs.RENDER_QUEUE_FOLDER, exist_ok=True)
+    with open(os.path.join(render_jobs.RENDER_QUEUE_FOLDER, str(pid)), 'w') as f:
+        f.write(str(count))
+
+
+def test_queue_limit_counts_other_live_web_workers(monkeypatch, dead_pid):
+    monkeypatch.setattr(render_jobs, 'RENDER_QUEUE_LIMIT', 3)
+    monkeypatch.setattr(render_jobs, '_pending', 0)
+    publish_pending(os.getppid(), 2)
+    publish_pending(dead_pid, 5)
+
+    render_jobs._reserve(1)
+    with pytest.raises(RenderQueueFull):
+        render_jobs._reserve(1)
+    assert not os.path.exists(os.path.join(render_jobs.RENDER_QUEUE_FOLDER, str(dead_pid)))
+
+    render_jobs._release(1)
+    render_jobs._reserve(1)
+
+
+def test_render_slots_are_exclusive(monkeypatch):
+    monkeypatch.setattr(render_jobs, 'RENDER_WORKERS', 2)
+    with render_jobs._acquire_render_slot() as first, render_jobs._acquire_render_slot() as second:
+        assert first.name != second.name
+    with render_jobs._acquire_render_slot() as slot:
+        assert slot.name == first.name
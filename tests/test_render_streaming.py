@@ -0,0 +1,24 @@
+def queued_render(render_pool):
+    assert len(render_pool.submitted) == 1
+    _, render_kwargs, _, _, _ = render_pool.submitted[0]
+    return render_kwargs
+
+
+def test_stream_flag_ignored_unless_enabled(client, render_pool, monkeypatch):
+    monkeypatch.setitem(client.application.config, 'RENDER_STREAMING', False)
+    response = client.post('/generate_video', data={
+        'template_id': '1', 'custom_text': 'Streaming off', 'stream': '1'
+    })
+    assert response.status_code == 202
+    assert 'stream_url' not in response.get_json()
+    assert 'stream_path' not in queued_render(render_pool)
+
+
+def test_stream_flag_streams_when_enabled(client, render_pool, monkeypatch):
+    monkeypatch.setitem(client.application.config, 'RENDER_STREAMING', True)
+    response = client.post('/generate_video', data={
+        'template_id': '1', 'custom_text': 'Streaming on', 'stream': '1'
+    })
+    assert response.status_code == 202
+    assert response.get_json()['stream_url'].startswith('/stream_video/')
+    assert 'stream_path' in queued_render(render_pool)
@@ -0,0 +1,60 @@
+import json
+import os
+
+import pytest
+
+import template_registry
+
+
+@pytest.fixture(autouse=True)
+def fresh_registry(monkeypatch):
+    monkeypatch.setattr(template_registry, '_index', None)
+    monkeypatch.setattr(template_registry, '_compiled_files', {})
+    monkeypatch.setattr(template_registry, '_catalog_signatures', None)
+
+
+def write_template(folder, filename, template_id, name='Template', **fields):
+    definition = {'id': template_id, 'name': name, 'description': 'Test', 'duration': 5, **fields}
+    path = os.path.join(folder, filename)
+    with open(path, 'w') as f:
+        json.dump(definition, f)
+    return path
+
+
+def test_invalid_file_is_skipped(tmp_path):
+    write_template(tmp_path, 'a.json', 1)
+    (tmp_path / 'b.json').write_text('{"id": 2, "name": ')
+    write_template(tmp_path, 'c.json', 3, effects=['no-such-effect'])
+
+    template_registry.reload_catalog(str(tmp_path))
+
+    assert [template.id for template in template_registry.all_templates()] == [1]
+
+
+def test_broken_edit_keeps_last_valid_version(tmp_path):
+    path = write_template(tmp_path, 'a.json', 1, name='Before')
+    template_registry.reload_catalog(str(tmp_path))
+
+    with open(path, 'w') as f:
+        f.write('{"id": 1, "name": "After", ')
+    os.utime(path, ns=(1, 1))
+    template_registry.reload_catalog(str(tmp_path))
+
+    assert template_registry.get_template(1).name == 'Before'
+
+
+def test_duplicate_id_keeps_first_file(tmp_path):
+    write_template(tmp_path, 'a.json', 1, name='First')
+    write_template(tmp_path, 'b.json', 1, name='Second')
+    write_template(tmp_path, 'c.json', 2)
+
+    template_registry.reload_catalog(str(tmp_path))
+
+    assert template_registry.get_template(1).name == 'First'
+    assert template_registry.get_template(2) is not None
+
+
+def test_missing_directory_is_an_empty_catalog(tmp_path):
+    template_registry.reload_catalog(str(tmp_path / 'missing'))
+
+    assert template_registry.all_templates() == ()
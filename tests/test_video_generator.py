@@ -0,0 +1,36 @@
+import os
+
+import pytest
+
+import asset_store
+from audio_prep import AudioPrepError
+from render_cache import file_digest
+import template_registry
+from video_generator import generate_video
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    template_registry.reload_catalog(os.path.join(REPO_ROOT, 'template_catalog'))
+
+
+def store_bytes(data, kind):
+    os.makedirs(asset_store.ASSETS_FOLDER, exist_ok=True)
+    path = os.path.join(asset_store.ASSETS_FOLDER, '.upload')
+    with open(path, 'wb') as f:
+        f.write(data)
+    return asset_store.put(path, file_digest(path), kind)
+
+
+def test_unusable_music_fails_instead_of_publishing_silent_video():
+    template = template_registry.all_templates()[0]
+    audio_asset = store_bytes(b'not really audio', 'audio')
+    output_path = os.path.join('uploads', 'video_with_music.mp4')
+
+    with pytest.raises(AudioPrepError):
+        generate_video(template, [], template.text_overlays('Music'), audio_asset, output_path,
+                       render_profile='preview')
+    assert not os.path.exists(output_path)
@@ -0,0 +1,252 @@
+import hashlib
+import os
+import tempfile
+import uuid
+
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge
+
+import asset_store
+import metrics
+from render_cache import file_digest
+from storage import UPLOAD_FOLDER
+
+INCOMING_FOLDER = os.path.join(UPLOAD_FOLDER, 'incoming')
+
+IMAGE_TYPES = {'png', 'jpeg', 'gif', 'webp'}
+AUDIO_TYPES = {'mp3', 'wav', 'ogg', 'm4a'}
+
+_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+_AUDIO_EXTENSIONS = {'mp3', 'wav', 'ogg', 'm4a'}
+# Text inputs such as batch variant lists; kept without a magic check
+_DATA_EXTENSIONS = {'csv', 'jsonl', 'ndjson', 'txt'}
+
+# Enough of the header to recognise every supported container
+_SNIFF_SIZE = 12
+
+
+def sniff_type(head):
+    """
+    Identify an upload from its first bytes
+
+    Args:
+        head: The first bytes of the file (at least 12 for RIFF/ftyp formats)
+
+    Returns:
+        One of IMAGE_TYPES or AUDIO_TYPES, or None if unrecognised
+    """
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head.startswith((b'GIF87a', b'GIF89a')):
+        return 'gif'
+    if head.startswith(b'RIFF') and head[8:12] == b'WEBP':
+        return 'webp'
+    if head.startswith(b'RIFF') and head[8:12] == b'WAVE':
+        return 'wav'
+    if head.startswith(b'OggS'):
+        return 'ogg'
+    if head[4:8] == b'ftyp':
+        return 'm4a'
+    # MP3: an ID3v2 tag, or a bare MPEG audio frame sync
+    if head.startswith(b'ID3') or (len(head) >= 2 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return 'mp3'
+    return None
+
+
+def _extension(filename):
+    if not filename or '.' not in filename:
+        return ''
+    return filename.rsplit('.', 1)[1].lower()
+
+
+class UploadSpool:
+    """
+    Writable file-like target for one multipart file part
+
+    Werkzeug writes each chunk here as it is parsed, so a part is never held
+    in memory. The SHA-256 digest and the magic-byte type are computed as the
+    data streams through. Parts that fail the magic check, or whose extension
+    is not accepted at all, are counted but not written to disk. Text parts
+    are kept without a magic check (sniff=False).
+
+    Args:
+        directory: Folder for the spooled temp file
+        max_size: Largest accepted part in bytes; larger parts abort the
+            request with 413 as soon as the limit is crossed
+        discard: Count the part without keeping it
+        sniff: Discard the part unless its first bytes are a supported type
+    """
+
+    def __init__(self, directory, max_size, discard=False, sniff=True):
+        self.max_size = max_size
+        self.size = 0
+        self.kind = None
+        self.path = None
+        self._head = b''
+        self._hash = hashlib.sha256()
+        self._file = None
+        self._discard = discard
+        self._sniff = sniff
+        self._claimed = False
+        if not discard:
+            os.makedirs(directory, exist_ok=True)
+            self._file = tempfile.NamedTemporaryFile(dir=directory, prefix='.upload_', delete=False)
+            self.path = self._file.name
+
+    @property
+    def digest(self):
+        """SHA-256 hex digest of the part, or None if it was discarded"""
+        return None if self._discard else self._hash.hexdigest()
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise RequestEntityTooLarge(f'Uploaded file exceeds {self.max_size // (1024 * 1024)} MB')
+
+        if len(self._head) < _SNIFF_SIZE:
+            self._head += data[:_SNIFF_SIZE - len(self._head)]
+            if len(self._head) >= _SNIFF_SIZE:
+                self._check_type()
+        if self._discard:
+            return len(data)
+
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def _check_type(self):
+        self.kind = sniff_type(self._head)
+        if self.kind is None and self._sniff and not self._discard:
+            # Not a file we can use; stop spending disk on the rest of it
+            self._file.close()
+            os.remove(self.path)
+            self._file = None
+            self.path = None
+            self._discard = True
+
+    def seek(self, offset, whence=0):
+        if len(self._head) < _SNIFF_SIZE and self.kind is None:
+            # Werkzeug rewinds once the part is complete; short files end here
+            self._check_type()
+        if self._file is None:
+            return 0
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell() if self._file else 0
+
+    def read(self, size=-1):
+        return self._file.read(size) if self._file else b''
+
+    def readline(self, size=-1):
+        return self._file.readline(size) if self._file else b''
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def flush(self):
+        if self._file:
+            self._file.flush()
+
+    def claim(self, dest_path):
+        """Move the spooled part to dest_path; returns False if nothing was kept"""
+        if self._file is None:
+            return False
+        self._file.close()
+        os.replace(self.path, dest_path)
+        self._file = None
+        self.path = dest_path
+        self._claimed = True
+        return True
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.path and not self._claimed:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+
+
+class StreamingRequest(Request):
+    """Request class that spools file uploads through UploadSpool"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        config = current_app.config
+        ext = _extension(filename)
+        if ext in _AUDIO_EXTENSIONS:
+            max_size = config['MAX_AUDIO_UPLOAD_SIZE']
+        elif ext in _DATA_EXTENSIONS:
+            max_size = config['MAX_DATA_UPLOAD_SIZE']
+        else:
+            max_size = config['MAX_IMAGE_UPLOAD_SIZE']
+        if content_length and content_length > max_size:
+            raise RequestEntityTooLarge(f'Uploaded file exceeds {max_size // (1024 * 1024)} MB')
+        discard = ext not in _IMAGE_EXTENSIONS | _AUDIO_EXTENSIONS | _DATA_EXTENSIONS
+        spool = UploadSpool(INCOMING_FOLDER, max_size, discard=discard, sniff=ext not in _DATA_EXTENSIONS)
+        # A part aborted mid-parse never reaches request.files, so track every
+        # spool here to be sure its temp file is removed
+        self.__dict__.setdefault('_spools', []).append(spool)
+        return spool
+
+    def close(self):
+        super().close()
+        for spool in self.__dict__.pop('_spools', ()):
+            spool.close()
+
+
+def upload_kind(file):
+    """Magic-byte type of an uploaded FileStorage, or None if unusable"""
+    return getattr(file.stream, 'kind', None)
+
+
+def spooled_path(file):
+    """Path of an upload's spooled temp file, removed when the request ends, or None if not kept"""
+    stream = file.stream
+    if not isinstance(stream, UploadSpool) or stream.path is None:
+        return None
+    stream.flush()
+    return stream.path
+
+
+def store_upload(file, kind):
+    """
+    Move an uploaded file into the asset store
+
+    Returns:
+        The asset id (content digest), holding one reference, or None if
+        the part was not kept
+    """
+    os.makedirs(INCOMING_FOLDER, exist_ok=True)
+    temp_path = os.path.join(INCOMING_FOLDER, f".claimed_{uuid.uuid4().hex}")
+    with metrics.timed('render_stage_seconds', stage='upload_save'):
+        digest = save_upload(file, temp_path)
+        if digest is None:
+            return None
+        return asset_store.put(temp_path, digest, kind)
+
+
+def save_upload(file, dest_path):
+    """
+    Move an uploaded file to dest_path without copying it
+
+    Returns:
+        SHA-256 hex digest of the file, or None if the part was not kept
+    """
+    stream = file.stream
+    if not isinstance(stream, UploadSpool):
+        file.save(dest_path)
+        return file_digest(dest_path)
+    if not stream.claim(dest_path):
+        return None
+    return stream.digest
@@ -1,70 +1,224 @@
 
-from moviepy import ImageClip, TextClip, CompositeVideoClip, concatenate_videoclips, AudioFileClip
 from PIL import Image, ImageDraw, ImageFont
 import numpy as np
+import functools
 import os
 
-def create_text_clip(text, duration, size=(1280, 720), fontsize=60, color='white', bg_color=(0, 0, 0)):
-    img = Image.new('RGB', size, color=bg_color)
-    draw = ImageDraw.Draw(img)
-    
+DEFAULT_FONT_PATH = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
+
+@functools.lru_cache(maxsize=32)
+def load_font(fontsize, font_path=DEFAULT_FONT_PATH):
     try:
-        font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", fontsize)
+        return ImageFont.truetype(font_path, fontsize)
     except:
-        font = ImageFont.load_default()
-    
-    bbox = draw.textbbox((0, 0), text, font=font)
-    text_width = bbox[2] - bbox[0]
-    text_height = bbox[3] - bbox[1]
-    
-    position = ((size[0] - text_width) // 2, (size[1] - text_height) // 2)
-    draw.text(position, text, fill=color, font=font)
-    
-    temp_path = f"uploads/temp_text_{hash(text)}.png"
-    img.save(temp_path)
-    
-    clip = ImageClip(temp_path, duration=duration)
-    return clip
-
-def apply_fade_in(clip, duration=1):
-    return clip.fadein(duration)
-
-def apply_fade_out(clip, duration=1):
-    return clip.fadeout(duration)
-
-def apply_zoom_effect(clip, zoom_factor=1.5):
-    def zoom(t):
-        scale = 1 + (zoom_factor - 1) * (t / clip.duration)
-        return clip.resized(scale).with_position('center')
-    
-    return clip.fl(lambda gf, t: zoom(t).get_frame(t), apply_to=[])
-
-def apply_slide_effect(clip, direction='right'):
-    w, h = clip.size
-    
-    if direction == 'right':
-        return clip.with_position(lambda t: (int(-w + w * t / clip.duration), 'center'))
-    elif direction == 'left':
-        return clip.with_position(lambda t: (int(w - w * t / clip.duration), 'center'))
-    elif direction == 'down':
-        return clip.with_position(lambda t: ('center', int(-h + h * t / clip.duration)))
+        return ImageFont.load_default()
+
+@functools.lru_cache(maxsize=256)
+def render_text(text, fontsize=60, color='white', font_path=DEFAULT_FONT_PATH):
+    """
+    Rasterize text into an RGBA array cropped to its bounding box
+
+    Results are memoized per (text, size, color, font) and returned
+    read-only, so every render in the process shares one copy.
+    """
+    font = load_font(fontsize, font_path)
+    bbox = font.getbbox(text)
+    width = max(bbox[2] - bbox[0], 1)
+    height = max(bbox[3] - bbox[1], 1)
+
+    img = Image.new('RGBA', (width, height), color=(0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    draw.text((-bbox[0], -bbox[1]), text, fill=color, font=font)
+
+    pixels = np.asarray(img)
+    pixels.flags.writeable = False
+    return pixels
+
+# Transition and effect names used by templates.py
+EFFECT_NAMES = ('fadein', 'fadeout', 'zoom', 'slide', 'crossfade', 'disintegrate', 'reintegrate')
+
+FADE_DURATION = 0.5
+TEXT_FADE_DURATION = 0.3
+SLIDE_DURATION = 0.6
+CROSSFADE_DURATION = 0.5
+DISSOLVE_DURATION = 1.0
+ZOOM_FACTOR = 1.15
+
+# Cost budget per effect instance: the most distinct frames it may render.
+# Frames between steps repeat the previous step, so an effect never costs
+# more composites than this however long it runs.
+EFFECT_BUDGETS = {
+    'fadein': 8,
+    'fadeout': 8,
+    'crossfade': 8,
+    'slide': 12,
+    'disintegrate': 12,
+    'reintegrate': 12,
+    'zoom': 24,
+}
+
+class LayerState:
+    """How a layer is drawn at one point in time"""
+
+    __slots__ = ('opacity', 'scale', 'dx', 'dy', 'dissolve')
+
+    def __init__(self):
+        self.opacity = 1.0
+        self.scale = 1.0
+        self.dx = 0
+        self.dy = 0
+        self.dissolve = 0.0
+
+    @property
+    def is_identity(self):
+        return (self.opacity >= 1.0 and self.scale == 1.0 and self.dx == 0
+                and self.dy == 0 and self.dissolve <= 0.0)
+
+class Effect:
+    """
+    An animation applied to a layer between start and end
+
+    Args:
+        name: One of EFFECT_NAMES
+        start: Absolute start time in seconds
+        end: Absolute end time in seconds
+        steps: Number of distinct states rendered across the span
+        distance: Travel in pixels for 'slide'
+    """
+
+    def __init__(self, name, start, end, steps, distance=0):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.steps = max(int(steps), 1)
+        self.distance = distance
+
+    def step_times(self):
+        """Boundaries between the effect's constant steps"""
+        span = self.end - self.start
+        return [self.start + span * i / self.steps for i in range(1, self.steps)]
+
+    def apply(self, state, t):
+        """Fold this effect's contribution at time t into state"""
+        p = min(max((t - self.start) / (self.end - self.start), 0.0), 1.0)
+        if self.name in ('fadein', 'crossfade'):
+            state.opacity *= p
+        elif self.name == 'fadeout':
+            state.opacity *= 1.0 - p
+        elif self.name == 'zoom':
+            state.scale *= 1.0 + (ZOOM_FACTOR - 1.0) * p
+        elif self.name == 'slide':
+            # Ease out so the layer settles into place
+            state.dx += int(round(self.distance * (1.0 - p) ** 2))
+        elif self.name == 'disintegrate':
+            state.dissolve = max(state.dissolve, p)
+        elif self.name == 'reintegrate':
+            state.dissolve = max(state.dissolve, 1.0 - p)
+
+def _effect(name, start, end, fps, quality, distance=0):
+    # Never spend more steps than there are frames in the span
+    frames = max(int((end - start) * fps), 1)
+    steps = min(frames, max(int(EFFECT_BUDGETS[name] * quality), 1))
+    return Effect(name, start, end, steps, distance)
+
+def build_layer_effects(names, start, end, frame_size, fps, quality=1.0, crossfade_in=0.0):
+    """
+    Schedule the named transitions/effects for a layer shown from start to end
+
+    Args:
+        names: Iterable of effect names from a template; unknown names are ignored
+        start: Layer start time in seconds
+        end: Layer end time in seconds
+        frame_size: (width, height) of the video, used for slide distance
+        fps: Output frame rate
+        quality: Multiplier on EFFECT_BUDGETS (lower for previews)
+        crossfade_in: Seconds this layer overlaps the previous one
+
+    Returns:
+        list of Effect
+    """
+    names = set(names)
+    span = end - start
+    # Entry and exit animations share the layer, so each gets at most half
+    half = span / 2
+    effects = []
+
+    if crossfade_in > 0:
+        effects.append(_effect('crossfade', start, start + min(crossfade_in, half), fps, quality))
+    elif 'fadein' in names:
+        effects.append(_effect('fadein', start, start + min(FADE_DURATION, half), fps, quality))
+    if 'reintegrate' in names:
+        effects.append(_effect('reintegrate', start, start + min(DISSOLVE_DURATION, half), fps, quality))
+    if 'slide' in names:
+        effects.append(_effect('slide', start, start + min(SLIDE_DURATION, half), fps, quality,
+                               distance=frame_size[0] // 2))
+
+    if 'fadeout' in names:
+        effects.append(_effect('fadeout', end - min(FADE_DURATION, half), end, fps, quality))
+    if 'disintegrate' in names:
+        effects.append(_effect('disintegrate', end - min(DISSOLVE_DURATION, half), end, fps, quality))
+
+    if 'zoom' in names:
+        effects.append(_effect('zoom', start, end, fps, quality))
+    return effects
+
+def build_text_effects(names, start, end, fps, quality=1.0):
+    """Text overlays only pick up the template's fades, kept short so text stays legible"""
+    names = set(names)
+    half = (end - start) / 2
+    effects = []
+    if 'fadein' in names:
+        effects.append(_effect('fadein', start, start + min(TEXT_FADE_DURATION, half), fps, quality))
+    if 'fadeout' in names:
+        effects.append(_effect('fadeout', end - min(TEXT_FADE_DURATION, half), end, fps, quality))
+    return effects
+
+@functools.lru_cache(maxsize=64)
+def dissolve_noise(shape, seed=0):
+    """Fixed per-pixel thresholds so a dissolve removes the same pixels in a stable order"""
+    pixels = np.random.default_rng(seed).integers(0, 255, size=shape, dtype=np.uint8)
+    pixels.flags.writeable = False
+    return pixels
+
+BACKGROUND_STYLES = ('solid', 'linear', 'radial')
+
+@functools.lru_cache(maxsize=32)
+def create_background_array(size=(1280, 720), style='solid', color=(30, 60, 114), end_color=None, angle=90):
+    """
+    Build a background frame as a read-only HxWx3 uint8 array
+
+    Args:
+        size: (width, height) of the frame
+        style: 'solid', 'linear' (gradient along angle) or 'radial' (center outwards)
+        color: Start color as an RGB tuple
+        end_color: Gradient end color; defaults to a darker shade of color
+        angle: Direction of a linear gradient in degrees, 90 being top to bottom
+
+    The array is memoized, so every frame of a render and every render in
+    the worker with the same colours share a single buffer.
+    """
+    width, height = size
+    start = np.array(color, dtype=np.float32)
+    if style == 'solid':
+        pixels = np.empty((height, width, 3), dtype=np.uint8)
+        pixels[...] = color
+        pixels.flags.writeable = False
+        return pixels
+
+    end = np.array(end_color if end_color is not None else tuple(int(c * 0.35) for c in color),
+                   dtype=np.float32)
+    ys, xs = np.mgrid[0:height, 0:width].astype(np.float32)
+    if style == 'radial':
+        cx, cy = (width - 1) / 2, (height - 1) / 2
+        t = np.hypot(xs - cx, ys - cy) / np.hypot(cx, cy)
+    elif style == 'linear':
+        theta = np.deg2rad(angle)
+        projection = xs * np.cos(theta) + ys * np.sin(theta)
+        t = (projection - projection.min()) / max(np.ptp(projection), 1e-6)
     else:
-        return clip.with_position(lambda t: ('center', int(h - h * t / clip.duration)))
-
-def apply_disintegrate_effect(image_path, duration=3, size=(1280, 720)):
-    clip = ImageClip(image_path).with_duration(duration).resized(size)
-    clip = clip.fadeout(duration * 0.8)
-    return clip
-
-def apply_reintegrate_effect(image_path, duration=3, size=(1280, 720)):
-    clip = ImageClip(image_path).with_duration(duration).resized(size)
-    clip = clip.fadein(duration * 0.8)
-    return clip
-
-def create_background_clip(duration, size=(1280, 720), color=(30, 60, 114)):
-    img = Image.new('RGB', size, color=color)
-    temp_path = f"uploads/temp_bg_{hash(str(color))}.png"
-    img.save(temp_path)
-    
-    clip = ImageClip(temp_path, duration=duration)
-    return clip
+        raise ValueError(f"Unknown background style: {style}")
+
+    t = np.clip(t, 0, 1)[..., None]
+    pixels = (start + (end - start) * t + 0.5).astype(np.uint8)
+    pixels.flags.writeable = False
+    return pixels
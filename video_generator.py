@@ -1,47 +1,310 @@
-
-from moviepy import ImageClip, TextClip, CompositeVideoClip, concatenate_videoclips, AudioFileClip, ColorClip, concatenate_audioclips
-from PIL import Image, ImageDraw, ImageFont
+from moviepy.config import FFMPEG_BINARY
+from PIL import Image
 import numpy as np
+import errno
+import functools
+import io
 import os
-from video_effects import (
-    create_text_clip, apply_fade_in, apply_fade_out, 
-    create_background_clip, apply_disintegrate_effect, apply_reintegrate_effect
-)
-
-def generate_video(template, images, text_overlays, audio_file, output_path, background_color=None):
-    video_size = (1280, 720)
-    duration = template['duration']
-    bg_color = background_color if background_color is not None else template.get('bg_color', (30, 60, 114))
+import shutil
+import subprocess
+import tempfile
+import asset_store
+import metrics
+from asset_store import AssetNotFound
+from audio_prep import prepare_audio, AudioPrepError
+from compositor import Compositor, Layer
+from image_ingest import fit_size, display_image, ingest_image
+from video_effects import render_text, create_background_array, build_layer_effects, build_text_effects
+
+VIDEO_SIZE = (1280, 720)
+VIDEO_FPS = 24
+TEXT_FONT_SIZE = 50
+
+# Encoder settings selectable per request. 'tune': 'auto' picks stillimage
+# when no layer is animated; 'effect_quality' scales the effect budgets;
+# 'scale' and 'fps' shrink the output for quick previews.
+RENDER_PROFILES = {
+    'preview': {'preset': 'ultrafast', 'crf': 30, 'tune': 'auto', 'threads': 0, 'effect_quality': 0.5,
+                'scale': 0.5, 'fps': 12},
+    'fast': {'preset': 'veryfast', 'crf': 23, 'tune': 'auto', 'threads': 0, 'effect_quality': 1.0},
+    'final': {'preset': 'medium', 'crf': 20, 'tune': 'auto', 'threads': 0, 'effect_quality': 1.0},
+}
+DEFAULT_RENDER_PROFILE = 'final'
+
+# Delivery formats: frame size, frame rate and an optional peak video
+# bitrate in kbit/s (CRF still decides quality below the cap). Templates are
+# designed for landscape; other aspects re-lay out the same timeline.
+OUTPUT_FORMATS = {
+    'landscape': {'size': (1280, 720), 'fps': 24},
+    'landscape_hd': {'size': (1920, 1080), 'fps': 24, 'max_bitrate': 8000},
+    'story': {'size': (1080, 1920), 'fps': 30, 'max_bitrate': 6000},
+    'square': {'size': (1080, 1080), 'fps': 30, 'max_bitrate': 5000},
+}
+DEFAULT_OUTPUT_FORMAT = 'landscape'
+
+# Cap libx264 threads per render; with several render workers sharing the
+# machine, one encoder per worker grabbing every core just thrashes.
+ENCODER_THREADS = int(os.environ.get('ENCODER_THREADS', 0))
+
+
+# Fragmented MP4 layout for renders streamed while encoding: the moov box is
+# written first and empty, then each fragment is self-contained.
+STREAM_MOVFLAGS = 'frag_keyframe+empty_moov+default_base_moof'
+
+
+class EncoderError(Exception):
+    pass
+
+
+class FFmpegEncoder:
+    """
+    Streams raw RGB frames over a pipe into a single ffmpeg process
+
+    Args:
+        output_path: Path of the MP4 to write
+        size: (width, height) of the frames
+        fps: Frame rate
+        profile: Entry from RENDER_PROFILES
+        duration: Output duration in seconds
+        audio_file: Optional audio track, looped or trimmed to duration
+        tune: x264 tune to apply, or None
+        copy_audio: Stream-copy the audio instead of encoding it to AAC;
+            only valid for tracks produced by audio_prep
+        fragmented: Write a fragmented MP4 with a keyframe (and so a new
+            fragment) every second, playable while it is still being written
+        max_bitrate: Peak video bitrate in kbit/s, or None for plain CRF
+    """
+
+    def __init__(self, output_path, size, fps, profile, duration, audio_file=None, tune=None, copy_audio=False,
+                 fragmented=False, max_bitrate=None):
+        threads = profile.get('threads') or ENCODER_THREADS
+        cmd = [
+            FFMPEG_BINARY, '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+            '-s', f'{size[0]}x{size[1]}', '-r', str(fps),
+            '-i', '-',
+        ]
+        if audio_file:
+            cmd += ['-stream_loop', '-1', '-i', audio_file]
+        cmd += ['-map', '0:v']
+        if audio_file and copy_audio:
+            cmd += ['-map', '1:a', '-c:a', 'copy']
+        elif audio_file:
+            cmd += ['-map', '1:a', '-c:a', 'aac', '-b:a', '192k']
+        cmd += [
+            '-c:v', 'libx264',
+            '-preset', profile['preset'],
+            '-crf', str(profile['crf']),
+            '-pix_fmt', 'yuv420p',
+            '-threads', str(threads),
+        ]
+        if max_bitrate:
+            cmd += ['-maxrate', f'{max_bitrate}k', '-bufsize', f'{max_bitrate * 2}k']
+        if tune:
+            cmd += ['-tune', tune]
+        if fragmented:
+            cmd += ['-g', str(fps), '-movflags', STREAM_MOVFLAGS]
+        else:
+            cmd += ['-movflags', '+faststart']
+        cmd += ['-t', f'{duration:.3f}', output_path]
+
+        self.frame_size = size
+        self._stderr = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=self._stderr)
+
+    def write(self, frame, count=1):
+        """Write the same frame count times"""
+        data = memoryview(np.ascontiguousarray(frame)).cast('B')
+        try:
+            for _ in range(count):
+                self._process.stdin.write(data)
+        except BrokenPipeError:
+            self._process.wait()
+            raise EncoderError(self._read_stderr())
+
+    def close(self):
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = self._process.wait()
+        error = self._read_stderr() if returncode != 0 else None
+        self._stderr.close()
+        if returncode != 0:
+            raise EncoderError(error)
+
+    def abort(self):
+        self._process.kill()
+        self._process.wait()
+        self._stderr.close()
+
+    def _read_stderr(self):
+        self._stderr.seek(0)
+        return self._stderr.read().decode('utf-8', 'replace').strip() or 'ffmpeg exited with an error'
+
+
+def encode_timeline(compositor, output_path, profile, audio_file=None, progress=None, copy_audio=False,
+                    fragmented=False, max_bitrate=None, stages=None):
+    """
+    Composite every segment once and stream its frames to ffmpeg
+
+    Time spent producing frames is recorded under the 'composite' stage and
+    time spent handing them to ffmpeg (blocked on the pipe while it
+    encodes) under 'encode'.
+    """
+    stages = stages or metrics.Stages()
+    tune = profile.get('tune')
+    if tune == 'auto':
+        tune = 'stillimage' if compositor.is_static else None
+
+    encoder = FFmpegEncoder(
+        output_path, compositor.size, compositor.fps, profile,
+        duration=compositor.duration, audio_file=audio_file, tune=tune,
+        copy_audio=copy_audio, fragmented=fragmented, max_bitrate=max_bitrate
+    )
+    total_frames = max(compositor.frame_count, 1)
+    written = 0
+    try:
+        segments = compositor.iter_segments()
+        while True:
+            with stages.stage('composite'):
+                segment = next(segments, None)
+            if segment is None:
+                break
+            frame, count = segment
+            with stages.stage('encode'):
+                encoder.write(frame, count)
+            written += count
+            if progress:
+                progress(written / total_frames)
+    except Exception:
+        encoder.abort()
+        raise
+    with stages.stage('encode'):
+        encoder.close()
+    metrics.inc('render_frames_encoded_total', written)
+
+
+def remux_faststart(src_path, dest_path):
+    """Rewrite a (fragmented) MP4 as a regular faststart MP4 without re-encoding"""
+    result = subprocess.run(
+        [FFMPEG_BINARY, '-y', '-loglevel', 'error', '-i', src_path,
+         '-map', '0', '-c', 'copy', '-movflags', '+faststart', dest_path],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    if result.returncode != 0:
+        raise EncoderError(result.stderr.decode('utf-8', 'replace').strip() or 'ffmpeg could not remux the video')
+
+
+def _default_scratch_dir():
+    # Prefer tmpfs so scratch files never touch the uploads volume
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return None
+
+
+RENDER_SCRATCH_DIR = os.environ.get('RENDER_SCRATCH_DIR') or _default_scratch_dir()
+
+
+def render_workspace():
+    """Private scratch directory for one render, removed with everything in it on exit"""
+    return tempfile.TemporaryDirectory(prefix='render_', dir=RENDER_SCRATCH_DIR)
+
+
+def publish_file(src_path, dest_path):
+    """
+    Move a finished file into place atomically
+
+    When the scratch directory is on another filesystem the file is first
+    copied next to the destination under a hidden name, so readers of
+    dest_path only ever see a complete file.
+    """
+    try:
+        os.replace(src_path, dest_path)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    dest_dir, dest_name = os.path.split(dest_path)
+    partial_path = os.path.join(dest_dir, f".{os.getpid()}.{dest_name}")
+    try:
+        shutil.copyfile(src_path, partial_path)
+        os.replace(partial_path, dest_path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+
+@functools.lru_cache(maxsize=32)
+def load_image_array(img_path, video_size):
+    """
+    Load an image at the size it is shown on screen, as an RGBA array
+
+    Display images are content-addressed, so a path always holds the same
+    pixels and batch renders in one worker decode each image once. The
+    array is shared between renders and therefore read-only.
+    """
+    with Image.open(img_path) as img:
+        target_size = fit_size(img.width, img.height, video_size)
+        img = img.convert('RGBA')
+        # Ingested uploads are already stored at their on-screen size
+        if img.size != target_size:
+            img = img.resize(target_size, Image.LANCZOS)
+        pixels = np.asarray(img)
+    pixels.flags.writeable = False
+    return pixels
+
+
+def build_compositor(template, images, text_overlays, video_size=VIDEO_SIZE, fps=VIDEO_FPS,
+                     background_color=None, background_style=None, effect_quality=1.0, stages=None):
+    """
+    Lay out a template's background, images and text overlays as a Compositor
+
+    Args:
+        template: CompiledTemplate from template_registry
+        images: Paths of the uploaded images, one per slot
+        text_overlays: list of dicts with 'text', 'start' and 'duration'
+        video_size: (width, height) to lay the template out at
+        fps: Frame rate the timeline is cut at
+        background_color: RGB tuple overriding the template's bg_color
+        background_style: 'solid', 'linear' or 'radial'
+        effect_quality: Multiplier on the effect budgets
+        stages: metrics.Stages collecting image decode and text timings
+
+    Returns:
+        Compositor
+    """
+    stages = stages or metrics.Stages()
+    duration = template.duration
+    bg_color = background_color if background_color is not None else template.bg_color
+    effect_names = template.effect_names
+    # Text is designed at 50px on a 1280x720 frame; other aspects scale by
+    # the tighter dimension so lines still fit across a portrait frame
+    scale = min(video_size[0] / VIDEO_SIZE[0], video_size[1] / VIDEO_SIZE[1])
+    fontsize = max(int(round(TEXT_FONT_SIZE * scale)), 8)
     
-    background = create_background_clip(duration, video_size, bg_color)
+    background = create_background_array(
+        video_size,
+        background_style or template.bg_style,
+        tuple(bg_color),
+        template.bg_color_end
+    )
     
-    clips = [background]
+    layers = []
     
-    if images:
-        images_per_slot = len(images)
-        slot_duration = duration / max(images_per_slot, 1)
-        
-        for i, img_path in enumerate(images):
-            start_time = i * slot_duration
-            img_duration = min(slot_duration, duration - start_time)
-            
-            if img_duration <= 0:
-                continue
-            
-            try:
-                img_clip = ImageClip(img_path)
-                img_clip = img_clip.with_duration(img_duration)
-                img_clip = img_clip.resized(height=video_size[1] * 0.6)
-                
-                if img_clip.w > video_size[0]:
-                    img_clip = img_clip.resized(width=video_size[0] * 0.8)
-                
-                img_clip = img_clip.with_position('center').with_start(start_time)
-                
-                clips.append(img_clip)
-            except Exception as e:
-                print(f"Error processing image {img_path}: {e}")
-                continue
+    for img_path, span in zip(images, template.spans_for(len(images))):
+        try:
+            with stages.stage('image_decode'):
+                pixels = load_image_array(img_path, video_size)
+            effects = build_layer_effects(
+                effect_names, span.start, span.end, video_size, fps,
+                quality=effect_quality, crossfade_in=span.crossfade_in
+            )
+            layers.append(Layer(pixels, span.start, span.end, effects=effects))
+        except Exception as e:
+            print(f"Error processing image {img_path}: {e}")
+            continue
     
     for overlay in text_overlays:
         try:
@@ -55,65 +318,183 @@ def generate_video(template, images, text_overlays, audio_file, output_path, bac
             if text_duration <= 0:
                 continue
             
-            text_clip = create_text_clip(
-                text, 
-                text_duration, 
-                size=video_size,
-                fontsize=50,
-                color='white',
-                bg_color=(0, 0, 0, 0)
-            )
-            
-            text_clip = text_clip.with_position('center').with_start(start)
-            
-            clips.append(text_clip)
+            with stages.stage('text_raster'):
+                pixels = render_text(text, fontsize=fontsize, color='white')
+            effects = build_text_effects(effect_names, start, start + text_duration, fps, quality=effect_quality)
+            layers.append(Layer(pixels, start, start + text_duration, effects=effects))
         except Exception as e:
             print(f"Error creating text overlay: {e}")
             continue
     
+    return Compositor(video_size, background, layers, duration, fps)
+
+
+def profile_video_size(profile, output_format=DEFAULT_OUTPUT_FORMAT):
+    """Output (width, height) for a render profile and format, kept even for yuv420p"""
+    scale = profile.get('scale', 1.0)
+    size = OUTPUT_FORMATS[output_format]['size']
+    return tuple(max(int(round(dimension * scale / 2)) * 2, 2) for dimension in size)
+
+
+def profile_fps(profile, output_format=DEFAULT_OUTPUT_FORMAT):
+    """Frame rate for a render profile and format; preview profiles only ever lower it"""
+    fps = OUTPUT_FORMATS[output_format]['fps']
+    return min(profile.get('fps', fps), fps)
+
+
+def resolve_images(image_assets, video_size):
+    """Normalized image paths for a frame size, skipping assets that can't be loaded"""
+    images = []
+    for asset_id in image_assets:
+        try:
+            images.append(display_image(asset_id, video_size))
+        except Exception as e:
+            print(f"Error loading image asset {asset_id}: {e}")
+    return images
+
+
+def render_keyframes(template, image_files, text_overlays, background_color=None, background_style=None,
+                     width=480, max_frames=8, quality=75, output_format=DEFAULT_OUTPUT_FORMAT):
+    """
+    Render a strip of still JPEG keyframes sampled from the template timeline
+
+    Frames are taken at max_frames evenly spaced times and composited
+    directly from the timeline, so nothing is encoded. image_files are paths
+    of the uploaded images, one per image slot; each is decoded once,
+    straight at the keyframe size, into a scratch directory rather than the
+    asset store. Frames have output_format's aspect.
+
+    Returns:
+        list of dicts with 'time' (seconds) and 'jpeg' (bytes)
+    """
+    format_width, format_height = OUTPUT_FORMATS[output_format]['size']
+    height = max(int(round(width * format_height / format_width / 2)) * 2, 2)
+    workspace_dir = render_workspace()
     try:
-        final_video = CompositeVideoClip(clips, size=video_size)
-        final_video = final_video.with_duration(duration)
-        
-        audio = None
-        if audio_file and os.path.exists(audio_file):
+        images = []
+        for index, image_file in enumerate(image_files):
+            image_path = os.path.join(workspace_dir.name, f'{index}.png')
             try:
-                audio = AudioFileClip(audio_file)
-                if audio.duration > duration:
-                    audio = audio.subclipped(0, duration)
-                elif audio.duration < duration:
-                    loops = int(duration / audio.duration) + 1
-                    audio = concatenate_audioclips([audio] * loops).subclipped(0, duration)
-                
-                final_video = final_video.with_audio(audio)
+                ingest_image(image_file, image_path, (width, height))
             except Exception as e:
-                print(f"Error adding audio: {e}")
-        
-        final_video.write_videofile(
-            output_path,
-            fps=24,
-            codec='libx264',
-            audio_codec='aac',
-            temp_audiofile='uploads/temp-audio.m4a',
-            remove_temp=True,
-            logger=None
+                print(f"Error loading image {image_file}: {e}")
+                continue
+            images.append(image_path)
+        compositor = build_compositor(
+            template, images, text_overlays, video_size=(width, height), fps=VIDEO_FPS,
+            background_color=background_color, background_style=background_style, effect_quality=0.25
         )
-        
-        for clip in clips:
-            clip.close()
-        if audio is not None:
+    finally:
+        workspace_dir.cleanup()
+
+    keyframes = []
+    for i in range(max_frames):
+        t = round((i + 0.5) * compositor.duration / max_frames, 3)
+        buffer = io.BytesIO()
+        Image.fromarray(compositor.frame_at(t)).save(buffer, format='JPEG', quality=quality)
+        keyframes.append({'time': t, 'jpeg': buffer.getvalue()})
+    return keyframes
+
+
+def generate_video(template, image_assets, text_overlays, audio_asset, output_path, background_color=None, progress=None, render_profile=DEFAULT_RENDER_PROFILE, background_style=None, stream_path=None, output_format=DEFAULT_OUTPUT_FORMAT, extra_outputs=None):
+    """
+    Render a template to output_path, and optionally to further formats
+
+    Every format is laid out from the same template timeline and composited
+    at its own size, which only costs its distinct frames (scaling a single
+    composite inside ffmpeg would process every output frame). The prepared
+    audio track is shared, and decoded images and text rasters come from the
+    per-process caches, so formats of the same width rasterize text once.
+
+    Args:
+        template: CompiledTemplate from template_registry
+        image_assets: Asset store ids of the uploaded images, one per slot
+        text_overlays: list of dicts with 'text', 'start' and 'duration'
+        audio_asset: Asset store id of the background music, or None
+        output_path: Where the finished MP4 is published
+        background_color: RGB tuple overriding the template's bg_color
+        progress: Optional callable receiving the fraction encoded
+        render_profile: Key of RENDER_PROFILES
+        background_style: 'solid', 'linear' or 'radial'
+        stream_path: If given, encode a fragmented MP4 here first so it can be
+            played while the render runs; the published output is remuxed
+            from it into a regular seekable MP4
+        output_format: Key of OUTPUT_FORMATS for output_path (and stream_path)
+        extra_outputs: {output format: path} of further formats to publish
+
+    Raises:
+        AudioPrepError: if audio_asset is given but cannot be prepared
+        EncoderError: if ffmpeg fails; nothing is published without the
+            requested music
+    """
+    profile = RENDER_PROFILES.get(render_profile, RENDER_PROFILES[DEFAULT_RENDER_PROFILE])
+    outputs = {output_format: output_path}
+    outputs.update(extra_outputs or {})
+    stages = metrics.Stages()
+
+    try:
+        compositors = {}
+        for name in outputs:
+            video_size = profile_video_size(profile, name)
+            with stages.stage('image_decode'):
+                images = resolve_images(image_assets, video_size)
+            compositors[name] = build_compositor(
+                template, images, text_overlays,
+                video_size=video_size,
+                fps=profile_fps(profile, name),
+                background_color=background_color,
+                background_style=background_style,
+                effect_quality=profile.get('effect_quality', 1.0),
+                stages=stages
+            )
+        total_frames = sum(max(compositor.frame_count, 1) for compositor in compositors.values())
+
+        audio_file = None
+        copy_audio = False
+        if audio_asset:
             try:
-                audio.close()
-            except:
-                pass
+                with stages.stage('audio_prep'):
+                    audio_file = prepare_audio(asset_store.resolve(audio_asset), digest=audio_asset)
+                copy_audio = True
+            except (AudioPrepError, AssetNotFound) as e:
+                # The render's cache key includes the music, so a silent
+                # video must never be published under it
+                raise AudioPrepError(f"Background music could not be used: {e}") from e
         
-        temp_files = [f for f in os.listdir('uploads') if f.startswith('temp_')]
-        for temp_file in temp_files:
-            try:
-                os.remove(os.path.join('uploads', temp_file))
-            except:
-                pass
+        # Each render gets a private scratch directory, so concurrent renders
+        # never share temp filenames and cleanup never scans uploads/
+        workspace_dir = render_workspace()
+        try:
+            workspace = workspace_dir.name
+            frames_done = 0
+            for name, compositor in compositors.items():
+                format_progress = None
+                if progress:
+                    offset = frames_done / total_frames
+                    share = max(compositor.frame_count, 1) / total_frames
+                    format_progress = lambda fraction, offset=offset, share=share: progress(offset + fraction * share)
+                encode_options = dict(
+                    progress=format_progress, max_bitrate=OUTPUT_FORMATS[name].get('max_bitrate'), stages=stages
+                )
+                scratch_path = os.path.join(workspace, f'{name}.mp4')
+                if stream_path and name == output_format:
+                    encode_timeline(compositor, stream_path, profile, audio_file=audio_file,
+                                    copy_audio=copy_audio, fragmented=True, **encode_options)
+                    with stages.stage('encode'):
+                        remux_faststart(stream_path, scratch_path)
+                else:
+                    encode_timeline(compositor, scratch_path, profile, audio_file=audio_file,
+                                    copy_audio=copy_audio, **encode_options)
+                frames_done += max(compositor.frame_count, 1)
+                with stages.stage('publish'):
+                    metrics.inc('render_output_bytes_total', os.path.getsize(scratch_path), output_format=name)
+                    publish_file(scratch_path, outputs[name])
+        finally:
+            with stages.stage('cleanup'):
+                workspace_dir.cleanup()
                 
     except Exception as e:
         print(f"Error generating final video: {e}")
         raise
+    finally:
+        stages.observe()